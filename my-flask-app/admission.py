@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Admission control לקריאות LLM
+#
+# שתי תקרות:
+#   - per-process: מספר קריאות LLM במקביל בתוך worker אחד
+#   - global (host): slots משותפים לכל ה-workers דרך flock על קבצים
+#     ב-ADMISSION_DIR (נעילה משתחררת אוטומטית אם ה-worker מת)
+#
+# בקשה שאין לה slot ממתינה בתור עד queue_timeout_sec; אם התור מלא
+# או שהזמן עבר – AdmissionRejected (ה-view מחזיר 503 + Retry-After).
+# עוטפים רק את קריאת ה-LLM, כך ש-cache hits ועמודים רגילים לא נחסמים.
+#
+# שינוי בזמן ריצה: update_settings() כותב overrides ל-settings.json
+# בתיקייה, וכל worker טוען אותו מחדש כשה-mtime משתנה.
+# ===================================================================
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time as pytime
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows – אין תקרה גלובלית
+    fcntl = None
+
+from metrics import ADMISSION_TOTAL, ADMISSION_WAIT
+
+ADMISSION_DIR = os.environ.get("ADMISSION_DIR") or os.path.join(tempfile.gettempdir(), "car_admission")
+POLL_INTERVAL_SEC = 0.05
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "per_process": int(os.environ.get("LLM_MAX_INFLIGHT_PER_PROCESS", 4)),
+    "global": int(os.environ.get("LLM_MAX_INFLIGHT_GLOBAL", 8)),  # 0 = ללא תקרה גלובלית
+    "max_queue": int(os.environ.get("LLM_ADMISSION_MAX_QUEUE", 16)),
+    "queue_timeout_sec": float(os.environ.get("LLM_ADMISSION_QUEUE_TIMEOUT_SEC", 20)),
+    "retry_after_sec": int(os.environ.get("LLM_ADMISSION_RETRY_AFTER_SEC", 15)),
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, directory: str = ADMISSION_DIR):
+        self.directory = directory
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+        self._settings_path = os.path.join(directory, "settings.json")
+        self._settings_mtime = 0.0
+        self._settings_checked = 0.0
+
+    # ---- settings ----
+    def _refresh_settings(self) -> None:
+        now = pytime.monotonic()
+        if now - self._settings_checked < 1.0:
+            return
+        self._settings_checked = now
+        try:
+            mtime = os.path.getmtime(self._settings_path)
+        except OSError:
+            return
+        if mtime == self._settings_mtime:
+            return
+        try:
+            with open(self._settings_path, encoding="utf-8") as f:
+                overrides = json.load(f)
+        except Exception as e:
+            print(f"[ADMISSION] ⚠️ failed to read settings: {e}")
+            return
+        self._settings_mtime = mtime
+        self.settings = {**DEFAULT_SETTINGS, **{k: v for k, v in overrides.items() if k in DEFAULT_SETTINGS}}
+        print(f"[ADMISSION] settings reloaded: {self.settings}")
+
+    def update_settings(self, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """מעדכן ושומר overrides לכל ה-workers. זורק ValueError על ערכים לא תקינים."""
+        unknown = set(changes) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise ValueError(f"unknown settings: {sorted(unknown)}")
+        new_settings = dict(self.settings)
+        for key, value in changes.items():
+            value = type(DEFAULT_SETTINGS[key])(value)
+            if value < 0:
+                raise ValueError(f"{key} must be >= 0")
+            new_settings[key] = value
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._settings_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({k: v for k, v in new_settings.items() if v != DEFAULT_SETTINGS[k]}, f)
+        os.replace(tmp, self._settings_path)
+        with self._cond:
+            self.settings = new_settings
+            self._settings_mtime = os.path.getmtime(self._settings_path)
+            self._cond.notify_all()
+        return dict(new_settings)
+
+    # ---- global slots ----
+    def _try_global_slot(self) -> Optional[int]:
+        """מחזיר fd נעול של slot פנוי, -1 אם אין תקרה גלובלית, או None אם הכל תפוס."""
+        limit = self.settings["global"]
+        if not limit or fcntl is None:
+            return -1
+        os.makedirs(self.directory, exist_ok=True)
+        for i in range(limit):
+            fd = os.open(os.path.join(self.directory, f"slot-{i}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    def global_in_flight(self) -> int:
+        """כמה slots גלובליים תפוסים כרגע (בדיקה לא חוסמת)."""
+        limit = self.settings["global"]
+        if not limit or fcntl is None or not os.path.isdir(self.directory):
+            return 0
+        busy = 0
+        for i in range(limit):
+            path = os.path.join(self.directory, f"slot-{i}.lock")
+            if not os.path.exists(path):
+                continue
+            fd = os.open(path, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            except OSError:
+                busy += 1
+            finally:
+                os.close(fd)
+        return busy
+
+    # ---- acquire / release ----
+    def _try_enter(self) -> Optional[int]:
+        # נקרא תחת self._cond
+        if self.settings["per_process"] and self.in_flight >= self.settings["per_process"]:
+            return None
+        token = self._try_global_slot()
+        if token is not None:
+            self.in_flight += 1
+        return token
+
+    def _enter_queue(self, pipeline: str, max_wait: Optional[float]) -> float:
+        # נקרא תחת self._cond; מחזיר deadline (לא יותר מ-max_wait – ה-deadline של הבקשה)
+        wait = self.settings["queue_timeout_sec"]
+        if max_wait is not None:
+            wait = min(wait, max_wait)
+        if self.waiting >= self.settings["max_queue"] or wait <= 0:
+            ADMISSION_TOTAL.inc(pipeline=pipeline, outcome="rejected")
+            raise AdmissionRejected("queue full", self.settings["retry_after_sec"])
+        self.waiting += 1
+        return pytime.monotonic() + wait
+
+    def _timed_out(self, pipeline: str, t0: float) -> AdmissionRejected:
+        ADMISSION_TOTAL.inc(pipeline=pipeline, outcome="timeout")
+        ADMISSION_WAIT.observe(pytime.perf_counter() - t0, pipeline=pipeline)
+        return AdmissionRejected("queue timeout", self.settings["retry_after_sec"])
+
+    def _admitted(self, pipeline: str, t0: float, queued: bool) -> None:
+        ADMISSION_TOTAL.inc(pipeline=pipeline, outcome="queued" if queued else "admitted")
+        ADMISSION_WAIT.observe(pytime.perf_counter() - t0, pipeline=pipeline)
+
+    def acquire(self, pipeline: str, max_wait: Optional[float] = None) -> int:
+        t0 = pytime.perf_counter()
+        self._refresh_settings()
+        with self._cond:
+            token = self._try_enter()
+            if token is not None:
+                self._admitted(pipeline, t0, queued=False)
+                return token
+            deadline = self._enter_queue(pipeline, max_wait)
+            try:
+                while True:
+                    remaining = deadline - pytime.monotonic()
+                    if remaining <= 0:
+                        raise self._timed_out(pipeline, t0)
+                    # polling: slot גלובלי שמשתחרר ב-worker אחר לא מעיר אותנו
+                    self._cond.wait(min(remaining, POLL_INTERVAL_SEC))
+                    token = self._try_enter()
+                    if token is not None:
+                        self._admitted(pipeline, t0, queued=True)
+                        return token
+            finally:
+                self.waiting -= 1
+
+    async def aacquire(self, pipeline: str, max_wait: Optional[float] = None) -> int:
+        t0 = pytime.perf_counter()
+        self._refresh_settings()
+        with self._cond:
+            token = self._try_enter()
+            if token is not None:
+                self._admitted(pipeline, t0, queued=False)
+                return token
+            deadline = self._enter_queue(pipeline, max_wait)
+        try:
+            while True:
+                remaining = deadline - pytime.monotonic()
+                if remaining <= 0:
+                    raise self._timed_out(pipeline, t0)
+                await asyncio.sleep(min(remaining, POLL_INTERVAL_SEC))
+                with self._cond:
+                    token = self._try_enter()
+                if token is not None:
+                    self._admitted(pipeline, t0, queued=True)
+                    return token
+        finally:
+            with self._cond:
+                self.waiting -= 1
+
+    def release(self, token: int) -> None:
+        if token >= 0:
+            try:
+                fcntl.flock(token, fcntl.LOCK_UN)
+            finally:
+                os.close(token)
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, pipeline: str, max_wait: Optional[float] = None):
+        token = self.acquire(pipeline, max_wait)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    @asynccontextmanager
+    async def aslot(self, pipeline: str, max_wait: Optional[float] = None):
+        token = await self.aacquire(pipeline, max_wait)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def status(self) -> Dict[str, Any]:
+        self._refresh_settings()
+        return {
+            "pid": os.getpid(),
+            "settings": dict(self.settings),
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "global_in_flight": self.global_in_flight(),
+            "global_enabled": bool(self.settings["global"]) and fcntl is not None,
+        }
+
+
+LLM_ADMISSION = AdmissionController()
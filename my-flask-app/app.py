@@ -4,13 +4,19 @@
 # v7.4.0 (Dashboard Fix + Owner Flag + Car Advisor API + AdvisorHistory)
 # ===================================================================
 
-import os, re, json, traceback
+import os, re, json, traceback, threading, asyncio, socket, uuid, hashlib, csv, io, atexit
 import time as pytime
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple, Any, Dict
-from datetime import datetime, time, timedelta
+from datetime import datetime, date, time, timedelta
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g, Response, current_app, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import (
+    inspect as sa_inspect, text as sa_text, select as sa_select, update as sa_update, insert as sa_insert,
+    type_coerce,
+)
+from sqlalchemy.exc import IntegrityError
 from flask_login import (
     LoginManager, UserMixin, login_user, logout_user,
     current_user, login_required
@@ -18,12 +24,31 @@ from flask_login import (
 from authlib.integrations.flask_client import OAuth
 from werkzeug.middleware.proxy_fix import ProxyFix
 from json_repair import repair_json
-import google.generativeai as genai
 import pandas as pd
+import click
+
+from db_pool import (
+    build_engine_options, dispose_engines, instrument_engine, lift_statement_timeout, maintenance_transaction,
+    pool_stats, pool_status,
+)
+from metrics import (
+    REGISTRY as METRICS, stage_timer, LLM_LATENCY, LLM_TOKENS, LLM_COST, CACHE_LOOKUPS, HTTP_LATENCY,
+    LLM_JOBS, LLM_JOB_WAIT, USER_LOOKUPS
+)
 
-# --- Gemini 3 (Car Advisor, SDK החדש) ---
-from google import genai as genai3
-from google.genai import types as genai_types
+# --- LLM backend (Gemini אמיתי / fake offline) ---
+from admission import LLM_ADMISSION, AdmissionRejected
+from shared_cache import SHARED_CACHE, MemoryLRU
+from compressed_json import (
+    CompressedText, DICTIONARIES, RESULT_COMPRESSION, compression_prefix, train_dictionary,
+)
+from deadline import Deadline, DeadlineExceeded, is_timeout_error
+from json_provider import FastJSONProvider, JSONDocument, dumps_text
+from http_compression import init_response_compression, etag_matches
+from catalog_index import CatalogIndex
+import history_partitions
+from llm_backends import ADVISOR_MODEL_ID, LLMBackend, create_llm_backend
+from workload import extract_workload
 
 # ==================================
 # === 1. יצירת אובייקטים גלובליים ===
@@ -32,9 +57,9 @@ db = SQLAlchemy()
 login_manager = LoginManager()
 oauth = OAuth()
 
-# Car Advisor – Gemini 3 client (SDK החדש)
-advisor_client = None
-GEMINI3_MODEL_ID = "gemini-3-pro-preview"
+# LLM backend – נוצר per-worker (ראה _init_llm_backend), LLM_BACKEND=gemini|fake
+llm_backend: Optional[LLMBackend] = None
+GEMINI3_MODEL_ID = ADVISOR_MODEL_ID
 
 # =========================
 # ========= CONFIG ========
@@ -43,9 +68,12 @@ PRIMARY_MODEL = "gemini-2.5-flash"
 FALLBACK_MODEL = "gemini-1.5-flash-latest"
 RETRIES = 2
 RETRY_BACKOFF_SEC = 1.5
-GLOBAL_DAILY_LIMIT = 1000
-USER_DAILY_LIMIT = 5
-MAX_CACHE_DAYS = 45
+GLOBAL_DAILY_LIMIT = int(os.environ.get("GLOBAL_DAILY_LIMIT", 1000))  # קריאות LLM ליום (כל המשתמשים)
+GLOBAL_DAILY_TOKEN_BUDGET = int(os.environ.get("GLOBAL_DAILY_TOKEN_BUDGET", 0))  # 0 = ללא הגבלה
+GLOBAL_DAILY_COST_BUDGET_ILS = float(os.environ.get("GLOBAL_DAILY_COST_BUDGET_ILS", 0))  # 0 = ללא הגבלה
+BUDGET_REFRESH_SEC = float(os.environ.get("BUDGET_REFRESH_SEC", 30))
+USER_DAILY_LIMIT = int(os.environ.get("USER_DAILY_LIMIT", 5))
+MAX_CACHE_DAYS = int(os.environ.get("MAX_CACHE_DAYS", 45))
 
 # ==================================
 # === 2. מודלים של DB (גלובלי) ===
@@ -69,7 +97,8 @@ class SearchHistory(db.Model):
     mileage_range = db.Column(db.String(100))
     fuel_type = db.Column(db.String(100))
     transmission = db.Column(db.String(100))
-    result_json = db.Column(db.Text, nullable=False)
+    result_json = db.Column(CompressedText, nullable=False)
+    prompt_version = db.Column(db.String(16))  # None = נשמר לפני שהתחלנו לסמן גרסאות
 
 
 class AdvisorHistory(db.Model):
@@ -81,16 +110,337 @@ class AdvisorHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
-    profile_json = db.Column(db.Text, nullable=False)
-    result_json = db.Column(db.Text, nullable=False)
+    profile_json = db.Column(CompressedText, nullable=False)
+    result_json = db.Column(CompressedText, nullable=False)
+    prompt_version = db.Column(db.String(16))
+
+
+class CompressionDictionary(db.Model):
+    """מילון דחיסה משותף (zstd / zlib) ל-CompressedText – ה-id נשמר בכל ערך דחוס."""
+    id = db.Column(db.Integer, primary_key=True)
+    algo = db.Column(db.String(10), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    sample_count = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+
+def load_compression_dictionaries() -> None:
+    # חיבור קצר משלו – לא משאירים טרנזקציה פתוחה ב-db.session של create_app
+    with db.engine.connect() as conn:
+        rows = conn.execute(
+            sa_select(CompressionDictionary.id, CompressionDictionary.algo, CompressionDictionary.data)
+            .order_by(CompressionDictionary.id.asc())
+        ).all()
+    for dict_id, algo, data in rows:
+        DICTIONARIES.register(dict_id, algo, data)
+    print(f"[COMPRESS] {RESULT_COMPRESSION}: active dictionary {DICTIONARIES.active_id(RESULT_COMPRESSION)}")
+
+
+def _load_compression_dictionary(dict_id: int):
+    # מילון שאומן ע"י תהליך אחר אחרי העלייה – נטען בחיבור נפרד (לא ב-session של הבקשה)
+    with db.engine.connect() as conn:
+        row = conn.execute(
+            sa_select(CompressionDictionary.algo, CompressionDictionary.data).where(CompressionDictionary.id == dict_id)
+        ).first()
+    return (row[0], row[1]) if row else None
+
+
+DICTIONARIES.loader = _load_compression_dictionary
+
+# טבלאות ההיסטוריה – partitioned לפי חודש ב-Postgres (ראה history_partitions.py)
+HISTORY_TABLES = [SearchHistory.__table__, AdvisorHistory.__table__]
+
+
+def ensure_history_partitions() -> None:
+    for table in HISTORY_TABLES:
+        created = history_partitions.ensure_partitions(db.engine, table.name)
+        if created:
+            print(f"[DB] ✅ created partitions: {', '.join(created)}")
+
+# עמודות CompressedText – למיגרציה
+COMPRESSED_COLUMNS = [
+    (SearchHistory, "result_json"),
+    (AdvisorHistory, "profile_json"),
+    (AdvisorHistory, "result_json"),
+]
+
+
+class CacheInvalidation(db.Model):
+    """
+    כלל invalidation עצל: כל שורת מטמון שנשמרה לפני created_at ותואמת
+    (make / model / prompt_version; None = הכל) נחשבת לא תקפה.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+    make = db.Column(db.String(100))
+    model = db.Column(db.String(100))
+    prompt_version = db.Column(db.String(16))
+    created_by = db.Column(db.String(200))
+
+
+class ReliabilityAggregate(db.Model):
+    """
+    סיכום מצטבר של דוחות האמינות – שורה לכל make/model/year ושורה לכל
+    make/model (year=0). מתעדכן בכל שמירה ל-SearchHistory, כך ש-/api/leaderboard
+    הוא שאילתת אינדקס ולא קריאת LLM. נשמרים סכומים (ולא ממוצעים) כדי שהעדכון יהיה מצטבר.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('make', 'model', 'year', name='uq_reliability_aggregate_key'),
+        db.Index('ix_reliability_aggregate_rank', 'year', 'score_avg'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    make = db.Column(db.String(100), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    year = db.Column(db.Integer, nullable=False, default=0)  # 0 = כל השנים
+    reports = db.Column(db.Integer, nullable=False, default=0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    score_min = db.Column(db.Float)
+    score_max = db.Column(db.Float)
+    score_avg = db.Column(db.Float)  # score_sum / score_count – עמודה לצורך ORDER BY
+    repair_cost_count = db.Column(db.Integer, nullable=False, default=0)
+    repair_cost_sum = db.Column(db.Float, nullable=False, default=0.0)
+    breakdown_json = db.Column(db.Text, nullable=False, default="{}")  # {"engine_transmission_score": [sum, count]}
+    issues_json = db.Column(db.Text, nullable=False, default="{}")  # {"תקלה": count} – עד AGG_MAX_ISSUES
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+
+# עמודות שנוספו לטבלאות קיימות (create_all לא מוסיף עמודות)
+SCHEMA_COLUMN_PATCHES = [
+    ("search_history", "prompt_version", "VARCHAR(16)"),
+    ("advisor_history", "prompt_version", "VARCHAR(16)"),
+]
+
+
+def ensure_schema_columns() -> None:
+    inspector = sa_inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    for table, column, ddl_type in SCHEMA_COLUMN_PATCHES:
+        if table not in tables:
+            continue
+        if column in {c["name"] for c in inspector.get_columns(table)}:
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(sa_text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        print(f"[DB] ✅ added column {table}.{column}")
+
+
+class SchemaNotReady(RuntimeError):
+    """הסכמה דורשת מיגרציה ידנית (flask ...) לפני שה-worker יכול לשרת."""
+
+
+def text_compressed_columns() -> list:
+    """
+    עמודות CompressedText שעדיין TEXT (Postgres מלפני המעבר ל-LargeBinary) – [(table, column)].
+    SQLite: תמיד ריק – BLOB נשמר גם בעמודה שהוגדרה TEXT.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return []
+    inspector = sa_inspect(db.engine)
+    tables = set(inspector.get_table_names())
+    pending = []
+    for model_cls, column in COMPRESSED_COLUMNS:
+        table = model_cls.__tablename__
+        if table not in tables:
+            continue
+        col_type = {c["name"]: c["type"] for c in inspector.get_columns(table)}.get(column)
+        if col_type is not None and not isinstance(col_type, db.LargeBinary):
+            pending.append((table, column))
+    return pending
+
+
+def convert_compressed_columns_to_binary() -> None:
+    """
+    ALTER ל-BYTEA עם convert_to – התוכן הישן נשמר כבתים ו-decompress_text קורא אותו.
+    כותב מחדש את כל הטבלה תחת ACCESS EXCLUSIVE – רץ רק מ-flask compression-binary-columns.
+    """
+    for table, column in text_compressed_columns():
+        # טבלה partitioned – ה-ALTER עובר גם לכל ה-partitions
+        with maintenance_transaction(db.engine) as conn:
+            conn.execute(sa_text(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA USING convert_to({column}, 'UTF8')"
+            ))
+        print(f"[DB] ✅ {table}.{column}: TEXT -> BYTEA")
+
+
+class DailyRollup(db.Model):
+    """
+    סיכומים יומיים לדשבורד ה-analytics של בעלי המערכת: (יום, מדד, ממד) -> ערך.
+    מדדים מההיסטוריה (חיפושים, LLM, advisor) מחושבים מחדש רק לימים שמאז ה-watermark;
+    מדדים חיים (cache_lookups) נצברים בזיכרון ה-worker ונכתבים מ-thread רקע. הדשבורד קורא רק מכאן.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('day', 'metric', 'dim', name='uq_daily_rollup_key'),
+        db.Index('ix_daily_rollup_metric_day', 'metric', 'day'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    metric = db.Column(db.String(40), nullable=False)
+    dim = db.Column(db.String(200), nullable=False, default="")
+    value = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class LLMCallLog(db.Model):
+    """
+    רישום של כל קריאת LLM (כולל ניסיונות כושלים): טוקנים, latency ועלות משוערת.
+    משמש לאכיפת התקציב היומי הגלובלי.
+    """
+    __table_args__ = (
+        # סיכום יומי (count/sum) נענה מהאינדקס בלבד, בלי לגעת בטבלה
+        db.Index('ix_llm_call_log_day_totals', 'timestamp', 'total_tokens', 'cost_ils'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    endpoint = db.Column(db.String(30), nullable=False)
+    model = db.Column(db.String(100), nullable=False)
+    prompt_tokens = db.Column(db.Integer, nullable=False, default=0)
+    output_tokens = db.Column(db.Integer, nullable=False, default=0)
+    total_tokens = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms = db.Column(db.Integer, nullable=False, default=0)
+    cost_ils = db.Column(db.Float, nullable=False, default=0.0)
+    success = db.Column(db.Boolean, nullable=False, default=True)
+    error = db.Column(db.String(300))
+
+
+class LLMJob(db.Model):
+    """
+    עבודת LLM (analyze / advisor) שרצה ב-lane נפרד מה-request threads.
+    הלקוח מקבל 202 + job_id ומושך את התוצאה מ-/jobs/<id>.
+    """
+    __table_args__ = (
+        db.Index('ix_llm_job_status_created', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending / running / done / error
+    payload_json = db.Column(db.Text, nullable=False)
+    result_json = db.Column(db.Text)
+    http_status = db.Column(db.Integer)
+    worker = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
 
 
 # ==================================
 # === 3. פונקציות עזר (גלובלי) ===
 # ==================================
+# ---- זהות המשתמש בלי DB ----
+# current_user נטען בכל בקשה מחוברת. במקום User.query.get בכל פעם:
+#   1) session (חתום ב-SECRET_KEY) מחזיק id/email/name/owner + מתי נטען מה-DB –
+#      כל עוד הוא צעיר מ-SESSION_IDENTITY_MAX_AGE_SEC, אפס שאילתות;
+#   2) אחר כך cache בזיכרון ה-worker (USER_CACHE_TTL_SEC);
+#   3) רק אז DB – והזהות ב-session מתרעננת.
+# forget_identity (logout) כותב חותמת ביטול ל-L2 המשותף (SHARED_CACHE). היא נבדקת רק
+# כשחלון ה-session פג (לא בכל בקשה), ונשמרת ב-L1 לאותו חלון – worker אחר ב-host
+# מפסיק לסמוך על זהות ישנה בתוך SESSION_IDENTITY_MAX_AGE_SEC לכל היותר. בין hosts
+# ה-stale חסום ע"י USER_CACHE_TTL_SEC.
+# current_user הוא CachedUser (לא אובייקט ORM) – רק השדות האלה.
+OWNER_EMAILS = frozenset(
+    e.strip().lower()
+    for e in os.environ.get("OWNER_EMAILS", "").split(",")
+    if e.strip()
+)
+SESSION_IDENTITY_KEY = "_identity"
+SESSION_IDENTITY_MAX_AGE_SEC = int(os.environ.get("SESSION_IDENTITY_MAX_AGE_SEC", 120))
+USER_CACHE_TTL_SEC = float(os.environ.get("USER_CACHE_TTL_SEC", 300))
+_user_cache = MemoryLRU(maxsize=int(os.environ.get("USER_CACHE_SIZE", 4096)), ttl_sec=USER_CACHE_TTL_SEC)
+_revoked_cache = MemoryLRU(maxsize=int(os.environ.get("USER_CACHE_SIZE", 4096)),
+                           ttl_sec=SESSION_IDENTITY_MAX_AGE_SEC)
+
+
+class CachedUser(UserMixin):
+    """המשתמש המחובר כפי שנשמר ב-session / ב-cache – בלי session של SQLAlchemy."""
+
+    def __init__(self, id: int, email: str, name: Optional[str], loaded_at: Optional[float] = None):
+        self.id = int(id)
+        self.email = email or ""
+        self.name = name
+        self.loaded_at = loaded_at or pytime.time()  # מתי הנתונים נקראו מה-DB
+        # הדגל מחושב מ-OWNER_EMAILS הנוכחי (לא מה-session) – שינוי env תופס מיד
+        self.is_owner = self.email.lower() in OWNER_EMAILS
+
+    @classmethod
+    def from_user(cls, user: "User") -> "CachedUser":
+        return cls(user.id, user.email, user.name)
+
+    def identity(self) -> dict:
+        return {"id": self.id, "email": self.email, "name": self.name,
+                "owner": self.is_owner, "ts": self.loaded_at}
+
+
+def _user_cache_key(user_id: Any) -> str:
+    return f"user:{user_id}:"
+
+
+def _identity_revoked_key(user_id: Any) -> str:
+    return f"identity-revoked:{user_id}"
+
+
+def identity_revoked_at(user_id: Any) -> float:
+    """חותמת הביטול האחרונה של המשתמש (0 = אין). L2 נקרא לכל היותר פעם בחלון per worker."""
+    key = _identity_revoked_key(user_id)
+    revoked_at = _revoked_cache.get(key)
+    if revoked_at is not None:
+        return revoked_at
+    raw = SHARED_CACHE.l2.get(key)
+    try:
+        revoked_at = float(raw) if raw else 0.0
+    except ValueError:
+        revoked_at = 0.0
+    _revoked_cache.set(key, revoked_at)
+    return revoked_at
+
+
+def remember_identity(user: Any) -> CachedUser:
+    """אחרי login / טעינה מה-DB: הזהות נכנסת ל-session ול-cache של ה-worker."""
+    cached = user if isinstance(user, CachedUser) else CachedUser.from_user(user)
+    _user_cache.set(_user_cache_key(cached.id), cached)
+    session[SESSION_IDENTITY_KEY] = cached.identity()
+    return cached
+
+
+def forget_identity(user_id: Any) -> None:
+    """
+    logout: מוחק את הזהות מה-session ומה-cache של ה-worker הנוכחי, וכותב חותמת ביטול
+    ל-L2 – workers אחרים חוזרים ל-DB במקום לסמוך על זהות שנטענה לפני כן.
+    """
+    session.pop(SESSION_IDENTITY_KEY, None)
+    if user_id is None:
+        return
+    _user_cache.delete_prefix(_user_cache_key(user_id))
+    now = pytime.time()
+    _revoked_cache.set(_identity_revoked_key(user_id), now)
+    # אחרי max(...) שניות אין זהות ישנה מספיק כדי שהחותמת תשנה משהו
+    SHARED_CACHE.l2.set(_identity_revoked_key(user_id), repr(now).encode("ascii"),
+                        max(SESSION_IDENTITY_MAX_AGE_SEC, USER_CACHE_TTL_SEC))
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    identity = session.get(SESSION_IDENTITY_KEY)
+    if (
+        isinstance(identity, dict)
+        and str(identity.get("id")) == str(user_id)
+        and pytime.time() - identity.get("ts", 0) < SESSION_IDENTITY_MAX_AGE_SEC
+    ):
+        USER_LOOKUPS.inc(source="session")
+        return CachedUser(identity["id"], identity.get("email"), identity.get("name"), identity["ts"])
+
+    cached = _user_cache.get(_user_cache_key(user_id))
+    if cached is not None and cached.loaded_at > identity_revoked_at(user_id):
+        USER_LOOKUPS.inc(source="memory")
+        session[SESSION_IDENTITY_KEY] = cached.identity()
+        return cached
+
+    USER_LOOKUPS.inc(source="db")
+    user = User.query.get(int(user_id))
+    if user is None:
+        session.pop(SESSION_IDENTITY_KEY, None)
+        return None
+    return remember_identity(user)
 
 
 # --- טעינת המילון ---
@@ -107,14 +457,54 @@ except Exception as e:
     israeli_car_market_full_compilation = {"Toyota": ["Corolla (2008-2025)"]}
     print("[DICT] ⚠️ Fallback applied — Toyota only")
 
+# JSON של הקטלוג (ל-index.html) – מחושב פעם אחת ומשותף ב-L2 בין workers
+SHARED_CACHE_TTL_SEC = float(os.environ.get("SHARED_CACHE_TTL_SEC", 6 * 3600))
+try:
+    import car_models_dict as _car_models_module
+    _catalog_stat = os.stat(_car_models_module.__file__)
+    CATALOG_VERSION = f"{_catalog_stat.st_mtime_ns:x}-{_catalog_stat.st_size:x}"
+except Exception:
+    CATALOG_VERSION = "fallback"
+_catalog_json: Optional[str] = None
+
+# השלמה אוטומטית ליצרן/דגם (trie + trigrams + כינויים בעברית) – נבנה פעם אחת
+CATALOG_SUGGEST_MAX_AGE_SEC = int(os.environ.get("CATALOG_SUGGEST_MAX_AGE_SEC", 3600))
+try:
+    CATALOG_INDEX = CatalogIndex(israeli_car_market_full_compilation)
+    print(f"[DICT] ✅ Catalog index: {CATALOG_INDEX.stats()}")
+except Exception as e:
+    print(f"[DICT] ⚠️ Catalog index build failed: {e}")
+    CATALOG_INDEX = CatalogIndex({})
+
+
+def get_catalog_json() -> str:
+    global _catalog_json
+    if _catalog_json is None:
+        from jinja2.utils import htmlsafe_json_dumps
+        key = f"catalog:{CATALOG_VERSION}"
+        value, _ = SHARED_CACHE.get(key)
+        if value is None:
+            # אותו escaping כמו הפילטר tojson (בטוח בתוך <script>)
+            value = str(htmlsafe_json_dumps(israeli_car_market_full_compilation, ensure_ascii=False))
+            SHARED_CACHE.set(key, value, 30 * 86400)
+        _catalog_json = value
+    return _catalog_json
+
+
 import re as _re
 
+# regex-ים מקומפלים פעם אחת ברמת המודול (משותפים בין workers עם --preload)
+_PARENS_RE = _re.compile(r"\(.*?\)")
+_WHITESPACE_RE = _re.compile(r"\s+")
+_NUMBER_RE = _re.compile(r"-?\d+(\.\d+)?")
+_JSON_OBJECT_RE = _re.compile(r"\{.*\}", _re.DOTALL)
+
 
 def normalize_text(s: Any) -> str:
     if s is None:
         return ""
-    s = _re.sub(r"\(.*?\)", " ", str(s)).strip().lower()
-    return _re.sub(r"\s+", " ", s)
+    s = _PARENS_RE.sub(" ", str(s)).strip().lower()
+    return _WHITESPACE_RE.sub(" ", s)
 
 
 def mileage_adjustment(mileage_range: str) -> Tuple[int, Optional[str]]:
@@ -138,7 +528,7 @@ def apply_mileage_logic(model_output: dict, mileage_range: str) -> Tuple[dict, O
             try:
                 base_val = float(model_output[base_key])
             except Exception:
-                m = _re.search(r"-?\d+(\.\d+)?", str(model_output[base_key]))
+                m = _NUMBER_RE.search(str(model_output[base_key]))
                 base_val = float(m.group()) if m else None
             if base_val is not None:
                 new_val = max(0.0, min(100.0, base_val + adj))
@@ -189,34 +579,202 @@ def build_prompt(make, model, sub_model, year, fuel_type, transmission, mileage_
 """.strip()
 
 
-def call_model_with_retry(prompt: str) -> dict:
+# ==========================================
+# === 3a. חשבונאות טוקנים ועלות + תקציב יומי ===
+# ==========================================
+USD_TO_ILS = float(os.environ.get("USD_TO_ILS", 3.7))
+
+# מחיר ל-1M טוקנים (USD): (input, output). ניתן לדרוס עם LLM_PRICES_JSON
+LLM_PRICES_USD_PER_1M = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-1.5-flash-latest": (0.075, 0.30),
+    "gemini-3-pro-preview": (2.00, 12.00),
+}
+try:
+    LLM_PRICES_USD_PER_1M.update({
+        k: tuple(v) for k, v in json.loads(os.environ.get("LLM_PRICES_JSON", "{}")).items()
+    })
+except Exception as e:
+    print(f"[BUDGET] ⚠️ invalid LLM_PRICES_JSON: {e}")
+
+_daily_usage: Dict[str, Any] = {"day": None, "fetched_at": 0.0, "calls": 0, "tokens": 0, "cost_ils": 0.0}
+_daily_usage_lock = threading.Lock()
+
+
+def estimate_cost_ils(model: str, usage: dict) -> float:
+    price_in, price_out = LLM_PRICES_USD_PER_1M.get(model, (0.0, 0.0))
+    usd = (usage.get("prompt_tokens", 0) * price_in + usage.get("output_tokens", 0) * price_out) / 1_000_000
+    return round(usd * USD_TO_ILS, 6)
+
+
+def record_llm_call(endpoint: str, model: str, usage: dict, latency_sec: float, success: bool,
+                    user_id: Optional[int] = None, error: Optional[str] = None) -> None:
+    """
+    שומר LLMCallLog ומעדכן את מוני התקציב של התהליך.
+    הכתיבה רצה על חיבור נפרד (engine.begin) – ה-db.session של הבקשה לא נוגעים בו,
+    כך שאובייקטים/טרנזקציה פתוחה של הקורא לא נשמרים או נסגרים מתחת לידיים.
+    """
+    cost = estimate_cost_ils(model, usage)
+    total_tokens = usage.get("total_tokens", 0)
+    LLM_TOKENS.inc(usage.get("prompt_tokens", 0), pipeline=endpoint, model=model, kind="prompt")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), pipeline=endpoint, model=model, kind="output")
+    LLM_COST.inc(cost, pipeline=endpoint, model=model)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(sa_insert(LLMCallLog).values(
+                user_id=user_id,
+                endpoint=endpoint,
+                model=model,
+                prompt_tokens=usage.get("prompt_tokens", 0),
+                output_tokens=usage.get("output_tokens", 0),
+                total_tokens=total_tokens,
+                latency_ms=int(latency_sec * 1000),
+                cost_ils=cost,
+                success=success,
+                error=(error or "")[:300] or None,
+            ))
+    except Exception as e:
+        print(f"[BUDGET] ⚠️ failed to log LLM call: {e}")
+    with _daily_usage_lock:
+        if _daily_usage["day"] == datetime.today().date():
+            _daily_usage["calls"] += 1
+            _daily_usage["tokens"] += total_tokens
+            _daily_usage["cost_ils"] += cost
+
+
+def get_daily_llm_usage(force: bool = False) -> Dict[str, Any]:
+    """
+    סיכום היום (קריאות / טוקנים / ₪) מתוך LLMCallLog.
+    נשמר בזיכרון BUDGET_REFRESH_SEC שניות כדי שלא תהיה שאילתה בכל בקשה.
+    """
+    today = datetime.today().date()
+    with _daily_usage_lock:
+        fresh = (
+            _daily_usage["day"] == today
+            and pytime.monotonic() - _daily_usage["fetched_at"] < BUDGET_REFRESH_SEC
+        )
+        if fresh and not force:
+            return dict(_daily_usage)
+    today_start = datetime.combine(today, time.min)
+    calls, tokens, cost = db.session.query(
+        db.func.count(LLMCallLog.id),
+        db.func.coalesce(db.func.sum(LLMCallLog.total_tokens), 0),
+        db.func.coalesce(db.func.sum(LLMCallLog.cost_ils), 0.0),
+    ).filter(LLMCallLog.timestamp >= today_start).one()
+    with _daily_usage_lock:
+        _daily_usage.update({
+            "day": today, "fetched_at": pytime.monotonic(),
+            "calls": int(calls), "tokens": int(tokens), "cost_ils": float(cost),
+        })
+        return dict(_daily_usage)
+
+
+def llm_budget_exhausted() -> Optional[str]:
+    """מחזיר סיבה (str) אם התקציב היומי הגלובלי נוצל, אחרת None."""
+    try:
+        usage = get_daily_llm_usage()
+    except Exception as e:
+        print(f"[BUDGET] ⚠️ usage query failed: {e}")
+        return None
+    if GLOBAL_DAILY_LIMIT and usage["calls"] >= GLOBAL_DAILY_LIMIT:
+        return f"calls {usage['calls']}/{GLOBAL_DAILY_LIMIT}"
+    if GLOBAL_DAILY_TOKEN_BUDGET and usage["tokens"] >= GLOBAL_DAILY_TOKEN_BUDGET:
+        return f"tokens {usage['tokens']}/{GLOBAL_DAILY_TOKEN_BUDGET}"
+    if GLOBAL_DAILY_COST_BUDGET_ILS and usage["cost_ils"] >= GLOBAL_DAILY_COST_BUDGET_ILS:
+        return f"cost {usage['cost_ils']:.2f}/{GLOBAL_DAILY_COST_BUDGET_ILS:.2f} ILS"
+    return None
+
+
+def parse_model_json(raw: str) -> dict:
+    raw = (raw or "").strip()
+    try:
+        m = _JSON_OBJECT_RE.search(raw)
+        return json.loads(m.group()) if m else json.loads(raw)
+    except Exception:
+        return json.loads(repair_json(raw))
+
+
+def _attempt_timeout_or_raise(deadline: Deadline, last_err: Optional[Exception]) -> float:
+    try:
+        return deadline.attempt_timeout()
+    except DeadlineExceeded as e:
+        print(f"[AI] ⏱️ {e} – giving up (last error: {last_err!r})")
+        raise
+
+
+def call_model_with_retry(prompt: str, user_id: Optional[int] = None, deadline: Optional[Deadline] = None) -> dict:
+    """
+    PRIMARY → FALLBACK, RETRIES ניסיונות לכל מודל, בתוך תקציב ה-deadline.
+    זורק DeadlineExceeded כשלא נשאר זמן לניסיון נוסף.
+    """
+    if llm_backend is None:
+        raise RuntimeError("LLM backend unavailable")
+    deadline = deadline or Deadline()
     last_err = None
     for model_name in [PRIMARY_MODEL, FALLBACK_MODEL]:
-        try:
-            llm = genai.GenerativeModel(model_name)
-        except Exception as e:
-            last_err = e
-            print(f"[AI] ❌ init {model_name}: {e}")
-            continue
         for attempt in range(1, RETRIES + 1):
+            timeout = _attempt_timeout_or_raise(deadline, last_err)
+            t0 = pytime.perf_counter()
+            resp = None
             try:
-                print(f"[AI] Calling {model_name} (attempt {attempt})")
-                resp = llm.generate_content(prompt)
-                raw = (getattr(resp, "text", "") or "").strip()
-                try:
-                    m = _re.search(r"\{.*\}", raw, _re.DOTALL)
-                    data = json.loads(m.group()) if m else json.loads(raw)
-                except Exception:
-                    data = json.loads(repair_json(raw))
+                print(f"[AI] Calling {model_name} (attempt {attempt}, timeout {timeout:.1f}s)")
+                resp = llm_backend.generate_report(model_name, prompt, timeout=timeout)
+                data = parse_model_json(resp.text)
+                # נרשם כהצלחה רק אחרי שהפלט עבר parsing
+                record_llm_call("analyze", model_name, resp.usage, pytime.perf_counter() - t0, True, user_id)
+                LLM_LATENCY.observe(pytime.perf_counter() - t0, pipeline="analyze", model=model_name, outcome="ok")
+                print("[AI] ✅ success")
+                return data
+            except Exception as e:
+                LLM_LATENCY.observe(pytime.perf_counter() - t0, pipeline="analyze", model=model_name, outcome="error")
+                # כשל parsing – הטוקנים כבר שולמו, נרשמים יחד עם הכשל
+                record_llm_call("analyze", model_name, resp.usage if resp is not None else {},
+                                pytime.perf_counter() - t0, False, user_id, str(e))
+                print(f"[AI] ⚠️ {model_name} attempt {attempt} failed: {e}")
+                last_err = e
+                if attempt < RETRIES:
+                    pytime.sleep(deadline.backoff(RETRY_BACKOFF_SEC, attempt))
+                continue
+    raise RuntimeError(f"Model failed: {repr(last_err)}") from last_err
+
+
+async def call_model_with_retry_async(prompt: str, user_id: Optional[int] = None,
+                                      deadline: Optional[Deadline] = None) -> dict:
+    """כמו call_model_with_retry, אבל ממתין לגרסת ה-async של ה-backend (מצב ASGI)."""
+    if llm_backend is None:
+        raise RuntimeError("LLM backend unavailable")
+    deadline = deadline or Deadline()
+    last_err = None
+    for model_name in [PRIMARY_MODEL, FALLBACK_MODEL]:
+        for attempt in range(1, RETRIES + 1):
+            timeout = _attempt_timeout_or_raise(deadline, last_err)
+            t0 = pytime.perf_counter()
+            resp = None
+            try:
+                print(f"[AI] Calling {model_name} async (attempt {attempt}, timeout {timeout:.1f}s)")
+                # wait_for – רשת ביטחון אם ה-SDK לא מכבד את ה-timeout
+                resp = await asyncio.wait_for(
+                    llm_backend.agenerate_report(model_name, prompt, timeout=timeout), timeout + 1.0
+                )
+                data = parse_model_json(resp.text)
+                await asyncio.to_thread(
+                    record_llm_call, "analyze", model_name, resp.usage, pytime.perf_counter() - t0, True, user_id
+                )
+                LLM_LATENCY.observe(pytime.perf_counter() - t0, pipeline="analyze", model=model_name, outcome="ok")
                 print("[AI] ✅ success")
                 return data
             except Exception as e:
+                LLM_LATENCY.observe(pytime.perf_counter() - t0, pipeline="analyze", model=model_name, outcome="error")
+                await asyncio.to_thread(
+                    record_llm_call, "analyze", model_name, resp.usage if resp is not None else {},
+                    pytime.perf_counter() - t0, False, user_id, str(e),
+                )
                 print(f"[AI] ⚠️ {model_name} attempt {attempt} failed: {e}")
                 last_err = e
                 if attempt < RETRIES:
-                    pytime.sleep(RETRY_BACKOFF_SEC)
+                    await asyncio.sleep(deadline.backoff(RETRY_BACKOFF_SEC, attempt))
                 continue
-    raise RuntimeError(f"Model failed: {repr(last_err)}")
+    raise RuntimeError(f"Model failed: {repr(last_err)}") from last_err
 
 
 # ======================================================
@@ -290,15 +848,8 @@ def make_user_profile(
     }
 
 
-def car_advisor_call_gemini_with_search(profile: dict) -> dict:
-    """
-    קריאה ל-Gemini 3 Pro (SDK החדש) עם Google Search ו-output כ-JSON בלבד.
-    """
-    global advisor_client
-    if advisor_client is None:
-        return {"_error": "Gemini Car Advisor client unavailable."}
-
-    prompt = f"""
+def build_advisor_prompt(profile: dict) -> str:
+    return f"""
 Please recommend cars for an Israeli customer. Here is the user profile (JSON):
 {json.dumps(profile, ensure_ascii=False, indent=2)}
 
@@ -354,32 +905,80 @@ IMPORTANT MARKET REALITY:
 Return ONLY raw JSON. Do not add any backticks or explanation text.
 """
 
-    search_tool = genai_types.Tool(
-        google_search=genai_types.GoogleSearch()
-    )
 
-    config = genai_types.GenerateContentConfig(
-        temperature=0.3,
-        top_p=0.9,
-        top_k=40,
-        tools=[search_tool],
-        response_mime_type="application/json",
+def car_advisor_parse_response(text: str) -> dict:
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return {"_error": "JSON decode error from Gemini Car Advisor", "_raw": text}
+
+
+def car_advisor_call_gemini_with_search(profile: dict, user_id: Optional[int] = None,
+                                        deadline: Optional[Deadline] = None) -> dict:
+    """
+    קריאה ל-Gemini 3 Pro (SDK החדש) עם Google Search ו-output כ-JSON בלבד.
+    """
+    if llm_backend is None:
+        return {"_error": "Gemini Car Advisor client unavailable."}
+    try:
+        # ניסיון יחיד – מקבל את כל הזמן שנותר (פחות שמירה)
+        timeout = (deadline or Deadline()).attempt_timeout(cap=None)
+    except DeadlineExceeded as e:
+        return {"_error": f"Gemini Car Advisor call skipped: {e}", "_timeout": True}
+
+    t0 = pytime.perf_counter()
+    resp = None
+    try:
+        resp = llm_backend.generate_advisor(build_advisor_prompt(profile), timeout=timeout)
+        parsed = car_advisor_parse_response(resp.text)
+    except Exception as e:
+        parsed = {"_error": f"Gemini Car Advisor call failed: {e}"}
+        if is_timeout_error(e):
+            parsed["_timeout"] = True
+    record_llm_call("advisor", GEMINI3_MODEL_ID, resp.usage if resp is not None else {},
+        pytime.perf_counter() - t0, not parsed.get("_error"), user_id, parsed.get("_error"),
+    )
+    LLM_LATENCY.observe(
+        pytime.perf_counter() - t0, pipeline="advisor", model=GEMINI3_MODEL_ID,
+        outcome="error" if parsed.get("_error") else "ok",
     )
+    return parsed
+
+
+async def car_advisor_call_gemini_with_search_async(profile: dict, user_id: Optional[int] = None,
+                                                    deadline: Optional[Deadline] = None) -> dict:
+    """
+    גרסת async (client.aio) של car_advisor_call_gemini_with_search – למצב ASGI.
+    """
+    if llm_backend is None:
+        return {"_error": "Gemini Car Advisor client unavailable."}
+    try:
+        # ניסיון יחיד – מקבל את כל הזמן שנותר (פחות שמירה)
+        timeout = (deadline or Deadline()).attempt_timeout(cap=None)
+    except DeadlineExceeded as e:
+        return {"_error": f"Gemini Car Advisor call skipped: {e}", "_timeout": True}
 
+    t0 = pytime.perf_counter()
+    resp = None
     try:
-        resp = advisor_client.models.generate_content(
-            model=GEMINI3_MODEL_ID,
-            contents=prompt,
-            config=config,
+        resp = await asyncio.wait_for(
+            llm_backend.agenerate_advisor(build_advisor_prompt(profile), timeout=timeout), timeout + 1.0
         )
-        text = getattr(resp, "text", "") or ""
-        text = text.strip()
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            return {"_error": "JSON decode error from Gemini Car Advisor", "_raw": text}
+        parsed = car_advisor_parse_response(resp.text)
     except Exception as e:
-        return {"_error": f"Gemini Car Advisor call failed: {e}"}
+        parsed = {"_error": f"Gemini Car Advisor call failed: {e}"}
+        if is_timeout_error(e):
+            parsed["_timeout"] = True
+    await asyncio.to_thread(
+        record_llm_call, "advisor", GEMINI3_MODEL_ID, resp.usage if resp is not None else {},
+        pytime.perf_counter() - t0, not parsed.get("_error"), user_id, parsed.get("_error"),
+    )
+    LLM_LATENCY.observe(
+        pytime.perf_counter() - t0, pipeline="advisor", model=GEMINI3_MODEL_ID,
+        outcome="error" if parsed.get("_error") else "ok",
+    )
+    return parsed
 
 
 def car_advisor_postprocess(profile: dict, parsed: dict) -> dict:
@@ -474,119 +1073,1605 @@ def car_advisor_postprocess(profile: dict, parsed: dict) -> dict:
     }
 
 
-# ========================================
-# ===== ★★★ 4. פונקציית ה-Factory ★★★ =====
-# ========================================
-def create_app():
-    app = Flask(__name__)
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
-
-    # ---- בעל מערכת (למנוע ההמלצות) ----
-    OWNER_EMAILS = [
-        e.strip().lower()
-        for e in os.environ.get("OWNER_EMAILS", "").split(",")
-        if e.strip()
-    ]
-
-    def is_owner_user() -> bool:
-        if not current_user.is_authenticated:
-            return False
-        email = (getattr(current_user, "email", "") or "").lower()
-        return email in OWNER_EMAILS
+# ==========================================================
+# === 3f. גרסת פרומפט + invalidation עצל של המטמון ===
+# ==========================================================
+# hash של תבניות הפרומפט (עם placeholders), שמות המודלים ו-CACHE_SCHEMA_REV.
+# כל שינוי בפרומפט / בסכמת ה-JSON מייצר גרסה חדשה, ושורות מטמון מגרסה
+# אחרת נחשבות ישנות – בלי למחוק היסטוריה.
+CACHE_SCHEMA_REV = os.environ.get("CACHE_SCHEMA_REV", "1")
+CACHE_STALE_WHILE_REVALIDATE = os.environ.get("CACHE_STALE_WHILE_REVALIDATE", "1").lower() in ("1", "true", "yes")
+INVALIDATION_REFRESH_SEC = float(os.environ.get("INVALIDATION_REFRESH_SEC", 30))
+CACHE_CANDIDATES = 10
 
-    @app.context_processor
-    def inject_template_globals():
-        return {
-            "is_logged_in": current_user.is_authenticated,
-            "current_user": current_user,
-            "is_owner": is_owner_user(),
-        }
 
-    # פונקציה חכמה לבחירת redirect_uri
-    def get_redirect_uri():
-        domain = request.host or ""
-        if "yedaarechev.com" in domain:
-            uri = "https://yedaarechev.com/auth"
-        else:
-            uri = "https://reliabilityaimodelsr-production.up.railway.app/auth"
-        print(f"[AUTH] Using redirect_uri={uri} (host={domain})")
-        return uri
+def compute_prompt_version(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in (CACHE_SCHEMA_REV, *parts):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:12]
 
-    # Secrets
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 
-    if not app.config['SQLALCHEMY_DATABASE_URI']:
-        print("[BOOT] ⚠️ DATABASE_URL not set. Using in-memory sqlite.")
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    if not app.config['SECRET_KEY']:
-        print("[BOOT] ⚠️ SECRET_KEY not set. Using dev fallback.")
-        app.config['SECRET_KEY'] = 'dev-secret-key-that-is-not-secret'
+ANALYZE_PROMPT_VERSION = compute_prompt_version(
+    # year עובר int() בתוך build_prompt – placeholder מספרי
+    build_prompt("{make}", "{model}", "{sub_model}", 0, "{fuel_type}", "{transmission}", "{mileage_range}"),
+    PRIMARY_MODEL, FALLBACK_MODEL,
+)
+ADVISOR_PROMPT_VERSION = compute_prompt_version(
+    build_advisor_prompt({"profile": "{profile}"}), GEMINI3_MODEL_ID,
+)
 
-    # Init
-    db.init_app(app)
-    login_manager.init_app(app)
-    oauth.init_app(app)
+_invalidation_rules: Dict[str, Any] = {"fetched_at": None, "rules": []}
+_invalidation_lock = threading.Lock()
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+
+def get_invalidation_rules(force: bool = False) -> list:
+    """[(created_at, make, model, prompt_version)] – נשמר בזיכרון INVALIDATION_REFRESH_SEC שניות."""
+    with _invalidation_lock:
+        fetched_at = _invalidation_rules["fetched_at"]
+        if not force and fetched_at is not None and pytime.monotonic() - fetched_at < INVALIDATION_REFRESH_SEC:
+            return _invalidation_rules["rules"]
+    rows = CacheInvalidation.query.with_entities(
+        CacheInvalidation.created_at, CacheInvalidation.make,
+        CacheInvalidation.model, CacheInvalidation.prompt_version,
+    ).all()
+    rules = [tuple(r) for r in rows]
+    with _invalidation_lock:
+        _invalidation_rules.update({"fetched_at": pytime.monotonic(), "rules": rules})
+    return rules
+
+
+def is_invalidated(make: str, model: str, prompt_version: Optional[str], saved_at: datetime) -> bool:
+    for created_at, r_make, r_model, r_version in get_invalidation_rules():
+        if saved_at >= created_at:
+            continue
+        if r_make is not None and r_make != make:
+            continue
+        if r_model is not None and r_model != model:
+            continue
+        if r_version is not None and r_version != prompt_version:
+            continue
+        return True
+    return False
 
-    login_manager.login_view = 'login'
 
-    # יצירת טבלאות (כולל AdvisorHistory) אם חסרות
+def revalidate_in_background(params: dict) -> bool:
+    """
+    stale-while-revalidate: מריץ ניתוח חדש ברקע (פעם אחת לכל מפתח בתהליך).
+    מדלג אם אין executor, אין תקציב, או שאין slot פנוי מיד.
+    התוצאה נכתבת רק למטמון (L1/L2) – לא ל-SearchHistory: זה לא חיפוש של המשתמש,
+    ולכן לא נספר במכסה היומית, לא מופיע בדשבורד/ייצוא ולא נכנס לאגרגציות.
+    """
+    executor = get_background_executor()
+    if executor is None or llm_backend is None:
+        return False
+    key = tuple(params[f] for f in ("make", "model", "year", "mileage_range", "fuel_type", "transmission"))
+    with _revalidating_lock:
+        if key in _revalidating:
+            return True
+        _revalidating.add(key)
+    executor.submit(_revalidate_analysis, current_app._get_current_object(), dict(params), key)
+    return True
+
+
+def _revalidate_analysis(app, params: dict, key: tuple) -> None:
     with app.app_context():
         try:
-            db.create_all()
-            print("[DB] ✅ create_all executed")
+            if llm_budget_exhausted():
+                return
+            with LLM_ADMISSION.slot("revalidate", max_wait=0), stage_timer("analyze", "revalidate"):
+                model_output = call_model_with_retry(build_analyze_prompt(params), None, Deadline())
+            model_output, _ = apply_mileage_logic(model_output, params["mileage_range"])
+            remember_analysis(params, datetime.now(), dumps_text(model_output))
+            print(f"[CACHE] 🔄 revalidated {key[:3]} -> {ANALYZE_PROMPT_VERSION}")
+        except AdmissionRejected:
+            print(f"[CACHE] revalidation skipped (no free LLM slot): {key[:3]}")
         except Exception as e:
-            print(f"[DB] ⚠️ create_all failed: {e}")
-
-    # Gemini key
-    GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
-    if not GEMINI_API_KEY:
-        print("[AI] ⚠️ GEMINI_API_KEY missing")
-    genai.configure(api_key=GEMINI_API_KEY)
+            print(f"[CACHE] ⚠️ revalidation failed: {e}")
+        finally:
+            db.session.remove()
+            with _revalidating_lock:
+                _revalidating.discard(key)
+
+
+# ==========================================================
+# === 3g. אגרגציה מצטברת של דוחות אמינות (leaderboard) ===
+# ==========================================================
+AGG_MAX_ISSUES = int(os.environ.get("AGG_MAX_ISSUES", 30))
+LEADERBOARD_MIN_REPORTS = int(os.environ.get("LEADERBOARD_MIN_REPORTS", 3))
+LEADERBOARD_MAX_AGE_SEC = int(os.environ.get("LEADERBOARD_MAX_AGE_SEC", 300))
+
+
+def _to_number(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    m = _NUMBER_RE.search(str(value or "").replace(",", ""))
+    return float(m.group()) if m else None
+
+
+def extract_reliability_sample(model_output: dict) -> dict:
+    """השדות המספריים מדוח אחד (אחרי mileage logic)."""
+    breakdown = {}
+    for key, value in (model_output.get("score_breakdown") or {}).items():
+        num = _to_number(value)
+        if num is not None:
+            breakdown[key] = num
+    issues = []
+    for issue in model_output.get("common_issues") or []:
+        text = _WHITESPACE_RE.sub(" ", str(issue)).strip()[:200]
+        if text and text not in issues:
+            issues.append(text)
+    return {
+        "score": _to_number(model_output.get("base_score_calculated")),
+        "breakdown": breakdown,
+        "issues": issues,
+        "repair_cost": _to_number(model_output.get("avg_repair_cost_ILS")),
+    }
 
-    # Gemini 3 client עבור Car Advisor (SDK החדש)
-    global advisor_client
-    if GEMINI_API_KEY:
-        try:
-            advisor_client = genai3.Client(api_key=GEMINI_API_KEY)
-            print("[CAR-ADVISOR] ✅ Gemini 3 client initialized")
-        except Exception as e:
-            advisor_client = None
-            print(f"[CAR-ADVISOR] ❌ Failed to init Gemini 3 client: {e}")
-    else:
-        advisor_client = None
 
-    # OAuth
-    oauth.register(
-        name='google',
-        client_id=os.environ.get('GOOGLE_CLIENT_ID'),
-        client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
-        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-        client_kwargs={'scope': 'openid email profile'},
-        api_base_url='https://www.googleapis.com/oauth2/v1/',
-        userinfo_endpoint='https://openidconnect.googleapis.com/v1/userinfo',
-        claims_options={'iss': {'values': ['https://accounts.google.com', 'accounts.google.com']}}
+def new_reliability_aggregate(make: str, model: str, year: int) -> ReliabilityAggregate:
+    return ReliabilityAggregate(
+        make=make, model=model, year=year, reports=0, score_count=0, score_sum=0.0,
+        repair_cost_count=0, repair_cost_sum=0.0, breakdown_json="{}", issues_json="{}",
     )
 
-    # ------------------
-    # ===== ROUTES =====
-    # ------------------
-    @app.route('/')
-    def index():
-        return render_template(
-            'index.html',
-            car_models_data=israeli_car_market_full_compilation,
-            user=current_user,
-            is_owner=is_owner_user(),
-        )
 
-    @app.route('/login')
-    def login():
-        redirect_uri = get_redirect_uri()
-        return oauth.google.authorize_redirect(redirect_uri, state=None)
+def apply_reliability_sample(row: ReliabilityAggregate, sample: dict) -> None:
+    row.reports += 1
+    score = sample["score"]
+    if score is not None:
+        row.score_count += 1
+        row.score_sum += score
+        row.score_min = score if row.score_min is None else min(row.score_min, score)
+        row.score_max = score if row.score_max is None else max(row.score_max, score)
+        row.score_avg = round(row.score_sum / row.score_count, 2)
+    if sample["repair_cost"] is not None:
+        row.repair_cost_count += 1
+        row.repair_cost_sum += sample["repair_cost"]
+    if sample["breakdown"]:
+        breakdown = json.loads(row.breakdown_json or "{}")
+        for key, value in sample["breakdown"].items():
+            total, count = breakdown.get(key, (0.0, 0))
+            breakdown[key] = (total + value, count + 1)
+        row.breakdown_json = json.dumps(breakdown, ensure_ascii=False)
+    if sample["issues"]:
+        issues = json.loads(row.issues_json or "{}")
+        for issue in sample["issues"]:
+            issues[issue] = issues.get(issue, 0) + 1
+        if len(issues) > AGG_MAX_ISSUES * 2:
+            # top-N בקירוב: התקלות הנדירות נחתכות כדי שהשורה לא תגדל בלי סוף
+            issues = dict(sorted(issues.items(), key=lambda kv: -kv[1])[:AGG_MAX_ISSUES])
+        row.issues_json = json.dumps(issues, ensure_ascii=False)
+    row.updated_at = datetime.now()
+
+
+def _locked_aggregate(make: str, model: str, year: int) -> ReliabilityAggregate:
+    query = ReliabilityAggregate.query.filter_by(make=make, model=model, year=year).with_for_update()
+    row = query.first()
+    if row is not None:
+        return row
+    try:
+        with db.session.begin_nested():
+            row = new_reliability_aggregate(make, model, year)
+            db.session.add(row)
+        return row
+    except IntegrityError:
+        # worker אחר יצר את השורה במקביל
+        return query.first()
+
+
+def update_reliability_aggregates(params: dict, model_output: dict) -> None:
+    """נקרא בתוך הטרנזקציה של השמירה; נועל (year, ואז 0) – סדר קבוע, בלי deadlocks."""
+    sample = extract_reliability_sample(model_output)
+    for year in (params["year"], 0):
+        apply_reliability_sample(_locked_aggregate(params["make"], params["model"], year), sample)
+
+
+def reliability_aggregate_to_dict(row: ReliabilityAggregate) -> dict:
+    breakdown = json.loads(row.breakdown_json or "{}")
+    issues = json.loads(row.issues_json or "{}")
+    top_issues = sorted(issues.items(), key=lambda kv: -kv[1])[:5]
+    return {
+        "make": row.make.title(),
+        "model": row.model.title(),
+        "year": row.year or None,
+        "reports": row.reports,
+        "score_avg": row.score_avg,
+        "score_min": row.score_min,
+        "score_max": row.score_max,
+        "score_breakdown": {k: round(total / count, 2) for k, (total, count) in breakdown.items() if count},
+        "common_issues": [{"issue": issue, "count": count} for issue, count in top_issues],
+        "avg_repair_cost_ILS": round(row.repair_cost_sum / row.repair_cost_count) if row.repair_cost_count else None,
+    }
 
-    @app.route('/auth')
-    def auth():
+
+# ==========================================================
+# === 3h. ייצוא היסטוריה בסטרימינג (NDJSON / CSV) ===
+# ==========================================================
+# שורות נשלפות ב-yield_per (server-side cursor ב-Postgres) ונכתבות
+# לתגובה בחבילות של EXPORT_BATCH_ROWS – זיכרון קבוע בלי קשר לגודל ההיסטוריה.
+# NDJSON: result_json / profile_json נבדקים ומודבקים כמו שהם; מסמך עם שורות
+#   חדשות מסודר מחדש בשורה אחת, ומסמך לא תקין יוצא כמחרוזת (מסומן ב-invalid_json).
+# CSV: score_breakdown ושדות העלות משוטחים לעמודות; advisor – שורה לכל רכב מומלץ.
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", 200))
+EXPORT_KINDS = ("search", "advisor")
+SCORE_BREAKDOWN_KEYS = (
+    "engine_transmission_score", "electrical_score", "suspension_brakes_score",
+    "maintenance_cost_score", "satisfaction_score", "recalls_score",
+)
+# שדות העלות ש-car_advisor_postprocess מחשב לכל רכב
+ADVISOR_COST_KEYS = ("annual_energy_cost", "maintenance_cost", "insurance_cost", "annual_fee", "total_annual_cost")
+EXPORT_CSV_COLUMNS = (
+    "type", "id", "timestamp", "make", "model", "year", "mileage_range", "fuel_type", "transmission",
+    "prompt_version", "base_score_calculated", *SCORE_BREAKDOWN_KEYS,
+    "avg_repair_cost_ILS", "issues_total_cost_ILS", "common_issues", "issues_with_costs",
+    "recommended_count", "car_rank", "car", "fit_score", *ADVISOR_COST_KEYS,
+)
+
+
+def _export_query(kind: str, user_id: int):
+    if kind == "search":
+        m = SearchHistory
+        columns = (m.id, m.timestamp, m.make, m.model, m.year, m.mileage_range, m.fuel_type,
+                   m.transmission, m.prompt_version, m.result_json)
+    else:
+        m = AdvisorHistory
+        columns = (m.id, m.timestamp, m.prompt_version, m.profile_json, m.result_json)
+    return (
+        sa_select(*columns)
+        .where(m.user_id == user_id)
+        .order_by(m.timestamp.desc(), m.id.desc())
+        .execution_options(yield_per=EXPORT_BATCH_ROWS)
+    )
+
+
+def iter_history_rows(user_id: int, kinds=EXPORT_KINDS):
+    for kind in kinds:
+        for row in db.session.execute(_export_query(kind, user_id)):
+            yield kind, row._mapping
+
+
+def _reject_json_constant(name: str):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def _ndjson_fragment(raw: Optional[str]) -> Optional[str]:
+    """
+    מסמך שמור כ-JSON בשורה אחת: כמו שהוא אם תקין, מסודר מחדש אם יש בו שורות חדשות.
+    None = לא JSON תקין (שורות ישנות / פלט חתוך).
+    """
+    try:
+        parsed = json.loads(raw, parse_constant=_reject_json_constant)
+    except (TypeError, ValueError):
+        return None
+    if "\n" in raw or "\r" in raw:
+        return dumps_text(parsed)
+    return raw
+
+
+def history_ndjson_line(kind: str, row) -> str:
+    meta = {"type": kind, "id": row["id"], "timestamp": row["timestamp"].isoformat(),
+            "prompt_version": row["prompt_version"]}
+    if kind == "search":
+        meta.update({k: row[k] for k in ("make", "model", "year", "mileage_range", "fuel_type", "transmission")})
+    fields = [("profile", "profile_json")] if kind == "advisor" else []
+    fields.append(("result", "result_json"))
+    parts = []
+    for name, column in fields:
+        fragment = _ndjson_fragment(row[column])
+        if fragment is None:
+            # לא מדביקים טקסט שישבור את השורה – יוצא כמחרוזת JSON
+            meta.setdefault("invalid_json", []).append(name)
+            fragment = dumps_text(row[column])
+        parts.append(f',"{name}":{fragment}')
+    return dumps_text(meta)[:-1] + "".join(parts) + "}\n"
+
+
+def _csv_number(value: Any) -> Any:
+    num = _to_number(value)
+    if num is None:
+        return ""
+    return int(num) if num.is_integer() else num
+
+
+def history_csv_rows(kind: str, row) -> list:
+    """שורת CSV לחיפוש; ל-advisor – שורה לכל רכב מומלץ (לפחות אחת)."""
+    try:
+        data = json.loads(row["result_json"])
+    except Exception:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    out = dict.fromkeys(EXPORT_CSV_COLUMNS, "")
+    out.update(type=kind, id=row["id"], timestamp=row["timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
+               prompt_version=row["prompt_version"] or "")
+    if kind == "search":
+        for key in ("make", "model", "year", "mileage_range", "fuel_type", "transmission"):
+            out[key] = row[key] if row[key] is not None else ""
+        breakdown = data.get("score_breakdown") or {}
+        for key in SCORE_BREAKDOWN_KEYS:
+            out[key] = _csv_number(breakdown.get(key))
+        out["base_score_calculated"] = _csv_number(data.get("base_score_calculated"))
+        out["avg_repair_cost_ILS"] = _csv_number(data.get("avg_repair_cost_ILS"))
+        costed = [i for i in data.get("issues_with_costs") or [] if isinstance(i, dict)]
+        costs = [c for c in (_to_number(i.get("avg_cost_ILS")) for i in costed) if c is not None]
+        out["issues_total_cost_ILS"] = _csv_number(sum(costs)) if costs else ""
+        out["common_issues"] = " | ".join(str(i) for i in data.get("common_issues") or [])
+        out["issues_with_costs"] = " | ".join(
+            f"{i.get('issue', '')}: {i.get('avg_cost_ILS', '')}" for i in costed
+        )
+    else:
+        cars = [c for c in data.get("recommended_cars") or [] if isinstance(c, dict)]
+        out["recommended_count"] = len(cars)
+        rows = []
+        for rank, car in enumerate(cars, start=1):
+            per_car = dict(out, car_rank=rank, fit_score=_csv_number(car.get("fit_score")))
+            per_car["car"] = " ".join(str(car.get(k) or "") for k in ("brand", "model", "year")).strip()
+            for key in ADVISOR_COST_KEYS:
+                per_car[key] = _csv_number(car.get(key))
+            rows.append([per_car[k] for k in EXPORT_CSV_COLUMNS])
+        if rows:
+            return rows
+    return [[out[k] for k in EXPORT_CSV_COLUMNS]]
+
+
+def stream_history_export(user_id: int, kinds, fmt: str):
+    """generator של חבילות טקסט לתגובה (ndjson / csv)."""
+    buf = io.StringIO()
+    writer = None
+    if fmt == "csv":
+        buf.write("\ufeff")  # BOM – Excel פותח עברית נכון
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+    count = 0
+    t0 = pytime.perf_counter()
+    for kind, row in iter_history_rows(user_id, kinds):
+        if writer is not None:
+            writer.writerows(history_csv_rows(kind, row))
+        else:
+            buf.write(history_ndjson_line(kind, row))
+        count += 1
+        if count % EXPORT_BATCH_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+    print(f"[EXPORT] ✅ user={user_id} {fmt} rows={count} in {pytime.perf_counter() - t0:.2f}s")
+
+
+# ==========================================================
+# === 3i. Rollups יומיים + analytics לבעלי המערכת (pandas) ===
+# ==========================================================
+# DailyRollup מתעדכן בשתי דרכים, שתיהן מחוץ לבקשות:
+#   1) מדדים חיים (cache_lookups) – מונים בזיכרון ה-worker; thread רקע
+#      (_init_rollup_flusher) כותב אותם כ-UPDATE מצטבר כל ROLLUP_FLUSH_SEC;
+#   2) מדדים מההיסטוריה – flask analytics-rollup (cron) מחשב מחדש רק מה-watermark
+#      (היום האחרון שחושב, כולל) ועד היום, עם groupby וקטורי של pandas.
+# הדשבורד קורא רק את DailyRollup – לא סורק את ההיסטוריה ולא כותב.
+#   */10 * * * *  flask --app app analytics-rollup
+ROLLUP_FLUSH_SEC = float(os.environ.get("ROLLUP_FLUSH_SEC", 30))
+ROLLUP_CHUNK_DAYS = 31
+ROLLUP_WATERMARK = "_watermark"
+LIVE_ROLLUP_METRICS = ("cache_lookups",)
+CACHE_HIT_OUTCOMES = ("memory", "l2", "db", "swr")
+CACHE_MISS_OUTCOMES = ("miss", "version_miss", "error")
+ADVISOR_BUDGET_BINS = [0, 50_000, 80_000, 120_000, 180_000, 250_000, float("inf")]
+ADVISOR_BUDGET_LABELS = ["עד 50K", "50–80K", "80–120K", "120–180K", "180–250K", "250K+"]
+
+_rollup_pending: Dict[Tuple[date, str, str], float] = {}
+_rollup_lock = threading.Lock()
+
+
+def count_cache_lookup(outcome: str) -> None:
+    CACHE_LOOKUPS.inc(outcome=outcome)
+    rollup_add("cache_lookups", outcome)
+
+
+def rollup_add(metric: str, dim: str = "", value: float = 1.0) -> None:
+    """מונה יומי חי – רק בזיכרון; ה-thread של _init_rollup_flusher כותב ל-DailyRollup."""
+    key = (datetime.now().date(), metric, dim[:200])
+    with _rollup_lock:
+        _rollup_pending[key] = _rollup_pending.get(key, 0.0) + value
+
+
+def flush_live_rollups() -> int:
+    """UPDATE value = value + delta (או INSERT) – בחיבור נפרד, לא בטרנזקציה של הבקשה."""
+    with _rollup_lock:
+        pending = dict(_rollup_pending)
+        _rollup_pending.clear()
+    if not pending:
+        return 0
+    table = DailyRollup.__table__
+    try:
+        with db.engine.begin() as conn:
+            for (day, metric, dim), delta in pending.items():
+                where = (table.c.day == day) & (table.c.metric == metric) & (table.c.dim == dim)
+                updated = conn.execute(sa_update(table).where(where).values(value=table.c.value + delta)).rowcount
+                if not updated:
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(table.insert().values(day=day, metric=metric, dim=dim, value=delta))
+                    except IntegrityError:
+                        # worker אחר הכניס את השורה באותו רגע
+                        conn.execute(sa_update(table).where(where).values(value=table.c.value + delta))
+        return len(pending)
+    except Exception as e:
+        print(f"[ROLLUP] ⚠️ live flush failed ({len(pending)} keys kept for next flush): {e}")
+        with _rollup_lock:
+            for key, delta in pending.items():
+                _rollup_pending[key] = _rollup_pending.get(key, 0.0) + delta
+        return 0
+
+
+def _read_frame(query) -> pd.DataFrame:
+    with db.engine.connect() as conn:
+        return pd.read_sql(query, conn)
+
+
+def _rows(frame: pd.DataFrame, metric: str, value_col: str, dim_col: Optional[str] = None) -> pd.DataFrame:
+    return pd.DataFrame({
+        "day": frame["day"],
+        "metric": metric,
+        "dim": frame[dim_col].astype(str).str.slice(0, 200) if dim_col else "",
+        "value": frame[value_col].astype(float),
+    })
+
+
+def compute_history_rollups(start: date, end: date) -> pd.DataFrame:
+    """(day, metric, dim, value) לימים start..end (כולל) – groupby וקטורי על ההיסטוריה."""
+    lo, hi = datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min)
+    parts = []
+
+    searches = _read_frame(
+        sa_select(SearchHistory.timestamp, SearchHistory.make, SearchHistory.model)
+        .where(SearchHistory.timestamp >= lo, SearchHistory.timestamp < hi)
+    )
+    if not searches.empty:
+        searches["day"] = pd.to_datetime(searches["timestamp"]).dt.date
+        searches["car"] = searches["make"].fillna("") + " " + searches["model"].fillna("")
+        parts.append(_rows(searches.groupby("day").size().reset_index(name="n"), "searches", "n"))
+        parts.append(_rows(searches.groupby(["day", "car"]).size().reset_index(name="n"), "model_searches", "n", "car"))
+
+    calls = _read_frame(
+        sa_select(LLMCallLog.timestamp, LLMCallLog.endpoint, LLMCallLog.success, LLMCallLog.total_tokens,
+                  LLMCallLog.cost_ils, LLMCallLog.latency_ms)
+        .where(LLMCallLog.timestamp >= lo, LLMCallLog.timestamp < hi)
+    )
+    if not calls.empty:
+        calls["day"] = pd.to_datetime(calls["timestamp"]).dt.date
+        calls["failed"] = ~calls["success"].astype(bool)
+        g_calls = calls.groupby(["day", "endpoint"])
+        llm = g_calls.agg(
+            calls=("endpoint", "size"), errors=("failed", "sum"), tokens=("total_tokens", "sum"),
+            cost=("cost_ils", "sum"),
+        )
+        llm["p50"] = g_calls["latency_ms"].quantile(0.5)
+        llm["p95"] = g_calls["latency_ms"].quantile(0.95)
+        llm = llm.reset_index()
+        for metric, col in (("llm_calls", "calls"), ("llm_errors", "errors"), ("llm_tokens", "tokens"),
+                            ("llm_cost_ils", "cost"), ("llm_latency_p50_ms", "p50"), ("llm_latency_p95_ms", "p95")):
+            parts.append(_rows(llm, metric, col, "endpoint"))
+
+    advisor = _read_frame(
+        sa_select(AdvisorHistory.timestamp, AdvisorHistory.profile_json)
+        .where(AdvisorHistory.timestamp >= lo, AdvisorHistory.timestamp < hi)
+    )
+    if not advisor.empty:
+        advisor["day"] = pd.to_datetime(advisor["timestamp"]).dt.date
+        profiles = advisor["profile_json"].map(_safe_json_object)
+        parts.append(_rows(advisor.groupby("day").size().reset_index(name="n"), "advisor_requests", "n"))
+        fuels = pd.DataFrame({"day": advisor["day"], "fuel": profiles.map(lambda p: p.get("fuel") or ["לא צוין"])})
+        fuels = fuels.explode("fuel")
+        fuels["fuel"] = fuels["fuel"].map(lambda f: fuel_map_he.get(f, f))
+        parts.append(_rows(fuels.groupby(["day", "fuel"]).size().reset_index(name="n"), "advisor_fuel", "n", "fuel"))
+        budget_max = pd.to_numeric(profiles.map(lambda p: (p.get("budget_nis") or [None, None])[-1]), errors="coerce")
+        budget = pd.DataFrame({
+            "day": advisor["day"],
+            "bucket": pd.cut(budget_max, ADVISOR_BUDGET_BINS, labels=ADVISOR_BUDGET_LABELS, right=False),
+        }).dropna()
+        if not budget.empty:
+            counts = budget.groupby(["day", "bucket"], observed=True).size().reset_index(name="n")
+            parts.append(_rows(counts, "advisor_budget", "n", "bucket"))
+
+    if not parts:
+        return pd.DataFrame(columns=["day", "metric", "dim", "value"])
+    return pd.concat(parts, ignore_index=True)
+
+
+def _safe_json_object(text: Any) -> dict:
+    try:
+        value = json.loads(text)
+        return value if isinstance(value, dict) else {}
+    except Exception:
+        return {}
+
+
+def write_history_rollups(start: date, end: date) -> int:
+    """מחליף את מדדי ההיסטוריה בימים start..end בטרנזקציה אחת (המדדים החיים לא נוגעים)."""
+    frame = compute_history_rollups(start, end)
+    table = DailyRollup.__table__
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(
+            table.c.day >= start, table.c.day <= end,
+            table.c.metric.notin_(LIVE_ROLLUP_METRICS + (ROLLUP_WATERMARK,)),
+        ))
+        if not frame.empty:
+            conn.execute(table.insert(), frame.to_dict("records"))
+        conn.execute(table.delete().where(table.c.metric == ROLLUP_WATERMARK))
+        conn.execute(table.insert().values(day=end, metric=ROLLUP_WATERMARK, dim="", value=0.0))
+    return len(frame)
+
+
+def rollup_watermark() -> Optional[date]:
+    return db.session.execute(
+        sa_select(DailyRollup.day).where(DailyRollup.metric == ROLLUP_WATERMARK)
+    ).scalar()
+
+
+def refresh_daily_rollups(since: Optional[date] = None) -> dict:
+    """
+    מעדכן את DailyRollup מה-watermark (כולל – היום האחרון היה חלקי) ועד היום.
+    since – חישוב מחדש מתאריך (backfill). רץ מ-flask analytics-rollup בלבד.
+    """
+    today = datetime.now().date()
+    start = since or rollup_watermark()
+    if start is None:
+        first = db.session.execute(sa_select(db.func.min(SearchHistory.timestamp))).scalar()
+        start = first.date() if first else today
+    rows = 0
+    chunk_start = start
+    while chunk_start <= today:
+        chunk_end = min(today, chunk_start + timedelta(days=ROLLUP_CHUNK_DAYS - 1))
+        rows += write_history_rollups(chunk_start, chunk_end)
+        chunk_start = chunk_end + timedelta(days=1)
+    return {"from": start.isoformat(), "to": today.isoformat(), "rows": rows}
+
+
+def build_owner_analytics(days: int) -> dict:
+    """הדשבורד: pivot-ים וקטוריים על DailyRollup בלבד."""
+    today = datetime.now().date()
+    since = today - timedelta(days=days - 1)
+    frame = _read_frame(
+        sa_select(DailyRollup.day, DailyRollup.metric, DailyRollup.dim, DailyRollup.value)
+        .where(DailyRollup.day >= since, DailyRollup.metric != ROLLUP_WATERMARK)
+    )
+    frame["day"] = pd.to_datetime(frame["day"]).dt.date
+    all_days = [since + timedelta(days=i) for i in range(days)]
+
+    def pivot(metric: str, aggfunc: str = "sum") -> pd.DataFrame:
+        part = frame[frame["metric"] == metric]
+        table = part.pivot_table(index="day", columns="dim", values="value", aggfunc=aggfunc, fill_value=0)
+        return table.reindex(all_days, fill_value=0)
+
+    def totals(metric: str, top: Optional[int] = None) -> list:
+        part = frame[frame["metric"] == metric].groupby("dim")["value"].sum().sort_values(ascending=False)
+        if top:
+            part = part.head(top)
+        total = part.sum()
+        return [{"name": k, "count": int(v), "share": round(float(v / total), 3) if total else 0.0}
+                for k, v in part.items()]
+
+    searches = pivot("searches").sum(axis=1)
+    cache = pivot("cache_lookups")
+    hits = cache.reindex(columns=list(CACHE_HIT_OUTCOMES), fill_value=0).sum(axis=1)
+    misses = cache.reindex(columns=list(CACHE_MISS_OUTCOMES), fill_value=0).sum(axis=1)
+    lookups = hits + misses
+    hit_rate = (hits / lookups.where(lookups > 0)).round(3)
+
+    llm_calls = pivot("llm_calls").sum(axis=1)
+    llm_errors = pivot("llm_errors").sum(axis=1)
+    llm_cost = pivot("llm_cost_ils").sum(axis=1)
+    # latency יומית משוקללת במספר הקריאות לכל endpoint
+    calls_by_ep = pivot("llm_calls")
+    weights = calls_by_ep.div(calls_by_ep.sum(axis=1).where(lambda s: s > 0), axis=0)
+    p50 = (pivot("llm_latency_p50_ms").reindex(columns=calls_by_ep.columns, fill_value=0) * weights).sum(axis=1, min_count=1)
+    p95 = (pivot("llm_latency_p95_ms").reindex(columns=calls_by_ep.columns, fill_value=0) * weights).sum(axis=1, min_count=1)
+
+    daily = pd.DataFrame({
+        "searches": searches, "cache_lookups": lookups, "cache_hit_rate": hit_rate,
+        "llm_calls": llm_calls, "llm_errors": llm_errors, "llm_cost_ils": llm_cost.round(4),
+        "llm_latency_p50_ms": p50.round(0), "llm_latency_p95_ms": p95.round(0),
+        "advisor_requests": pivot("advisor_requests").sum(axis=1),
+    }, index=all_days)
+    daily.insert(0, "day", [d.isoformat() for d in all_days])
+
+    total_lookups = lookups.sum()
+    return {
+        "days": days,
+        "from": since.isoformat(),
+        "to": today.isoformat(),
+        "watermark": (rollup_watermark() or since).isoformat(),
+        "summary": {
+            "searches": int(searches.sum()),
+            "cache_hit_rate": round(float(hits.sum() / total_lookups), 3) if total_lookups else None,
+            "llm_calls": int(llm_calls.sum()),
+            "llm_error_rate": round(float(llm_errors.sum() / llm_calls.sum()), 3) if llm_calls.sum() else None,
+            "llm_cost_ils": round(float(llm_cost.sum()), 2),
+            "advisor_requests": int(daily["advisor_requests"].sum()),
+        },
+        # to_json: טיפוסי numpy -> JSON רגיל, NaN -> null
+        "daily": json.loads(daily.to_json(orient="records")),
+        "top_models": totals("model_searches", top=15),
+        "advisor_fuel": totals("advisor_fuel"),
+        "advisor_budget": sorted(totals("advisor_budget"), key=lambda r: ADVISOR_BUDGET_LABELS.index(r["name"])
+                                 if r["name"] in ADVISOR_BUDGET_LABELS else len(ADVISOR_BUDGET_LABELS)),
+    }
+
+
+# ==============================================================
+# === 3d. שלבי /analyze ו-/advisor_api (משותף ל-sync ול-ASGI) ===
+# ==============================================================
+class ApiError(Exception):
+    """שגיאה שמוחזרת למשתמש כ-JSON {"error": message} עם status."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def overloaded_response(e: AdmissionRejected):
+    """503 + Retry-After כשאין slot פנוי לקריאת LLM."""
+    print(f"[ADMISSION] 🚦 rejected: {e.reason}")
+    body = jsonify({"error": "המערכת עמוסה כרגע בניתוחי AI. נסה שוב בעוד מספר שניות.", "retry_after": e.retry_after})
+    return body, 503, {"Retry-After": str(e.retry_after)}
+
+
+# רשומות היסטוריה לא משתנות אחרי insert – ETag חזק לפי id + גרסת פרומפט,
+# והדפדפן שומר את הפרטים בלי לחזור לשרת
+HISTORY_DETAILS_REV = "1"  # להעלות כשמבנה התגובה של /search-details / /advisor-details משתנה
+HISTORY_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def history_etag(kind: str, row_id: int, prompt_version: Optional[str]) -> str:
+    return f"{kind}{row_id}.{prompt_version or 'legacy'}.r{HISTORY_DETAILS_REV}"
+
+
+def immutable_history_response(response, etag: str):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = HISTORY_CACHE_CONTROL
+    return response
+
+
+def not_modified_response(etag: str):
+    return immutable_history_response(Response(status=304), etag)
+
+
+def parse_analyze_input(data: Any) -> dict:
+    # 0) Input
+    with stage_timer("analyze", "input"):
+        try:
+            data = data or {}
+            params = {
+                "make": normalize_text(data.get('make')),
+                "model": normalize_text(data.get('model')),
+                "sub_model": normalize_text(data.get('sub_model')),
+                "year": int(data.get('year')) if data.get('year') else None,
+                "mileage_range": str(data.get('mileage_range')),
+                "fuel_type": str(data.get('fuel_type')),
+                "transmission": str(data.get('transmission')),
+            }
+        except Exception as e:
+            raise ApiError(f"שגיאת קלט (שלב 0): {str(e)}", 400)
+        if not (params["make"] and params["model"] and params["year"]):
+            raise ApiError("שגיאת קלט (שלב 0): נא למלא יצרן, דגם ושנה", 400)
+        return params
+
+
+def check_user_quota(user_id: int) -> int:
+    # 1) User quota – מחזיר את מספר החיפושים של היום
+    try:
+        with stage_timer("analyze", "quota"):
+            today_start = datetime.combine(datetime.today().date(), time.min)
+            today_end = datetime.combine(datetime.today().date(), time.max)
+            user_searches_today = SearchHistory.query.filter(
+                SearchHistory.user_id == user_id,
+                SearchHistory.timestamp >= today_start,
+                SearchHistory.timestamp <= today_end
+            ).count()
+            if LLM_LANE_MODE != "inline":
+                # ניתוחים שעוד רצים ב-lane נספרים כבר עכשיו
+                user_searches_today += LLMJob.query.filter(
+                    LLMJob.user_id == user_id,
+                    LLMJob.kind == "analyze",
+                    LLMJob.status.in_(("pending", "running")),
+                ).count()
+    except Exception as e:
+        traceback.print_exc()
+        raise ApiError(f"שגיאת שרת (שלב 1): {str(e)}", 500)
+    if user_searches_today >= USER_DAILY_LIMIT:
+        raise ApiError(f"שגיאת מגבלה (שלב 1): ניצלת את {USER_DAILY_LIMIT} החיפושים היומיים שלך. נסה שוב מחר.", 429)
+    return user_searches_today
+
+
+ANALYSIS_KEY_FIELDS = ("make", "model", "year", "mileage_range", "fuel_type", "transmission")
+
+
+def analysis_cache_key(params: dict) -> str:
+    return f"analyze:{ANALYZE_PROMPT_VERSION}:" + "|".join(str(params[f]) for f in ANALYSIS_KEY_FIELDS)
+
+
+def remember_analysis(params: dict, saved_at: datetime, result_json: str) -> None:
+    """כותב תוצאה (בגרסה הנוכחית) ל-L1/L2 – עד תום התוקף שלה במטמון."""
+    valid_for = (saved_at + timedelta(days=MAX_CACHE_DAYS) - datetime.now()).total_seconds()
+    SHARED_CACHE.set(
+        analysis_cache_key(params), f"{saved_at.isoformat()}\n{result_json}",
+        min(SHARED_CACHE_TTL_SEC, valid_for),
+    )
+
+
+def _tiered_cache_lookup(params: dict, max_age_days: int) -> Optional[JSONDocument]:
+    value, tier = SHARED_CACHE.get(analysis_cache_key(params))
+    if value is None:
+        return None
+    saved_iso, _, result_json = value.partition("\n")
+    saved_at = datetime.fromisoformat(saved_iso)
+    if saved_at < datetime.now() - timedelta(days=max_age_days):
+        return None
+    if is_invalidated(params["make"], params["model"], ANALYZE_PROMPT_VERSION, saved_at):
+        return None
+    count_cache_lookup(tier)
+    return JSONDocument(result_json, {"source_tag": f"מקור: מטמון DB (נשמר ב-{saved_at.strftime('%Y-%m-%d')})"})
+
+
+def find_cached_analysis(params: dict, max_age_days: Optional[int] = MAX_CACHE_DAYS,
+                         revalidate: bool = False) -> Optional[JSONDocument]:
+    """
+    2–3) Cache. מפתח = פרמטרי הרכב + ANALYZE_PROMPT_VERSION.
+    מחזיר JSONDocument – result_json השמור יוצא לתגובה בלי parse, עם source_tag מודבק.
+    max_age_days=None – כל גיל וכל גרסה (מצב cache-only / deadline).
+    revalidate=True – שורה מגרסת פרומפט אחרת מוחזרת מיד ומתרעננת ברקע (למטמון בלבד).
+    """
+    prefix = "" if max_age_days is not None else "stale_"
+    try:
+        with stage_timer("analyze", "cache"):
+            if max_age_days is not None:
+                tiered = _tiered_cache_lookup(params, max_age_days)
+                if tiered is not None:
+                    return tiered
+
+            query = SearchHistory.query.with_entities(
+                SearchHistory.id, SearchHistory.timestamp, SearchHistory.prompt_version,
+            ).filter(
+                SearchHistory.make == params["make"],
+                SearchHistory.model == params["model"],
+                SearchHistory.year == params["year"],
+                SearchHistory.mileage_range == params["mileage_range"],
+                SearchHistory.fuel_type == params["fuel_type"],
+                SearchHistory.transmission == params["transmission"],
+            )
+            if max_age_days is not None:
+                query = query.filter(SearchHistory.timestamp >= datetime.now() - timedelta(days=max_age_days))
+            candidates = query.order_by(SearchHistory.timestamp.desc()).limit(CACHE_CANDIDATES).all()
+
+            current = other = None
+            for row_id, saved_at, version in candidates:
+                if is_invalidated(params["make"], params["model"], version, saved_at):
+                    continue
+                if version == ANALYZE_PROMPT_VERSION:
+                    current = (row_id, saved_at)
+                    break
+                if other is None:
+                    other = (row_id, saved_at)
+
+            outcome, chosen, note = f"{prefix}db", current, ""
+            if current is None and other is not None:
+                if max_age_days is None:
+                    chosen = other
+                elif CACHE_STALE_WHILE_REVALIDATE and revalidate:
+                    if revalidate_in_background(params):
+                        outcome, chosen, note = "swr", other, ", גרסה קודמת – מתעדכן ברקע"
+                else:
+                    count_cache_lookup("version_miss")
+                    return None
+            if chosen:
+                # timestamp בתנאי – רק ה-partition של השורה נסרק
+                result_json = SearchHistory.query.with_entities(SearchHistory.result_json).filter(
+                    SearchHistory.id == chosen[0], SearchHistory.timestamp == chosen[1],
+                ).scalar()
+                if chosen is current:
+                    remember_analysis(params, chosen[1], result_json)
+                count_cache_lookup(outcome)
+                return JSONDocument(result_json, {
+                    "source_tag": f"מקור: מטמון DB (נשמר ב-{chosen[1].strftime('%Y-%m-%d')}{note})",
+                })
+    except Exception as e:
+        count_cache_lookup("error")
+        print(f"[CACHE] ⚠️ {e}")
+        return None
+    count_cache_lookup(f"{prefix}miss")
+    return None
+
+
+# ---- הערכה מקומית מדוחות שכנים (בלי LLM) ----
+ESTIMATE_YEAR_SPAN = int(os.environ.get("ESTIMATE_YEAR_SPAN", 3))
+ESTIMATE_MAX_REPORTS = int(os.environ.get("ESTIMATE_MAX_REPORTS", 40))
+ESTIMATE_MAX_AGE_DAYS = int(os.environ.get("ESTIMATE_MAX_AGE_DAYS", 365))
+
+
+def _weighted_top(counter: Dict[str, float], n: int) -> list:
+    return [k for k, _ in sorted(counter.items(), key=lambda kv: -kv[1])[:n]]
+
+
+def estimate_from_neighbors(params: dict, reason: str) -> Optional[dict]:
+    """
+    ציון זמני לרכב מדוחות שמורים של אותו דגם בשנים סמוכות ובכל טווחי הקילומטראז':
+    כל ציון מנורמל חזרה לבסיס (בלי ה-mileage_adjustment שלו), ממוצע משוקלל
+    לפי מרחק בשנים (inverse distance) והתאמת דלק/תיבה, ואז מותאם לקילומטראז' המבוקש.
+    None אם אין שום דוח שכן.
+    """
+    try:
+        with stage_timer("analyze", "estimate"):
+            year = params["year"]
+            rows = SearchHistory.query.with_entities(
+                SearchHistory.year, SearchHistory.mileage_range, SearchHistory.fuel_type,
+                SearchHistory.transmission, SearchHistory.result_json,
+            ).filter(
+                SearchHistory.make == params["make"],
+                SearchHistory.model == params["model"],
+                SearchHistory.year.between(year - ESTIMATE_YEAR_SPAN, year + ESTIMATE_YEAR_SPAN),
+                SearchHistory.timestamp >= datetime.now() - timedelta(days=ESTIMATE_MAX_AGE_DAYS),
+            ).order_by(SearchHistory.timestamp.desc()).limit(ESTIMATE_MAX_REPORTS).all()
+
+            total_w = score_w = cost_w = 0.0
+            score_sum = cost_sum = 0.0
+            breakdown: Dict[str, list] = {}
+            issues: Dict[str, float] = {}
+            checks: Dict[str, float] = {}
+            costed: Dict[str, Tuple[float, dict]] = {}
+            best = (0.0, None)
+            years = set()
+            for r_year, r_mileage, r_fuel, r_gear, result_json in rows:
+                try:
+                    report = json.loads(result_json)
+                except Exception:
+                    continue
+                w = 1.0 / (1 + abs((r_year or year) - year))
+                if r_fuel == params["fuel_type"]:
+                    w *= 1.25
+                if r_gear == params["transmission"]:
+                    w *= 1.1
+                total_w += w
+                years.add(r_year)
+                if w > best[0]:
+                    best = (w, report)
+                sample = extract_reliability_sample(report)
+                if sample["score"] is not None:
+                    score_sum += w * (sample["score"] - mileage_adjustment(r_mileage)[0])
+                    score_w += w
+                if sample["repair_cost"] is not None:
+                    cost_sum += w * sample["repair_cost"]
+                    cost_w += w
+                for key, value in sample["breakdown"].items():
+                    acc = breakdown.setdefault(key, [0.0, 0.0])
+                    acc[0] += w * value
+                    acc[1] += w
+                for issue in sample["issues"]:
+                    issues[issue] = issues.get(issue, 0.0) + w
+                for check in report.get("recommended_checks") or []:
+                    checks[str(check)] = checks.get(str(check), 0.0) + w
+                for item in report.get("issues_with_costs") or []:
+                    name = str(item.get("issue", "")) if isinstance(item, dict) else ""
+                    if name and w > costed.get(name, (0.0, None))[0]:
+                        costed[name] = (w, item)
+
+            if not score_w:
+                count_cache_lookup("estimate_miss")
+                return None
+
+            adj, note = mileage_adjustment(params["mileage_range"])
+            score = max(0.0, min(100.0, score_sum / score_w + adj))
+            n = len(rows)
+            year_range = f"{min(years)}–{max(years)}" if len(years) > 1 else str(next(iter(years)))
+            car = f"{params['make'].title()} {params['model'].title()}"
+            count_cache_lookup("estimate")
+            return {
+                "search_performed": False,
+                "is_estimate": True,
+                "score_breakdown": {k: round(v / w, 1) for k, (v, w) in breakdown.items() if w},
+                "base_score_calculated": round(score, 1),
+                "common_issues": _weighted_top(issues, 6),
+                "avg_repair_cost_ILS": round(cost_sum / cost_w) if cost_w else None,
+                "issues_with_costs": [item for _, item in sorted(costed.values(), key=lambda t: -t[0])[:5]],
+                "reliability_summary": (
+                    f"הערכה זמנית שחושבה מ-{n} ניתוחים קודמים של {car} (שנים {year_range}, "
+                    f"טווחי קילומטראז' שונים), מותאמת לשנת {year} ולטווח {params['mileage_range']}. "
+                    "לא בוצע ניתוח AI חדש."
+                ),
+                "reliability_summary_simple": "זו הערכה בלבד, לפי רכבים דומים שכבר נבדקו. כדאי להריץ ניתוח מלא מאוחר יותר.",
+                "sources": ["הערכה מקומית מניתוחים קודמים במערכת"],
+                "recommended_checks": _weighted_top(checks, 5),
+                "common_competitors_brief": (best[1] or {}).get("common_competitors_brief") or [],
+                "estimate": {"reports": n, "years": sorted(y for y in years if y)},
+                "source_tag": f"מקור: הערכה מקומית ({n} ניתוחים דומים) – {reason}",
+                "mileage_note": note,
+                "km_warn": False,
+            }
+    except Exception as e:
+        print(f"[ESTIMATE] ⚠️ {e}")
+        return None
+
+
+def quota_fallback_analysis(params: dict) -> Optional[Any]:
+    """המשתמש ניצל את המכסה: תוצאה מהמטמון (לא נספרת במכסה) או הערכה מקומית."""
+    cached = find_cached_analysis(params)
+    if cached is not None:
+        return cached
+    return estimate_from_neighbors(params, "ניצלת את החיפושים היומיים, מוצגת הערכה בלבד")
+
+
+def llm_error_fallback(params: dict, error: Exception) -> Tuple[Any, int]:
+    """שירות ה-AI נכשל: ניתוח ישן מהמטמון, אחרת הערכה מקומית, אחרת 500."""
+    stale = find_cached_analysis(params, max_age_days=None)
+    if stale is not None:
+        stale['source_tag'] += " – שירות ה-AI לא זמין כרגע, מוצג ניתוח קודם"
+        return stale, 200
+    estimate = estimate_from_neighbors(params, "שירות ה-AI לא זמין כרגע")
+    if estimate is not None:
+        return estimate, 200
+    return {"error": f"שגיאת AI (שלב 4): {str(error)}"}, 500
+
+
+def budget_fallback_analysis(params: dict) -> Optional[Any]:
+    """
+    אם התקציב היומי הגלובלי נוצל – מצב cache-only:
+    מחזיר תוצאה ישנה מהמטמון (ללא הגבלת גיל), הערכה מקומית, או זורק 503.
+    אם יש תקציב – None (ממשיכים לקריאת AI).
+    """
+    reason = llm_budget_exhausted()
+    if reason is None:
+        return None
+    print(f"[BUDGET] 🚫 daily LLM budget exhausted ({reason}) – cache-only mode")
+    stale = find_cached_analysis(params, max_age_days=None)
+    if stale is None:
+        estimate = estimate_from_neighbors(params, "מכסת AI יומית נוצלה")
+        if estimate is None:
+            raise ApiError("המערכת הגיעה למכסת ניתוחי ה-AI היומית. נסה שוב מחר.", 503)
+        return estimate
+    stale['source_tag'] += " – מכסת AI יומית נוצלה, מוצג ניתוח קודם"
+    return stale
+
+
+def deadline_fallback_analysis(params: dict) -> Tuple[Any, int]:
+    """
+    נגמר תקציב הזמן של הבקשה: מחזירים ניתוח ישן מהמטמון (כל גיל) אם יש,
+    אחרת 504 מהיר – לפני ש-gunicorn הורג את ה-worker.
+    """
+    print("[AI] ⏱️ request deadline exhausted – trying stale cache")
+    stale = find_cached_analysis(params, max_age_days=None)
+    if stale is not None:
+        stale['source_tag'] += " – ניתוח חדש לא הסתיים בזמן, מוצג ניתוח קודם"
+        return stale, 200
+    estimate = estimate_from_neighbors(params, "ניתוח חדש לא הסתיים בזמן")
+    if estimate is not None:
+        return estimate, 200
+    return {"error": "הניתוח לוקח יותר זמן מהרגיל. נסה שוב בעוד מספר דקות."}, 504
+
+
+def advisor_timeout_error() -> dict:
+    return {"error": "מנוע ההמלצות לא הספיק לסיים בזמן. נסה שוב בעוד מספר דקות."}
+
+
+def ensure_advisor_budget() -> None:
+    reason = llm_budget_exhausted()
+    if reason is not None:
+        print(f"[BUDGET] 🚫 daily LLM budget exhausted ({reason}) – advisor disabled")
+        raise ApiError("המערכת הגיעה למכסת ה-AI היומית. נסה שוב מחר.", 503)
+
+
+def release_db_connection() -> None:
+    """
+    מחזיר את החיבור של ה-session ל-pool לפני המתנה ארוכה (קריאת LLM).
+    ה-session פותח חיבור חדש אוטומטית בשימוש הבא (שמירה).
+    """
+    try:
+        db.session.close()
+    except Exception as e:
+        print(f"[DB] ⚠️ release connection failed: {e}")
+
+
+def build_analyze_prompt(params: dict) -> str:
+    return build_prompt(
+        params["make"], params["model"], params["sub_model"], params["year"],
+        params["fuel_type"], params["transmission"], params["mileage_range"]
+    )
+
+
+def finalize_analysis(user_id: int, params: dict, model_output: dict, searches_today: int) -> JSONDocument:
+    # 5) Mileage logic
+    with stage_timer("analyze", "mileage"):
+        model_output, note = apply_mileage_logic(model_output, params["mileage_range"])
+
+    # 6) Save – ה-JSON שנשמר הוא גם גוף התגובה (סריאליזציה אחת)
+    result_json = None
+    try:
+        with stage_timer("analyze", "save"):
+            result_json = _save_search_history(user_id, params, model_output)
+    except Exception as e:
+        print(f"[DB] ⚠️ save failed: {e}")
+        db.session.rollback()
+
+    return JSONDocument(result_json or dumps_text(model_output), {
+        "source_tag": f"מקור: ניתוח AI חדש (חיפוש {searches_today + 1}/{USER_DAILY_LIMIT})",
+        "mileage_note": note,
+        "km_warn": False,
+    })
+
+
+def _save_search_history(user_id: int, params: dict, model_output: dict) -> str:
+    saved_at = datetime.now()
+    result_json = dumps_text(model_output)
+    new_log = SearchHistory(
+        user_id=user_id,
+        timestamp=saved_at,
+        make=params["make"],
+        model=params["model"],
+        year=params["year"],
+        mileage_range=params["mileage_range"],
+        fuel_type=params["fuel_type"],
+        transmission=params["transmission"],
+        result_json=result_json,
+        prompt_version=ANALYZE_PROMPT_VERSION,
+    )
+    db.session.add(new_log)
+    try:
+        with db.session.begin_nested():
+            update_reliability_aggregates(params, model_output)
+    except Exception as e:
+        # האגרגציה לא מפילה את שמירת הדוח (rebuild משלים)
+        print(f"[AGG] ⚠️ aggregate update failed: {e}")
+    db.session.commit()
+    # write-through: ה-worker הבא (או בקשה חוזרת) מקבל את התוצאה מ-L1/L2
+    remember_analysis(params, saved_at, result_json)
+    return result_json
+
+
+def parse_advisor_profile(payload: dict) -> dict:
+    """
+    בונה user_profile מלא כמו ב-Car Advisor (Streamlit) מתוך ה-payload של recommendations.js.
+    """
+    try:
+        # ---- שלב 1: בסיסי ----
+        budget_min = float(payload.get("budget_min", 0))
+        budget_max = float(payload.get("budget_max", 0))
+        year_min = int(payload.get("year_min", 2000))
+        year_max = int(payload.get("year_max", 2025))
+
+        fuels_he = payload.get("fuels_he") or []
+        gears_he = payload.get("gears_he") or []
+        turbo_choice_he = payload.get("turbo_choice_he", "לא משנה")
+
+        # ---- שלב 2: שימוש וסגנון ----
+        main_use = (payload.get("main_use") or "").strip()
+        annual_km = int(payload.get("annual_km", 15000))
+        driver_age = int(payload.get("driver_age", 21))
+
+        license_years = int(payload.get("license_years", 0))
+        driver_gender = payload.get("driver_gender", "זכר") or "זכר"
+
+        body_style = payload.get("body_style", "כללי") or "כללי"
+        driving_style = payload.get("driving_style", "רגוע ונינוח") or "רגוע ונינוח"
+        seats_choice = payload.get("seats_choice", "5") or "5"
+
+        excluded_colors = payload.get("excluded_colors") or []
+        if isinstance(excluded_colors, str):
+            excluded_colors = [
+                s.strip() for s in excluded_colors.split(",") if s.strip()
+            ]
+
+        # ---- שלב 3: סדר עדיפויות ----
+        weights = payload.get("weights") or {
+            "reliability": 5,
+            "resale": 3,
+            "fuel": 4,
+            "performance": 2,
+            "comfort": 3,
+        }
+
+        # ---- שלב 4: פרטים נוספים ----
+        insurance_history = payload.get("insurance_history", "") or ""
+        violations = payload.get("violations", "אין") or "אין"
+
+        family_size = payload.get("family_size", "1-2") or "1-2"
+        cargo_need = payload.get("cargo_need", "בינוני") or "בינוני"
+
+        safety_required = payload.get("safety_required")
+        if not safety_required:
+            safety_required = payload.get("safety_required_radio", "כן")
+        if not safety_required:
+            safety_required = "כן"
+
+        trim_level = payload.get("trim_level", "סטנדרטי") or "סטנדרטי"
+
+        consider_supply = payload.get("consider_supply", "כן") or "כן"
+        consider_market_supply = (consider_supply == "כן")
+
+        fuel_price = float(payload.get("fuel_price", 7.0))
+        electricity_price = float(payload.get("electricity_price", 0.65))
+
+    except Exception as e:
+        raise ApiError(f"שגיאת קלט: {e}", 400)
+
+    # --- מיפוי דלק/גיר/טורבו מהעברית לערכים לוגיים ---
+    fuels = [fuel_map.get(f, "gasoline") for f in fuels_he] if fuels_he else ["gasoline"]
+
+    if "חשמלי" in fuels_he:
+        gears = ["automatic"]
+    else:
+        gears = [gear_map.get(g, "automatic") for g in gears_he] if gears_he else ["automatic"]
+
+    turbo_choice = turbo_map.get(turbo_choice_he, "any")
+
+    # --- בניית user_profile כמו ב-Car Advisor (Streamlit) ---
+    user_profile = make_user_profile(
+        budget_min,
+        budget_max,
+        [year_min, year_max],
+        fuels,
+        gears,
+        turbo_choice,
+        main_use,
+        annual_km,
+        driver_age,
+        family_size,
+        cargo_need,
+        safety_required,
+        trim_level,
+        weights,
+        body_style,
+        driving_style,
+        excluded_colors,
+    )
+
+    # שדות נוספים
+    user_profile["license_years"] = license_years
+    user_profile["driver_gender"] = driver_gender
+    user_profile["insurance_history"] = insurance_history
+    user_profile["violations"] = violations
+    user_profile["consider_market_supply"] = consider_market_supply
+    user_profile["fuel_price_nis_per_liter"] = fuel_price
+    user_profile["electricity_price_nis_per_kwh"] = electricity_price
+    user_profile["seats"] = seats_choice
+    return user_profile
+
+
+def save_advisor_history(user_id: int, user_profile: dict, result: dict) -> None:
+    # 🔴 שמירת היסטוריית המלצות למאגר
+    try:
+        with stage_timer("advisor", "save"):
+            rec_log = AdvisorHistory(
+                user_id=user_id,
+                profile_json=json.dumps(user_profile, ensure_ascii=False),
+                result_json=json.dumps(result, ensure_ascii=False),
+                prompt_version=ADVISOR_PROMPT_VERSION,
+            )
+            db.session.add(rec_log)
+            db.session.commit()
+    except Exception as e:
+        print(f"[DB] ⚠️ failed to save advisor history: {e}")
+        db.session.rollback()
+
+
+# ==========================================================
+# === 3c. אתחול per-worker (אחרי fork, תומך gunicorn --preload) ===
+# ==========================================================
+# create_app רץ פעם אחת ב-master (config, מילון, routes, templates).
+# משאבים שאינם בטוחים ל-fork (חיבורי DB, לקוחות Gemini, executors)
+# נוצרים רק כאן – פעם אחת בכל תהליך worker.
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 2))
+
+_worker_init_hooks = []
+_worker_state: Dict[str, Any] = {"pid": None, "executor": None, "llm_lane": None}
+_worker_init_lock = threading.Lock()
+
+
+def worker_init_hook(fn):
+    """רישום פונקציה (app) -> None שתרוץ פעם אחת בכל worker."""
+    _worker_init_hooks.append(fn)
+    return fn
+
+
+def init_worker_resources(app) -> None:
+    """
+    מריץ את כל ה-hooks של אתחול ה-worker, פעם אחת לכל PID.
+    נקרא מ-post_fork של gunicorn, ובנוסף בעצלות מ-before_request
+    (למקרה של הרצה בלי gunicorn / בלי preload).
+    """
+    pid = os.getpid()
+    if _worker_state["pid"] == pid:
+        return
+    with _worker_init_lock:
+        if _worker_state["pid"] == pid:
+            return
+        for fn in _worker_init_hooks:
+            try:
+                fn(app)
+            except SchemaNotReady:
+                raise
+            except Exception as e:
+                print(f"[WORKER] ⚠️ init hook {fn.__name__} failed: {e}")
+        _worker_state["pid"] = pid
+        print(f"[WORKER] ✅ pid={pid} initialized ({len(_worker_init_hooks)} hooks)")
+
+
+def get_background_executor() -> Optional[ThreadPoolExecutor]:
+    return _worker_state.get("executor")
+
+
+@worker_init_hook
+def _reset_db_engines(app) -> None:
+    # חיבורים שנפתחו ב-master (create_all) אסור לשתף בין תהליכים.
+    # close=False: לא סוגרים את ה-socket של ההורה, רק זונחים את ה-pool.
+    # sqlite בזיכרון נשאר – אחרת הטבלאות של create_all נעלמות.
+    with app.app_context():
+        dispose_engines(db.engines.values(), close=False)
+
+
+@worker_init_hook
+def _check_compressed_columns(app) -> None:
+    # עמודה שעדיין TEXT תדחה כל INSERT של בתים דחוסים – לא מתחילים לשרת במצב כזה
+    with app.app_context():
+        pending = text_compressed_columns()
+    if pending:
+        names = ", ".join(f"{t}.{c}" for t, c in pending)
+        raise SchemaNotReady(f"{names} still TEXT – run: flask --app app compression-binary-columns")
+
+
+@worker_init_hook
+def _init_llm_backend(app) -> None:
+    global llm_backend
+    backend = create_llm_backend(app.config.get("LLM_BACKEND", "gemini"), app.config.get("GEMINI_API_KEY", ""))
+    # לקוחות Gemini (SDK ישן + Client של Gemini 3) נוצרים כאן, אחרי ה-fork
+    backend.init_worker()
+    backend.warm((PRIMARY_MODEL, FALLBACK_MODEL))
+    llm_backend = backend
+    print(f"[AI] ✅ LLM backend: {backend.name}")
+
+
+@worker_init_hook
+def _init_background_executor(app) -> None:
+    # threads לא שורדים fork – יוצרים executor חדש בכל worker
+    _worker_state["executor"] = ThreadPoolExecutor(
+        max_workers=BACKGROUND_WORKERS, thread_name_prefix="bg-worker"
+    )
+
+
+@worker_init_hook
+def _init_rollup_flusher(app) -> None:
+    # מוני ה-rollup החיים נכתבים מכאן בלבד – אף בקשה לא פותחת בשבילם חיבור
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(ROLLUP_FLUSH_SEC):
+            with app.app_context():
+                flush_live_rollups()
+
+    def final_flush():
+        stop.set()
+        with app.app_context():
+            flush_live_rollups()
+
+    threading.Thread(target=run, name="rollup-flush", daemon=True).start()
+    atexit.register(final_flush)
+
+
+# ==========================================================
+# === 3e. Execution lanes – עבודת LLM מחוץ ל-request threads ===
+# ==========================================================
+# LLM_LANE_MODE:
+#   inline – הקריאה ל-LLM רצה בתוך ה-request (ברירת מחדל, כמו קודם)
+#   thread – LLMJob נשמר ב-DB ורץ על executor ייעודי ומוגבל בתוך ה-worker
+#   queue  – LLMJob נשמר ב-DB ותהליך נפרד (flask run-llm-lane) מושך ומריץ.
+#            רק במצב הזה צריך להוסיף ל-Procfile:  lane: flask --app app run-llm-lane
+# במצבי thread/queue ה-view מחזיר מיד 202 + job_id, והלקוח מושך את /jobs/<id>.
+LLM_LANE_MODE = os.environ.get("LLM_LANE_MODE", "inline").strip().lower()
+LLM_LANE_THREADS = int(os.environ.get("LLM_LANE_THREADS", 4))
+LLM_JOB_STALE_SEC = int(os.environ.get("LLM_JOB_STALE_SEC", 600))
+LLM_JOB_RETENTION_HOURS = int(os.environ.get("LLM_JOB_RETENTION_HOURS", 24))
+JOB_POLL_AFTER_MS = 1500
+
+
+class LaneExecutor:
+    """ThreadPoolExecutor מוגבל + מוני busy/queued למדדי רוויה."""
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.capacity = max_workers
+        self.busy = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"lane-{name}")
+
+    def submit(self, fn, *args):
+        with self._lock:
+            self.queued += 1
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+                self.busy += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+
+        return self._executor.submit(run)
+
+    def has_capacity(self) -> bool:
+        with self._lock:
+            return self.busy + self.queued < self.capacity
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def get_llm_lane() -> Optional[LaneExecutor]:
+    return _worker_state.get("llm_lane")
+
+
+@worker_init_hook
+def _init_llm_lane(app) -> None:
+    if LLM_LANE_MODE == "thread":
+        _worker_state["llm_lane"] = LaneExecutor("llm", LLM_LANE_THREADS)
+
+
+def execute_analyze_llm(user_id: int, params: dict, searches_today: int,
+                        deadline: Optional[Deadline] = None) -> Tuple[Any, int]:
+    """שלבים 4–6 (AI + מיילג' + שמירה). AdmissionRejected עובר למעלה."""
+    deadline = deadline or Deadline()
+    try:
+        with LLM_ADMISSION.slot("analyze", max_wait=deadline.queue_budget()), stage_timer("analyze", "ai_call"):
+            model_output = call_model_with_retry(build_analyze_prompt(params), user_id, deadline)
+    except AdmissionRejected:
+        raise
+    except DeadlineExceeded:
+        return deadline_fallback_analysis(params)
+    except Exception as e:
+        traceback.print_exc()
+        if is_timeout_error(e.__cause__ or e) and deadline.queue_budget() <= 0:
+            return deadline_fallback_analysis(params)
+        return llm_error_fallback(params, e)
+    return finalize_analysis(user_id, params, model_output, searches_today), 200
+
+
+def execute_advisor_llm(user_id: int, user_profile: dict,
+                        deadline: Optional[Deadline] = None) -> Tuple[dict, int]:
+    deadline = deadline or Deadline()
+    with LLM_ADMISSION.slot("advisor", max_wait=deadline.queue_budget()), stage_timer("advisor", "ai_call"):
+        parsed = car_advisor_call_gemini_with_search(user_profile, user_id, deadline)
+    if parsed.get("_error"):
+        if parsed.get("_timeout"):
+            return advisor_timeout_error(), 504
+        return {"error": parsed["_error"], "raw": parsed.get("_raw")}, 500
+    with stage_timer("advisor", "postprocess"):
+        result = car_advisor_postprocess(user_profile, parsed)
+    save_advisor_history(user_id, user_profile, result)
+    return result, 200
+
+
+def submit_llm_job(kind: str, user_id: int, payload: dict) -> dict:
+    """שומר LLMJob ומחזיר גוף תשובת 202. במצב thread גם מתזמן אותו על ה-lane."""
+    job_id = uuid.uuid4().hex
+    db.session.add(LLMJob(
+        id=job_id, kind=kind, user_id=user_id, status="pending",
+        payload_json=json.dumps(payload, ensure_ascii=False),
+    ))
+    db.session.commit()
+    db.session.close()
+    lane = get_llm_lane()
+    if LLM_LANE_MODE == "thread" and lane is not None:
+        lane.submit(_run_llm_job_in_context, current_app._get_current_object(), job_id)
+    LLM_JOBS.inc(kind=kind, outcome="submitted")
+    print(f"[LANE] 📥 {kind} job {job_id} ({LLM_LANE_MODE})")
+    return {
+        "job_id": job_id,
+        "status": "pending",
+        "poll_url": url_for('job_status', job_id=job_id),
+        "poll_after_ms": JOB_POLL_AFTER_MS,
+    }
+
+
+def claim_llm_job(worker_name: str) -> Optional[str]:
+    """לוקח את ה-job הוותיק ביותר במצב pending (SKIP LOCKED ב-Postgres)."""
+    query = LLMJob.query.filter_by(status="pending").order_by(LLMJob.created_at.asc())
+    if db.engine.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    job = query.first()
+    if job is None:
+        db.session.rollback()
+        return None
+    # UPDATE מותנה – מגן גם על sqlite (אין SKIP LOCKED) מפני שני lanes על אותו job
+    claimed = LLMJob.query.filter_by(id=job.id, status="pending").update(
+        {"status": "running", "started_at": datetime.now(), "worker": worker_name},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return job.id if claimed else None
+
+
+def llm_job_deadline(started_at: datetime) -> Deadline:
+    """
+    ה-lane לא כפוף ל-timeout של gunicorn: התקציב הוא חלון ה-stale של /jobs/<id>
+    פחות מה שכבר עבר מאז שה-job התחיל – התוצאה (או ה-fallback) נשמרת לפני שהלקוח מקבל 504.
+    """
+    elapsed = (datetime.now() - started_at).total_seconds()
+    return Deadline(max(0.0, LLM_JOB_STALE_SEC - elapsed))
+
+
+def run_llm_job(job_id: str) -> None:
+    """מריץ job (בתוך app context) ושומר את התוצאה."""
+    job = db.session.get(LLMJob, job_id)
+    if job is None:
+        return
+    if job.status == "pending":
+        job.status = "running"
+        job.started_at = datetime.now()
+        job.worker = f"{socket.gethostname()}:{os.getpid()}"
+        db.session.commit()
+    kind, user_id = job.kind, job.user_id
+    payload = json.loads(job.payload_json)
+    LLM_JOB_WAIT.observe((job.started_at - job.created_at).total_seconds(), kind=kind)
+    deadline = llm_job_deadline(job.started_at)
+    db.session.close()
+
+    try:
+        if kind == "analyze":
+            body, status = execute_analyze_llm(user_id, payload["params"], payload["searches_today"], deadline)
+        elif kind == "advisor":
+            body, status = execute_advisor_llm(user_id, payload["profile"], deadline)
+        else:
+            body, status = {"error": f"unknown job kind: {kind}"}, 500
+    except AdmissionRejected as e:
+        body, status = {"error": "המערכת עמוסה כרגע בניתוחי AI. נסה שוב בעוד מספר שניות.",
+                        "retry_after": e.retry_after}, 503
+    except Exception as e:
+        traceback.print_exc()
+        db.session.rollback()
+        body, status = {"error": f"שגיאת שרת: {e}"}, 500
+
+    LLMJob.query.filter_by(id=job_id).update({
+        "status": "done" if status == 200 else "error",
+        "result_json": dumps_text(body),
+        "http_status": status,
+        "finished_at": datetime.now(),
+    }, synchronize_session=False)
+    db.session.commit()
+    db.session.close()
+    LLM_JOBS.inc(kind=kind, outcome="done" if status == 200 else "error")
+    print(f"[LANE] ✅ {kind} job {job_id} -> {status}")
+
+
+def _run_llm_job_in_context(app, job_id: str) -> None:
+    with app.app_context():
+        try:
+            run_llm_job(job_id)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            db.session.remove()
+
+
+def purge_finished_llm_jobs() -> int:
+    cutoff = datetime.now() - timedelta(hours=LLM_JOB_RETENTION_HOURS)
+    deleted = LLMJob.query.filter(
+        LLMJob.status.in_(("done", "error")), LLMJob.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+# ========================================
+# ===== ★★★ 4. פונקציית ה-Factory ★★★ =====
+# ========================================
+def create_app():
+    app = Flask(__name__)
+    app.json = FastJSONProvider(app)
+    init_response_compression(app)
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
+
+    # ---- בעל מערכת (למנוע ההמלצות) ----
+    def is_owner_user() -> bool:
+        # מחושב פעם אחת לבקשה (current_user עצמו נטען פעם אחת ונשמר ב-g)
+        if "is_owner" not in g:
+            g.is_owner = bool(current_user.is_authenticated and getattr(current_user, "is_owner", False))
+        return g.is_owner
+
+    @app.context_processor
+    def inject_template_globals():
+        return {
+            "is_logged_in": current_user.is_authenticated,
+            "current_user": current_user,
+            "is_owner": is_owner_user(),
+        }
+
+    # פונקציה חכמה לבחירת redirect_uri
+    def get_redirect_uri():
+        domain = request.host or ""
+        if "yedaarechev.com" in domain:
+            uri = "https://yedaarechev.com/auth"
+        else:
+            uri = "https://reliabilityaimodelsr-production.up.railway.app/auth"
+        print(f"[AUTH] Using redirect_uri={uri} (host={domain})")
+        return uri
+
+    # Secrets
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+
+    if not app.config['SQLALCHEMY_DATABASE_URI']:
+        print("[BOOT] ⚠️ DATABASE_URL not set. Using in-memory sqlite.")
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    if not app.config['SECRET_KEY']:
+        print("[BOOT] ⚠️ SECRET_KEY not set. Using dev fallback.")
+        app.config['SECRET_KEY'] = 'dev-secret-key-that-is-not-secret'
+
+    # Connection pool (pool_size / overflow / recycle / pre-ping / statement_timeout)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    # Init
+    db.init_app(app)
+    login_manager.init_app(app)
+    oauth.init_app(app)
+
+    login_manager.login_view = 'login'
+
+    # יצירת טבלאות (כולל AdvisorHistory) אם חסרות
+    with app.app_context():
+        try:
+            db.create_all()
+            print("[DB] ✅ create_all executed")
+            ensure_schema_columns()
+            load_compression_dictionaries()
+            ensure_history_partitions()
+        except Exception as e:
+            print(f"[DB] ⚠️ create_all failed: {e}")
+        print(f"[CACHE] prompt versions: analyze={ANALYZE_PROMPT_VERSION} advisor={ADVISOR_PROMPT_VERSION}")
+        # החיבורים של create_all נסגרים ב-master רק לפני ה-fork (when_ready ב-gunicorn.conf.py)
+        for engine in db.engines.values():
+            instrument_engine(engine)
+
+    # Gemini key (הלקוחות עצמם נוצרים per-worker, ראה init_worker_resources)
+    app.config['LLM_BACKEND'] = os.environ.get("LLM_BACKEND", "gemini")
+    app.config['GEMINI_API_KEY'] = os.environ.get("GEMINI_API_KEY", "")
+    if not app.config['GEMINI_API_KEY'] and app.config['LLM_BACKEND'] == "gemini":
+        print("[AI] ⚠️ GEMINI_API_KEY missing")
+
+    # OAuth
+    oauth.register(
+        name='google',
+        client_id=os.environ.get('GOOGLE_CLIENT_ID'),
+        client_secret=os.environ.get('GOOGLE_CLIENT_SECRET'),
+        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        client_kwargs={'scope': 'openid email profile'},
+        api_base_url='https://www.googleapis.com/oauth2/v1/',
+        userinfo_endpoint='https://openidconnect.googleapis.com/v1/userinfo',
+        claims_options={'iss': {'values': ['https://accounts.google.com', 'accounts.google.com']}}
+    )
+
+    # ------------------
+    # ===== ROUTES =====
+    # ------------------
+    @app.route('/')
+    def index():
+        return render_template(
+            'index.html',
+            car_models_data=israeli_car_market_full_compilation,
+            car_models_json=get_catalog_json(),
+            user=current_user,
+            is_owner=is_owner_user(),
+        )
+
+    @app.route('/login')
+    def login():
+        redirect_uri = get_redirect_uri()
+        return oauth.google.authorize_redirect(redirect_uri, state=None)
+
+    @app.route('/auth')
+    def auth():
         try:
             token = oauth.google.authorize_access_token()
             userinfo = oauth.google.get('userinfo').json()
@@ -600,11 +2685,13 @@ def create_app():
                 db.session.add(user)
                 db.session.commit()
             login_user(user)
+            remember_identity(user)
             return redirect(url_for('index'))
         except Exception as e:
             print(f"[AUTH] ❌ {e}")
             traceback.print_exc()
             try:
+                forget_identity(session.get("_user_id"))
                 logout_user()
             except Exception:
                 pass
@@ -613,6 +2700,7 @@ def create_app():
     @app.route('/logout')
     @login_required
     def logout():
+        forget_identity(current_user.id)
         logout_user()
         return redirect(url_for('index'))
 
@@ -676,6 +2764,14 @@ def create_app():
     @login_required
     def search_details(search_id):
         try:
+            if request.if_none_match:
+                # 304 בלי לטעון את result_json
+                row = SearchHistory.query.with_entities(SearchHistory.prompt_version).filter_by(
+                    id=search_id, user_id=current_user.id
+                ).first()
+                if row is not None and etag_matches(history_etag("s", search_id, row.prompt_version)):
+                    return not_modified_response(history_etag("s", search_id, row.prompt_version))
+
             s = SearchHistory.query.filter_by(id=search_id, user_id=current_user.id).first()
             if not s:
                 return jsonify({"error": "לא נמצא רישום מתאים"}), 404
@@ -690,11 +2786,131 @@ def create_app():
                 "fuel_type": s.fuel_type,
                 "transmission": s.transmission,
             }
-            return jsonify({"meta": meta, "data": json.loads(s.result_json)})
+            response = jsonify({"meta": meta, "data": JSONDocument(s.result_json)})
+            return immutable_history_response(response, history_etag("s", s.id, s.prompt_version))
         except Exception as e:
             print(f"[DETAILS] ❌ {e}")
             return jsonify({"error": "שגיאת שרת בשליפת נתוני חיפוש"}), 500
 
+    @app.route('/advisor-details/<int:advisor_id>')
+    @login_required
+    def advisor_details(advisor_id):
+        try:
+            if request.if_none_match:
+                row = AdvisorHistory.query.with_entities(AdvisorHistory.prompt_version).filter_by(
+                    id=advisor_id, user_id=current_user.id
+                ).first()
+                if row is not None and etag_matches(history_etag("a", advisor_id, row.prompt_version)):
+                    return not_modified_response(history_etag("a", advisor_id, row.prompt_version))
+
+            a = AdvisorHistory.query.filter_by(id=advisor_id, user_id=current_user.id).first()
+            if not a:
+                return jsonify({"error": "לא נמצא רישום מתאים"}), 404
+
+            meta = {
+                "id": a.id,
+                "timestamp": a.timestamp.strftime("%d/%m/%Y %H:%M"),
+            }
+            response = jsonify({
+                "meta": meta,
+                "profile": JSONDocument(a.profile_json),
+                "data": JSONDocument(a.result_json),
+            })
+            return immutable_history_response(response, history_etag("a", a.id, a.prompt_version))
+        except Exception as e:
+            print(f"[DETAILS] ❌ {e}")
+            return jsonify({"error": "שגיאת שרת בשליפת נתוני המלצות"}), 500
+
+    # ===========================
+    # 🔹 Leaderboard – מהאגרגציה בלבד
+    # ===========================
+    @app.route('/api/leaderboard')
+    def leaderboard():
+        level = request.args.get("level", "model")
+        if level not in ("model", "year"):
+            return jsonify({"error": "level חייב להיות model או year"}), 400
+        make = normalize_text(request.args.get("make"))
+        year = request.args.get("year", type=int)
+        min_reports = max(1, request.args.get("min_reports", default=LEADERBOARD_MIN_REPORTS, type=int))
+        limit = max(1, min(request.args.get("limit", default=20, type=int), 100))
+        ascending = request.args.get("order", "desc") == "asc"
+
+        query = ReliabilityAggregate.query.filter(
+            ReliabilityAggregate.reports >= min_reports,
+            ReliabilityAggregate.score_avg.isnot(None),
+        )
+        if level == "model":
+            query = query.filter(ReliabilityAggregate.year == 0)
+        elif year:
+            query = query.filter(ReliabilityAggregate.year == year)
+        else:
+            query = query.filter(ReliabilityAggregate.year != 0)
+        if make:
+            query = query.filter(ReliabilityAggregate.make == make)
+        score_order = ReliabilityAggregate.score_avg.asc() if ascending else ReliabilityAggregate.score_avg.desc()
+        rows = query.order_by(score_order, ReliabilityAggregate.reports.desc()).limit(limit).all()
+
+        response = jsonify({
+            "level": level,
+            "min_reports": min_reports,
+            "items": [dict(rank=i, **reliability_aggregate_to_dict(r)) for i, r in enumerate(rows, start=1)],
+        })
+        response.headers["Cache-Control"] = f"public, max-age={LEADERBOARD_MAX_AGE_SEC}"
+        return response
+
+    # ===========================
+    # 🔹 ייצוא היסטוריה (NDJSON / CSV) – בסטרימינג
+    # ===========================
+    @app.route('/export/history.<fmt>')
+    @login_required
+    def export_history(fmt):
+        if fmt not in ("ndjson", "csv"):
+            return jsonify({"error": "פורמט לא נתמך (ndjson / csv)"}), 404
+        kind = request.args.get("kind", "all")
+        if kind != "all" and kind not in EXPORT_KINDS:
+            return jsonify({"error": "kind חייב להיות all / search / advisor"}), 400
+        kinds = EXPORT_KINDS if kind == "all" else (kind,)
+
+        user_id = current_user.id
+        # צוות התמיכה (בעלי המערכת) יכול לייצא היסטוריה של משתמש אחר
+        target_id = request.args.get("user_id", type=int)
+        target_email = (request.args.get("email") or "").strip().lower()
+        if target_id or target_email:
+            if not is_owner_user():
+                return jsonify({"error": "אין הרשאה"}), 403
+            query = User.query.with_entities(User.id)
+            target = query.filter_by(id=target_id).first() if target_id else query.filter_by(email=target_email).first()
+            if target is None:
+                return jsonify({"error": "משתמש לא נמצא"}), 404
+            user_id = target.id
+
+        filename = f"history-{user_id}-{datetime.now():%Y%m%d}.{fmt}"
+        return Response(
+            stream_with_context(stream_history_export(user_id, kinds, fmt)),
+            mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Cache-Control": "private, no-store",
+                "X-Accel-Buffering": "no",
+            },
+        )
+
+    # ===========================
+    # 🔹 Catalog autocomplete – יצרן/דגם קנוניים
+    # ===========================
+    @app.route('/api/catalog/suggest')
+    def catalog_suggest():
+        query = (request.args.get("q") or "").strip()[:80]
+        make = (request.args.get("make") or "").strip()[:40] or None
+        limit = request.args.get("limit", default=8, type=int)
+        response = jsonify({
+            "query": query,
+            "catalog_version": CATALOG_VERSION,
+            "results": CATALOG_INDEX.suggest(query, limit=limit, make=make),
+        })
+        response.headers["Cache-Control"] = f"public, max-age={CATALOG_SUGGEST_MAX_AGE_SEC}"
+        return response
+
     # ===========================
     # 🔹 Car Advisor – עמוד HTML
     # ===========================
@@ -720,231 +2936,498 @@ def create_app():
         בונה user_profile מלא כמו ב-Car Advisor (Streamlit),
         קורא ל-Gemini 3 Pro, שומר היסטוריה ומחזיר JSON מוכן להצגה.
         """
+        deadline = Deadline()
         try:
             payload = request.get_json(force=True) or {}
         except Exception:
             return jsonify({"error": "קלט JSON לא תקין"}), 400
 
         try:
-            # ---- שלב 1: בסיסי ----
-            budget_min = float(payload.get("budget_min", 0))
-            budget_max = float(payload.get("budget_max", 0))
-            year_min = int(payload.get("year_min", 2000))
-            year_max = int(payload.get("year_max", 2025))
-
-            fuels_he = payload.get("fuels_he") or []
-            gears_he = payload.get("gears_he") or []
-            turbo_choice_he = payload.get("turbo_choice_he", "לא משנה")
-
-            # ---- שלב 2: שימוש וסגנון ----
-            main_use = (payload.get("main_use") or "").strip()
-            annual_km = int(payload.get("annual_km", 15000))
-            driver_age = int(payload.get("driver_age", 21))
-
-            license_years = int(payload.get("license_years", 0))
-            driver_gender = payload.get("driver_gender", "זכר") or "זכר"
-
-            body_style = payload.get("body_style", "כללי") or "כללי"
-            driving_style = payload.get("driving_style", "רגוע ונינוח") or "רגוע ונינוח"
-            seats_choice = payload.get("seats_choice", "5") or "5"
-
-            excluded_colors = payload.get("excluded_colors") or []
-            if isinstance(excluded_colors, str):
-                excluded_colors = [
-                    s.strip() for s in excluded_colors.split(",") if s.strip()
-                ]
-
-            # ---- שלב 3: סדר עדיפויות ----
-            weights = payload.get("weights") or {
-                "reliability": 5,
-                "resale": 3,
-                "fuel": 4,
-                "performance": 2,
-                "comfort": 3,
-            }
+            with stage_timer("advisor", "input"):
+                user_profile = parse_advisor_profile(payload)
+            ensure_advisor_budget()
+        except ApiError as e:
+            return jsonify({"error": e.message}), e.status
 
-            # ---- שלב 4: פרטים נוספים ----
-            insurance_history = payload.get("insurance_history", "") or ""
-            violations = payload.get("violations", "אין") or "אין"
+        user_id = current_user.id
+        if LLM_LANE_MODE != "inline":
+            return jsonify(submit_llm_job("advisor", user_id, {"profile": user_profile})), 202
 
-            family_size = payload.get("family_size", "1-2") or "1-2"
-            cargo_need = payload.get("cargo_need", "בינוני") or "בינוני"
-
-            safety_required = payload.get("safety_required")
-            if not safety_required:
-                safety_required = payload.get("safety_required_radio", "כן")
-            if not safety_required:
-                safety_required = "כן"
-
-            trim_level = payload.get("trim_level", "סטנדרטי") or "סטנדרטי"
-
-            consider_supply = payload.get("consider_supply", "כן") or "כן"
-            consider_market_supply = (consider_supply == "כן")
+        release_db_connection()
+        try:
+            body, status = execute_advisor_llm(user_id, user_profile, deadline)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        return jsonify(body), status
 
-            fuel_price = float(payload.get("fuel_price", 7.0))
-            electricity_price = float(payload.get("electricity_price", 0.65))
+    @app.route('/jobs/<job_id>')
+    @login_required
+    def job_status(job_id):
+        job = LLMJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+        if job is None:
+            return jsonify({"error": "העבודה לא נמצאה"}), 404
+        if job.status in ("pending", "running"):
+            since = job.started_at or job.created_at
+            if (datetime.now() - since).total_seconds() > LLM_JOB_STALE_SEC:
+                # ה-lane מת / לא רץ – לא משאירים את הלקוח לחכות לנצח
+                job.status = "error"
+                job.http_status = 504
+                job.result_json = json.dumps({"error": "הניתוח לא הסתיים בזמן. נסה שוב."}, ensure_ascii=False)
+                job.finished_at = datetime.now()
+                db.session.commit()
+                LLM_JOBS.inc(kind=job.kind, outcome="stale")
+            else:
+                return jsonify({
+                    "job_id": job.id,
+                    "status": job.status,
+                    "poll_url": url_for('job_status', job_id=job.id),
+                    "poll_after_ms": JOB_POLL_AFTER_MS,
+                }), 202
+        return Response(job.result_json, status=job.http_status or 200, mimetype="application/json")
 
-        except Exception as e:
-            return jsonify({"error": f"שגיאת קלט: {e}"}), 400
+    @app.route('/analyze', methods=['POST'])
+    @login_required
+    def analyze_car():
+        deadline = Deadline()
+        user_id = current_user.id
+        try:
+            data = request.get_json(silent=True)
+            print(f"[ANALYZE 0/6] user={user_id} payload: {data}")
+            params = parse_analyze_input(data)
+            try:
+                searches_today = check_user_quota(user_id)
+            except ApiError as e:
+                fallback = quota_fallback_analysis(params) if e.status == 429 else None
+                if fallback is None:
+                    raise
+                return jsonify(fallback)
+            cached = find_cached_analysis(params, revalidate=True)
+            if cached:
+                return jsonify(cached)
+            stale = budget_fallback_analysis(params)
+            if stale:
+                return jsonify(stale)
+        except ApiError as e:
+            return jsonify({"error": e.message}), e.status
 
-        # --- מיפוי דלק/גיר/טורבו מהעברית לערכים לוגיים ---
-        fuels = [fuel_map.get(f, "gasoline") for f in fuels_he] if fuels_he else ["gasoline"]
+        if LLM_LANE_MODE != "inline":
+            job = submit_llm_job("analyze", user_id, {"params": params, "searches_today": searches_today})
+            return jsonify(job), 202
 
-        if "חשמלי" in fuels_he:
-            gears = ["automatic"]
-        else:
-            gears = [gear_map.get(g, "automatic") for g in gears_he] if gears_he else ["automatic"]
-
-        turbo_choice = turbo_map.get(turbo_choice_he, "any")
-
-        # --- בניית user_profile כמו ב-Car Advisor (Streamlit) ---
-        user_profile = make_user_profile(
-            budget_min,
-            budget_max,
-            [year_min, year_max],
-            fuels,
-            gears,
-            turbo_choice,
-            main_use,
-            annual_km,
-            driver_age,
-            family_size,
-            cargo_need,
-            safety_required,
-            trim_level,
-            weights,
-            body_style,
-            driving_style,
-            excluded_colors,
-        )
+        # לא מחזיקים חיבור DB במשך קריאת ה-LLM
+        release_db_connection()
 
-        # שדות נוספים
-        user_profile["license_years"] = license_years
-        user_profile["driver_gender"] = driver_gender
-        user_profile["insurance_history"] = insurance_history
-        user_profile["violations"] = violations
-        user_profile["consider_market_supply"] = consider_market_supply
-        user_profile["fuel_price_nis_per_liter"] = fuel_price
-        user_profile["electricity_price_nis_per_kwh"] = electricity_price
-        user_profile["seats"] = seats_choice
+        # 4–6) AI call + Mileage logic + Save
+        try:
+            body, status = execute_analyze_llm(user_id, params, searches_today, deadline)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        return jsonify(body), status
 
-        parsed = car_advisor_call_gemini_with_search(user_profile)
-        if parsed.get("_error"):
-            return jsonify({"error": parsed["_error"], "raw": parsed.get("_raw")}), 500
+    # ===========================
+    # 🔹 Admin – מצב ה-DB pool
+    # ===========================
+    @app.route('/admin/db-pool')
+    @login_required
+    def admin_db_pool():
+        if not is_owner_user():
+            return jsonify({"error": "אין הרשאה"}), 403
+        engines = {
+            (name or "default"): pool_status(engine)
+            for name, engine in db.engines.items()
+        }
+        return jsonify({"pid": os.getpid(), "stats": pool_stats.snapshot(), "engines": engines})
 
-        result = car_advisor_postprocess(user_profile, parsed)
+    @app.route('/admin/admission', methods=['GET', 'POST'])
+    @login_required
+    def admin_admission():
+        if not is_owner_user():
+            return jsonify({"error": "אין הרשאה"}), 403
+        if request.method == 'POST':
+            try:
+                LLM_ADMISSION.update_settings(request.get_json(silent=True) or {})
+            except (ValueError, TypeError) as e:
+                return jsonify({"error": str(e)}), 400
+        return jsonify(LLM_ADMISSION.status())
 
-        # 🔴 שמירת היסטוריית המלצות למאגר
-        try:
-            rec_log = AdvisorHistory(
-                user_id=current_user.id,
-                profile_json=json.dumps(user_profile, ensure_ascii=False),
-                result_json=json.dumps(result, ensure_ascii=False),
-            )
-            db.session.add(rec_log)
+    @app.route('/admin/cache/invalidate', methods=['GET', 'POST'])
+    @login_required
+    def admin_cache_invalidate():
+        """
+        POST {"make": ..., "model": ..., "prompt_version": ...} – לפחות שדה אחד.
+        השורות לא נמחקות; הן פשוט לא יוגשו יותר מהמטמון (invalidation עצל).
+        """
+        if not is_owner_user():
+            return jsonify({"error": "אין הרשאה"}), 403
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            rule = {k: (str(data[k]).strip() or None) if data.get(k) is not None else None
+                    for k in ("make", "model", "prompt_version")}
+            if not any(rule.values()):
+                return jsonify({"error": "נדרש לפחות אחד מ: make, model, prompt_version"}), 400
+            db.session.add(CacheInvalidation(created_by=current_user.email, **rule))
             db.session.commit()
-        except Exception as e:
-            print(f"[DB] ⚠️ failed to save advisor history: {e}")
-            db.session.rollback()
-
-        return jsonify(result)
+            get_invalidation_rules(force=True)
+            SHARED_CACHE.delete_prefix("analyze:")
+            print(f"[CACHE] 🧹 invalidation added by {current_user.email}: {rule}")
+        rules = CacheInvalidation.query.order_by(CacheInvalidation.created_at.desc()).limit(50).all()
+        return jsonify({
+            "analyze_prompt_version": ANALYZE_PROMPT_VERSION,
+            "advisor_prompt_version": ADVISOR_PROMPT_VERSION,
+            "stale_while_revalidate": CACHE_STALE_WHILE_REVALIDATE,
+            "tiered_cache": SHARED_CACHE.stats(),
+            "rules": [
+                {
+                    "created_at": r.created_at.isoformat(timespec="seconds"),
+                    "make": r.make, "model": r.model, "prompt_version": r.prompt_version,
+                    "created_by": r.created_by,
+                }
+                for r in rules
+            ],
+        })
+
+    @app.route('/admin/llm-usage')
+    @login_required
+    def admin_llm_usage():
+        if not is_owner_user():
+            return jsonify({"error": "אין הרשאה"}), 403
+        usage = get_daily_llm_usage(force=True)
+        return jsonify({
+            "day": usage["day"].isoformat(),
+            "calls": usage["calls"],
+            "tokens": usage["tokens"],
+            "cost_ils": round(usage["cost_ils"], 4),
+            "limits": {
+                "calls": GLOBAL_DAILY_LIMIT,
+                "tokens": GLOBAL_DAILY_TOKEN_BUDGET,
+                "cost_ils": GLOBAL_DAILY_COST_BUDGET_ILS,
+            },
+            "exhausted": llm_budget_exhausted(),
+        })
 
-    @app.route('/analyze', methods=['POST'])
+    # ===========================
+    # 🔹 Analytics לבעלי המערכת – מ-DailyRollup בלבד
+    # ===========================
+    @app.route('/admin/analytics')
     @login_required
-    def analyze_car():
-        # 0) Input
-        try:
-            data = request.json
-            print(f"[ANALYZE 0/6] user={current_user.id} payload: {data}")
-            final_make = normalize_text(data.get('make'))
-            final_model = normalize_text(data.get('model'))
-            final_sub_model = normalize_text(data.get('sub_model'))
-            final_year = int(data.get('year')) if data.get('year') else None
-            final_mileage = str(data.get('mileage_range'))
-            final_fuel = str(data.get('fuel_type'))
-            final_trans = str(data.get('transmission'))
-            if not (final_make and final_model and final_year):
-                return jsonify({"error": "שגיאת קלט (שלב 0): נא למלא יצרן, דגם ושנה"}), 400
-        except Exception as e:
-            return jsonify({"error": f"שגיאת קלט (שלב 0): {str(e)}"}), 400
+    def admin_analytics():
+        if not is_owner_user():
+            return jsonify({"error": "אין הרשאה"}), 403
+        days = max(1, min(request.args.get("days", default=30, type=int), 365))
+        with stage_timer("analytics", "build"):
+            analytics = build_owner_analytics(days)
+        if request.args.get("format") == "json":
+            return jsonify(analytics)
+        return render_template(
+            'admin_analytics.html',
+            analytics=analytics,
+            user=current_user,
+            is_owner=True,
+        )
 
-        # 1) User quota
-        try:
-            today_start = datetime.combine(datetime.today().date(), time.min)
-            today_end = datetime.combine(datetime.today().date(), time.max)
-            user_searches_today = SearchHistory.query.filter(
-                SearchHistory.user_id == current_user.id,
-                SearchHistory.timestamp >= today_start,
-                SearchHistory.timestamp <= today_end
-            ).count()
-            if user_searches_today >= USER_DAILY_LIMIT:
-                return jsonify({"error": f"שגיאת מגבלה (שלב 1): ניצלת את {USER_DAILY_LIMIT} החיפושים היומיים שלך. נסה שוב מחר."}), 429
-        except Exception as e:
-            traceback.print_exc()
-            return jsonify({"error": f"שגיאת שרת (שלב 1): {str(e)}"}), 500
+    # ===========================
+    # 🔹 Metrics (Prometheus text)
+    # ===========================
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+    METRICS_ALLOWED_IPS = {
+        ip.strip()
+        for ip in os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",")
+        if ip.strip()
+    }
 
-        # 2–3) Cache
-        try:
-            cutoff_date = datetime.now() - timedelta(days=MAX_CACHE_DAYS)
-            cached = SearchHistory.query.filter(
-                SearchHistory.make == final_make,
-                SearchHistory.model == final_model,
-                SearchHistory.year == final_year,
-                SearchHistory.mileage_range == final_mileage,
-                SearchHistory.fuel_type == final_fuel,
-                SearchHistory.transmission == final_trans,
-                SearchHistory.timestamp >= cutoff_date
-            ).order_by(SearchHistory.timestamp.desc()).first()
-            if cached:
-                result = json.loads(cached.result_json)
-                result['source_tag'] = f"מקור: מטמון DB (נשמר ב-{cached.timestamp.strftime('%Y-%m-%d')})"
-                return jsonify(result)
-        except Exception as e:
-            print(f"[CACHE] ⚠️ {e}")
+    def _pool_gauges():
+        rows = []
+        for name, engine in db.engines.items():
+            for key, value in pool_status(engine).items():
+                if isinstance(value, (int, float)):
+                    rows.append(((name or "default", key), value))
+        return rows
 
-        # 4) AI call
-        try:
-            prompt = build_prompt(
-                final_make, final_model, final_sub_model, final_year,
-                final_fuel, final_trans, final_mileage
-            )
-            model_output = call_model_with_retry(prompt)
-        except Exception as e:
-            traceback.print_exc()
-            return jsonify({"error": f"שגיאת AI (שלב 4): {str(e)}"}), 500
+    METRICS.gauge_callback(
+        "car_db_pool_connections", "Current DB pool state per engine", ("engine", "state"), _pool_gauges
+    )
+    METRICS.gauge_callback(
+        "car_db_pool_stat", "Cumulative DB pool counters (per process, summed)", ("stat",),
+        lambda: [((k,), v) for k, v in pool_stats.snapshot().items() if k != "wait_avg_ms"],
+    )
 
-        # 5) Mileage logic
-        model_output, note = apply_mileage_logic(model_output, final_mileage)
+    METRICS.gauge_callback(
+        "car_llm_admission_in_flight", "LLM calls currently holding a slot (per process, summed)", (),
+        lambda: [((), LLM_ADMISSION.in_flight)],
+    )
+    METRICS.gauge_callback(
+        "car_llm_admission_queue_depth", "Requests waiting for an LLM slot (per process, summed)", (),
+        lambda: [((), LLM_ADMISSION.waiting)],
+    )
 
-        # 6) Save
-        try:
-            new_log = SearchHistory(
-                user_id=current_user.id,
-                make=final_make,
-                model=final_model,
-                year=final_year,
-                mileage_range=final_mileage,
-                fuel_type=final_fuel,
-                transmission=final_trans,
-                result_json=json.dumps(model_output, ensure_ascii=False)
-            )
-            db.session.add(new_log)
-            db.session.commit()
-        except Exception as e:
-            print(f"[DB] ⚠️ save failed: {e}")
-            db.session.rollback()
+    def _lane_gauges():
+        lane = get_llm_lane()
+        if lane is None:
+            return []
+        return [
+            ((lane.name, "busy"), lane.busy),
+            ((lane.name, "queued"), lane.queued),
+            ((lane.name, "capacity"), lane.capacity),
+        ]
+
+    METRICS.gauge_callback(
+        "car_lane_threads", "Execution lane saturation (per process, summed)", ("lane", "state"), _lane_gauges
+    )
 
-        model_output['source_tag'] = f"מקור: ניתוח AI חדש (חיפוש {user_searches_today + 1}/{USER_DAILY_LIMIT})"
-        model_output['mileage_note'] = note
-        model_output['km_warn'] = False
-        return jsonify(model_output)
+    @app.route('/metrics')
+    def metrics():
+        auth_header = request.headers.get("Authorization", "")
+        allowed = (
+            (METRICS_TOKEN and auth_header == f"Bearer {METRICS_TOKEN}")
+            or request.remote_addr in METRICS_ALLOWED_IPS
+            or is_owner_user()
+        )
+        if not allowed:
+            return jsonify({"error": "אין הרשאה"}), 403
+        return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started_at = pytime.perf_counter()
+
+    @app.after_request
+    def observe_request_latency(response):
+        started = g.get("request_started_at")
+        if started is not None and request.endpoint not in (None, "static", "metrics"):
+            HTTP_LATENCY.observe(
+                pytime.perf_counter() - started,
+                endpoint=request.endpoint, method=request.method, status=response.status_code,
+            )
+            METRICS.flush()
+        return response
 
     @app.cli.command("init-db")
     def init_db_command():
         with app.app_context():
             db.create_all()
+            ensure_schema_columns()
         print("Initialized the database tables.")
 
+    @app.cli.command("workload-extract")
+    @click.option("--out", default="workload.json", show_default=True)
+    @click.option("--days", default=90, show_default=True, type=int)
+    def workload_extract_command(out, days):
+        """מודל עומס אנונימי מ-SearchHistory/AdvisorHistory (ל-workload.py replay/simulate)."""
+        lift_statement_timeout(db.engine)
+        workload = extract_workload(SearchHistory, AdvisorHistory, days=days)
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(workload, f, ensure_ascii=False, indent=2)
+        src = workload["source"]
+        print(f"[WORKLOAD] ✅ {src['searches']} searches / {src['distinct_keys']} keys "
+              f"/ {src['advisor_requests']} advisor requests -> {out}")
+
+    @app.cli.command("run-llm-lane")
+    @click.option("--threads", default=LLM_LANE_THREADS, show_default=True, type=int)
+    @click.option("--poll-interval", default=1.0, show_default=True, type=float)
+    def run_llm_lane_command(threads, poll_interval):
+        """תהליך lane נפרד: מושך LLMJob-ים במצב pending ומריץ אותם (LLM_LANE_MODE=queue)."""
+        if LLM_LANE_MODE != "queue":
+            # במצבים האחרים אף אחד לא יוצר jobs בשביל התהליך הזה – לא מתשאלים את ה-DB סתם
+            print(f"[LANE] LLM_LANE_MODE={LLM_LANE_MODE} – nothing to run (set LLM_LANE_MODE=queue)")
+            return
+        init_worker_resources(app)
+        lane = LaneExecutor("llm", threads)
+        _worker_state["llm_lane"] = lane
+        worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        last_purge = 0.0
+        print(f"[LANE] 🚀 {worker_name} running with {threads} threads")
+        try:
+            while True:
+                job_id = None
+                if lane.has_capacity():
+                    try:
+                        job_id = claim_llm_job(worker_name)
+                    except Exception as e:
+                        print(f"[LANE] ⚠️ claim failed: {e}")
+                        db.session.rollback()
+                    finally:
+                        db.session.close()
+                if job_id:
+                    lane.submit(_run_llm_job_in_context, app, job_id)
+                    continue
+                if pytime.monotonic() - last_purge > 3600:
+                    last_purge = pytime.monotonic()
+                    print(f"[LANE] 🧹 purged {purge_finished_llm_jobs()} finished jobs")
+                METRICS.flush()
+                pytime.sleep(poll_interval)
+        except KeyboardInterrupt:
+            print("[LANE] stopping – waiting for running jobs")
+        finally:
+            lane.shutdown(wait=True)
+            METRICS.flush(force=True)
+
+    @app.cli.command("compression-train")
+    @click.option("--samples", default=2000, show_default=True, type=int)
+    @click.option("--size", default=64 * 1024, show_default=True, type=int, help="גודל המילון בבתים")
+    @click.option("--algo", default=RESULT_COMPRESSION, show_default=True, type=click.Choice(["zstd", "zlib"]))
+    def compression_train_command(samples, size, algo):
+        """מאמן מילון דחיסה משותף מהשורות האחרונות ומפעיל אותו (workers קיימים – אחרי restart)."""
+        lift_statement_timeout(db.engine)
+        docs = []
+        per_column = max(1, samples // len(COMPRESSED_COLUMNS))
+        for model_cls, column in COMPRESSED_COLUMNS:
+            col = getattr(model_cls, column)
+            docs.extend(v for (v,) in model_cls.query.with_entities(col)
+                        .order_by(model_cls.id.desc()).limit(per_column).yield_per(500))
+        data = train_dictionary(docs, algo, size)
+        row = CompressionDictionary(algo=algo, sample_count=len(docs), data=data)
+        db.session.add(row)
+        db.session.commit()
+        DICTIONARIES.register(row.id, algo, data)
+        print(f"[COMPRESS] ✅ trained {algo} dictionary #{row.id}: {len(data)} bytes from {len(docs)} samples")
+
+    @app.cli.command("compression-binary-columns")
+    def compression_binary_columns_command():
+        """
+        חד-פעמי (Postgres): עמודות CompressedText מ-TEXT ל-BYTEA. נועל וכותב מחדש את הטבלאות –
+        להריץ בחלון תחזוקה, לפני פריסת workers עם הקוד החדש (הם לא עולים כל עוד העמודה TEXT).
+        """
+        if not text_compressed_columns():
+            print("[DB] compressed columns are already binary")
+            return
+        convert_compressed_columns_to_binary()
+
+    @app.cli.command("compression-migrate")
+    @click.option("--batch", default=500, show_default=True, type=int)
+    def compression_migrate_command(batch):
+        """
+        כותב מחדש שורות קיימות בפורמט הבינארי עם המילון הפעיל (שורות TEXT/base64 ישנות,
+        לא דחוסות, או דחוסות במילון קודם), בבאצ'ים לפי id.
+        """
+        pending = text_compressed_columns()
+        if pending:
+            raise click.ClickException("עמודות TEXT – קודם: flask --app app compression-binary-columns")
+        lift_statement_timeout(db.engine)  # הסריקה head != prefix עוברת על כל הטבלה
+        prefix = compression_prefix()
+        for model_cls, column in COMPRESSED_COLUMNS:
+            table = model_cls.__table__
+            raw_col = type_coerce(table.c[column], db.LargeBinary)  # הבתים כמו שהם ב-DB, בלי פענוח
+            head = db.func.substr(raw_col, 1, len(prefix), type_=db.LargeBinary)
+            last_id, changed, raw_bytes, stored_bytes = 0, 0, 0, 0
+            while True:
+                rows = db.session.execute(
+                    sa_select(table.c.id, table.c[column])
+                    .where(table.c.id > last_id, head != prefix)
+                    .order_by(table.c.id.asc()).limit(batch)
+                ).all()
+                if not rows:
+                    break
+                for row_id, text in rows:
+                    db.session.execute(sa_update(table).where(table.c.id == row_id).values({column: text}))
+                    raw_bytes += len(text.encode("utf-8"))
+                last_id = rows[-1][0]
+                changed += len(rows)
+                db.session.commit()
+                stored_bytes += db.session.execute(
+                    sa_select(db.func.coalesce(db.func.sum(db.func.length(raw_col)), 0))
+                    .where(table.c.id.in_([r[0] for r in rows]))
+                ).scalar()
+                print(f"[COMPRESS] {table.name}.{column}: {changed} rows (up to id {last_id})")
+            ratio = f"{raw_bytes / stored_bytes:.2f}x" if stored_bytes else "-"
+            print(f"[COMPRESS] ✅ {table.name}.{column}: {changed} rows, {raw_bytes} -> {stored_bytes} bytes ({ratio})")
+
+    @app.cli.command("reliability-aggregates-rebuild")
+    @click.option("--batch", default=500, show_default=True, type=int)
+    def reliability_aggregates_rebuild_command(batch):
+        """
+        בונה מחדש את ReliabilityAggregate מכל SearchHistory (backfill / תיקון סטייה).
+        שימו לב: אחרי retention נבנה רק ממה שנשאר ב-DB, בעוד שהעדכון המצטבר זוכר גם דוחות שאורכבו.
+        """
+        lift_statement_timeout(db.engine)
+        aggregates: Dict[tuple, ReliabilityAggregate] = {}
+        rows = db.session.execute(
+            sa_select(SearchHistory.make, SearchHistory.model, SearchHistory.year, SearchHistory.result_json)
+            .order_by(SearchHistory.id.asc())
+            .execution_options(yield_per=batch)
+        )
+        count = 0
+        for make, model, year, result_json in rows:
+            try:
+                sample = extract_reliability_sample(json.loads(result_json))
+            except Exception:
+                continue
+            for y in ((year, 0) if year else (0,)):
+                key = (make or "", model or "", y)
+                if key not in aggregates:
+                    aggregates[key] = new_reliability_aggregate(*key)
+                apply_reliability_sample(aggregates[key], sample)
+            count += 1
+        rows.close()
+        # מחליפים את כל הטבלה בטרנזקציה אחת
+        ReliabilityAggregate.query.delete(synchronize_session=False)
+        db.session.add_all(aggregates.values())
+        db.session.commit()
+        print(f"[AGG] ✅ rebuilt {len(aggregates)} aggregates from {count} reports")
+
+    @app.cli.command("analytics-rollup")
+    @click.option("--since", default=None, help="YYYY-MM-DD – חישוב מחדש מתאריך (ברירת מחדל: מה-watermark)")
+    def analytics_rollup_command(since):
+        """
+        מעדכן את DailyRollup מההיסטוריה (backfill / cron).
+        שימו לב: --since על חודשים שכבר אורכבו (retention) ימחק את ה-rollups שלהם.
+        """
+        start = datetime.strptime(since, "%Y-%m-%d").date() if since else None
+        lift_statement_timeout(db.engine)
+        result = refresh_daily_rollups(since=start)
+        print(f"[ROLLUP] ✅ {json.dumps(result, ensure_ascii=False)}")
+
+    @app.cli.group("history-partitions")
+    def history_partitions_cli():
+        """partitions חודשיים, retention וארכוב של טבלאות ההיסטוריה."""
+
+    @history_partitions_cli.command("migrate")
+    def history_partitions_migrate_command():
+        """המרה חד-פעמית לטבלאות partitioned (Postgres, נועל את הטבלאות)."""
+        for table in HISTORY_TABLES:
+            if history_partitions.migrate_to_partitioned(db.engine, table.name):
+                print(f"[DB] ✅ {table.name} is now partitioned by month")
+            else:
+                print(f"[DB] {table.name} already partitioned")
+
+    @history_partitions_cli.command("ensure")
+    @click.option("--months-ahead", default=history_partitions.HISTORY_PREMAKE_MONTHS, show_default=True, type=int)
+    def history_partitions_ensure_command(months_ahead):
+        through = history_partitions.add_months(history_partitions.month_start(datetime.now()), months_ahead)
+        for table in HISTORY_TABLES:
+            created = history_partitions.ensure_partitions(db.engine, table.name, through)
+            print(f"[DB] {table.name}: {len(created)} partitions created {created or ''}")
+
+    @history_partitions_cli.command("retain")
+    @click.option("--months", default=history_partitions.HISTORY_RETENTION_MONTHS, show_default=True, type=int,
+                  help="חודשים שלמים לשמור (0 = ללא retention)")
+    @click.option("--archive-dir", default=history_partitions.HISTORY_ARCHIVE_DIR, show_default=True)
+    @click.option("--dry-run", is_flag=True)
+    def history_partitions_retain_command(months, archive_dir, dry_run):
+        """מארכב ל-NDJSON.gz ומסיר את מה שישן מ---months."""
+        if months <= 0:
+            print("[DB] retention disabled (HISTORY_RETENTION_MONTHS=0)")
+            return
+        for table in HISTORY_TABLES:
+            for action in history_partitions.retain(db.engine, table, months, archive_dir, dry_run):
+                print(f"[DB] {'(dry-run) ' if dry_run else ''}{json.dumps(action, ensure_ascii=False)}")
+
+    @history_partitions_cli.command("status")
+    def history_partitions_status_command():
+        for table in HISTORY_TABLES:
+            print(json.dumps(history_partitions.status(db.engine, table), ensure_ascii=False, indent=2))
+
+    # אתחול עצל per-worker (no-op אם post_fork כבר הריץ אותו)
+    @app.before_request
+    def ensure_worker_initialized():
+        init_worker_resources(app)
+
+    # טעינה וקומפילציה של כל ה-templates מראש – נשארים בזיכרון המשותף אחרי fork
+    for template_name in app.jinja_env.list_templates():
+        try:
+            app.jinja_env.get_template(template_name)
+        except Exception as e:
+            print(f"[BOOT] ⚠️ template precompile failed ({template_name}): {e}")
+
     return app
 
 
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# 🚗 Car Reliability Analyzer – ASGI entry point (async LLM I/O)
+#
+# /analyze ו-/advisor_api רצים כאן כ-coroutines שממתינים לגרסאות ה-async
+# של ה-SDK-ים של Gemini, כך שתהליך אחד מחזיק מאות קריאות LLM במקביל.
+# כל שאר ה-routes (עמודים, דשבורד, auth) רצים כרגיל ב-Flask (WSGI)
+# על thread pool נפרד.
+#
+# הרצה:
+#   uvicorn asgi:application --port 8000
+#   gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:application
+# ===================================================================
+
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request, jsonify
+from flask_login import current_user
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from admission import LLM_ADMISSION, AdmissionRejected
+from deadline import Deadline, DeadlineExceeded, is_timeout_error
+from metrics import stage_timer
+from app import (
+    app as flask_app,
+    ApiError,
+    overloaded_response,
+    LLM_LANE_MODE,
+    submit_llm_job,
+    init_worker_resources,
+    SchemaNotReady,
+    parse_analyze_input,
+    check_user_quota,
+    find_cached_analysis,
+    budget_fallback_analysis,
+    deadline_fallback_analysis,
+    quota_fallback_analysis,
+    llm_error_fallback,
+    advisor_timeout_error,
+    ensure_advisor_budget,
+    build_analyze_prompt,
+    finalize_analysis,
+    release_db_connection,
+    call_model_with_retry_async,
+    parse_advisor_profile,
+    car_advisor_call_gemini_with_search_async,
+    car_advisor_postprocess,
+    save_advisor_history,
+)
+
+# threads לעמודים הרגילים (WSGI) – נפרד מה-event loop
+ASGI_PAGE_THREADS = int(os.environ.get("ASGI_PAGE_THREADS", 8))
+_page_executor = ThreadPoolExecutor(max_workers=ASGI_PAGE_THREADS, thread_name_prefix="asgi-wsgi")
+# תגובות WSGI נשלחות בחבילות של עד כמה KB (export בזרימה לא נאסף כולו לזיכרון)
+ASGI_STREAM_CHUNK_BYTES = int(os.environ.get("ASGI_STREAM_CHUNK_BYTES", 64 * 1024))
+
+# אותה תצורת ProxyFix כמו ב-create_app, אבל מחזירה רק את ה-environ המתוקן
+_pf = flask_app.wsgi_app
+_fix_environ = ProxyFix(
+    lambda environ, start_response: environ,
+    x_for=_pf.x_for, x_proto=_pf.x_proto, x_host=_pf.x_host,
+    x_port=_pf.x_port, x_prefix=_pf.x_prefix,
+)
+
+
+# ==================================
+# === Async views ===
+# ==================================
+async def analyze_async():
+    deadline = Deadline()
+    try:
+        data = request.get_json(silent=True)
+        user_id = current_user.id
+        print(f"[ANALYZE 0/6] user={user_id} payload: {data} (async)")
+        params = parse_analyze_input(data)
+        try:
+            searches_today = await asyncio.to_thread(check_user_quota, user_id)
+        except ApiError as e:
+            fallback = await asyncio.to_thread(quota_fallback_analysis, params) if e.status == 429 else None
+            if fallback is None:
+                raise
+            return jsonify(fallback)
+        cached = await asyncio.to_thread(find_cached_analysis, params, revalidate=True)
+        if cached:
+            return jsonify(cached)
+        stale = await asyncio.to_thread(budget_fallback_analysis, params)
+        if stale:
+            return jsonify(stale)
+    except ApiError as e:
+        return jsonify({"error": e.message}), e.status
+
+    if LLM_LANE_MODE != "inline":
+        job = await asyncio.to_thread(
+            submit_llm_job, "analyze", user_id, {"params": params, "searches_today": searches_today}
+        )
+        return jsonify(job), 202
+
+    # לא מחזיקים חיבור DB בזמן ההמתנה ל-LLM
+    await asyncio.to_thread(release_db_connection)
+
+    # 4) AI call
+    try:
+        async with LLM_ADMISSION.aslot("analyze", max_wait=deadline.queue_budget()):
+            with stage_timer("analyze", "ai_call"):
+                model_output = await call_model_with_retry_async(build_analyze_prompt(params), user_id, deadline)
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except DeadlineExceeded:
+        body, status = await asyncio.to_thread(deadline_fallback_analysis, params)
+        return jsonify(body), status
+    except Exception as e:
+        if is_timeout_error(e.__cause__ or e) and deadline.queue_budget() <= 0:
+            body, status = await asyncio.to_thread(deadline_fallback_analysis, params)
+            return jsonify(body), status
+        body, status = await asyncio.to_thread(llm_error_fallback, params, e)
+        return jsonify(body), status
+
+    # 5–6) Mileage logic + Save
+    result = await asyncio.to_thread(finalize_analysis, user_id, params, model_output, searches_today)
+    return jsonify(result)
+
+
+async def advisor_api_async():
+    deadline = Deadline()
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({"error": "קלט JSON לא תקין"}), 400
+    try:
+        with stage_timer("advisor", "input"):
+            user_profile = parse_advisor_profile(payload)
+        await asyncio.to_thread(ensure_advisor_budget)
+    except ApiError as e:
+        return jsonify({"error": e.message}), e.status
+
+    user_id = current_user.id
+    if LLM_LANE_MODE != "inline":
+        job = await asyncio.to_thread(submit_llm_job, "advisor", user_id, {"profile": user_profile})
+        return jsonify(job), 202
+
+    await asyncio.to_thread(release_db_connection)
+
+    try:
+        async with LLM_ADMISSION.aslot("advisor", max_wait=deadline.queue_budget()):
+            with stage_timer("advisor", "ai_call"):
+                parsed = await car_advisor_call_gemini_with_search_async(user_profile, user_id, deadline)
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    if parsed.get("_timeout"):
+        return jsonify(advisor_timeout_error()), 504
+    if parsed.get("_error"):
+        return jsonify({"error": parsed["_error"], "raw": parsed.get("_raw")}), 500
+
+    with stage_timer("advisor", "postprocess"):
+        result = car_advisor_postprocess(user_profile, parsed)
+    await asyncio.to_thread(save_advisor_history, user_id, user_profile, result)
+    return jsonify(result)
+
+
+# (method, path) -> (view, login_required)
+ASYNC_ROUTES = {
+    ("POST", "/analyze"): (analyze_async, True),
+    ("POST", "/advisor_api"): (advisor_api_async, True),
+}
+
+
+# ==================================
+# === ASGI <-> WSGI glue ===
+# ==================================
+def _build_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            key = "CONTENT_TYPE"
+        elif name == "CONTENT_LENGTH":
+            key = "CONTENT_LENGTH"
+        else:
+            key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _start_message(status: int, headers) -> dict:
+    return {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers],
+    }
+
+
+async def _send_response(send, status: int, headers, body: bytes) -> None:
+    await send(_start_message(status, headers))
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _run_async_view(scope, body: bytes, view, needs_login: bool, send) -> None:
+    environ = _fix_environ(_build_environ(scope, body), None)
+    with flask_app.request_context(environ):
+        try:
+            rv = await asyncio.to_thread(flask_app.preprocess_request)
+            if rv is None and needs_login:
+                # טעינת המשתמש (DB) מחוץ ל-event loop
+                is_authenticated = await asyncio.to_thread(lambda: current_user.is_authenticated)
+                if not is_authenticated:
+                    rv = flask_app.login_manager.unauthorized()
+            if rv is None:
+                rv = await view()
+            response = flask_app.make_response(rv)
+        except Exception as e:
+            try:
+                rv = flask_app.handle_user_exception(e)
+            except Exception as unhandled:
+                rv = flask_app.handle_exception(unhandled)
+            response = flask_app.make_response(rv)
+        response = flask_app.process_response(response)
+        body_out = response.get_data()
+        await _send_response(send, response.status_code, response.headers.items(), body_out)
+
+
+async def _run_wsgi(scope, body: bytes, send) -> None:
+    environ = _build_environ(scope, body)
+    state = {}
+
+    def start_response(status, headers, exc_info=None):
+        state["status"] = int(status.split(" ", 1)[0])
+        state["headers"] = headers
+
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message: dict) -> None:
+        # ממתינים לשליחה – backpressure מול לקוח איטי
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        # כל האיטרציה באותו thread: stream_with_context פותח request context
+        # בתחילת ה-generator וחייב לסגור אותו באותו thread
+        result = flask_app.wsgi_app(environ, start_response)
+        try:
+            started = False
+            chunks, size = [], 0
+            for chunk in result:
+                if not chunk:
+                    continue
+                chunks.append(chunk)
+                size += len(chunk)
+                if size < ASGI_STREAM_CHUNK_BYTES:
+                    continue
+                if not started:
+                    send_from_thread(_start_message(state["status"], state["headers"]))
+                    started = True
+                send_from_thread({"type": "http.response.body", "body": b"".join(chunks), "more_body": True})
+                chunks, size = [], 0
+            if not started:
+                send_from_thread(_start_message(state["status"], state["headers"]))
+            send_from_thread({"type": "http.response.body", "body": b"".join(chunks)})
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+    await loop.run_in_executor(_page_executor, run)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.to_thread(init_worker_resources, flask_app)
+            except SchemaNotReady as e:
+                # uvicorn יוצא במקום לשרת עם סכמה ישנה
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _page_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    body = await _read_body(receive)
+    route = ASYNC_ROUTES.get((scope["method"], scope["path"]))
+    if route:
+        view, needs_login = route
+        await _run_async_view(scope, body, view, needs_login, send)
+    else:
+        await _run_wsgi(scope, body, send)
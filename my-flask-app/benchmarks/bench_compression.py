@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Benchmark לדחיסת result_json: נפח אחסון + latency של קריאה
+#
+#   python benchmarks/bench_compression.py --docs 5000
+#   python benchmarks/bench_compression.py --db-url postgresql://... --docs 20000 --out bench_results/compress.json
+#
+# מסמכים: מ-DB אמיתי (--db-url, עמודות search_history.result_json ו-
+# advisor_history.result_json כמו שהן – גם שורות שכבר דחוסות נפתחות)
+# או מסמכי סימולציה של FakeLLMBackend. המילון מאומן על 20% מהמסמכים
+# ונמדד על השאר. read latency = SELECT מטבלת sqlite זמנית + פענוח.
+# ===================================================================
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time as pytime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+sys.path.insert(0, APP_DIR)
+
+import compressed_json as cj  # noqa: E402
+
+
+def load_docs(db_url: str, limit: int) -> list:
+    from sqlalchemy import create_engine, text
+    engine = create_engine(db_url)
+    docs = []
+    with engine.connect() as conn:
+        for table in ("search_history", "advisor_history"):
+            rows = conn.execute(text(f"SELECT result_json FROM {table} ORDER BY id DESC LIMIT :n"), {"n": limit})
+            docs.extend(cj.decompress_text(r[0]) for r in rows)
+    return docs[:limit]
+
+
+def fake_docs(n: int, seed: int) -> list:
+    from llm_backends import FakeLLMBackend
+    rng = random.Random(seed)
+    fake = FakeLLMBackend()
+    makes = ["Toyota Corolla", "Hyundai i30", "Kia Picanto", "Mazda 3", "Skoda Octavia", "Suzuki Swift"]
+    docs = []
+    for i in range(n):
+        if i % 10 == 0:
+            docs.append(fake.render_advisor(""))
+        else:
+            docs.append(fake.render_report(f"רכב: {rng.choice(makes)} {rng.randint(2008, 2024)} #{i}"))
+    return docs
+
+
+def bench_config(name: str, algo: str, dict_id: int, docs: list, tmpdir: str) -> dict:
+    # המילון הפעיל נקבע לפי dict_id (0 = ללא מילון)
+    cj.DICTIONARIES._active[algo] = dict_id if algo != "off" else 0
+    raw_bytes = sum(len(d.encode("utf-8")) for d in docs)
+
+    t0 = pytime.perf_counter()
+    stored = [cj.compress_text(d, algo) if algo != "off" else d.encode("utf-8") for d in docs]
+    compress_sec = pytime.perf_counter() - t0
+    stored_bytes = sum(len(s) for s in stored)
+
+    path = os.path.join(tmpdir, f"{name}.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE docs (id INTEGER PRIMARY KEY, body BLOB)")
+    conn.executemany("INSERT INTO docs (body) VALUES (?)", [(s,) for s in stored])
+    conn.commit()
+    conn.close()
+    file_bytes = os.path.getsize(path)
+
+    conn = sqlite3.connect(path)
+    t0 = pytime.perf_counter()
+    for (body,) in conn.execute("SELECT body FROM docs"):
+        json.loads(cj.decompress_text(body))
+    read_sec = pytime.perf_counter() - t0
+    conn.close()
+
+    n = len(docs)
+    return {
+        "raw_bytes": raw_bytes,
+        "stored_bytes": stored_bytes,
+        "ratio": round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+        "sqlite_file_bytes": file_bytes,
+        "compress_us_per_doc": round(compress_sec / n * 1e6, 2),
+        "read_decode_us_per_doc": round(read_sec / n * 1e6, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="result_json compression benchmark")
+    parser.add_argument("--db-url", default="", help="ברירת מחדל: מסמכי סימולציה")
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--dict-size", type=int, default=64 * 1024)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+
+    docs = load_docs(args.db_url, args.docs) if args.db_url else fake_docs(args.docs, args.seed)
+    random.Random(args.seed).shuffle(docs)
+    split = max(1, len(docs) // 5)
+    train, test = docs[:split], docs[split:]
+    print(f"[BENCH] {len(docs)} docs ({len(train)} train / {len(test)} measured)")
+
+    algos = ["zlib"] + (["zstd"] if cj.zstandard is not None else [])
+    configs = [("raw", "off", 0)]
+    for i, algo in enumerate(algos, start=1):
+        cj.DICTIONARIES.register(1000 + i, algo, cj.train_dictionary(train, algo, args.dict_size), activate=False)
+        configs += [(algo, algo, 0), (f"{algo}+dict", algo, 1000 + i)]
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="car-compress-") as tmpdir:
+        for name, algo, dict_id in configs:
+            results[name] = bench_config(name, algo, dict_id, test, tmpdir)
+            r = results[name]
+            print(f"[BENCH] {name:<10} ratio {r['ratio']:>6}x  stored {r['stored_bytes']:>12}  "
+                  f"compress {r['compress_us_per_doc']:>8}us  read+decode {r['read_decode_us_per_doc']:>8}us")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"[BENCH] ✅ results -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
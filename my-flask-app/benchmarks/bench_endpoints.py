@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# End-to-end benchmark ל-endpoints של Flask
+#
+#   python benchmarks/bench_endpoints.py --rows 100000 --out bench_results/before.json
+#   python benchmarks/bench_endpoints.py --db-url postgresql://... --rows 1000000
+#   python benchmarks/bench_endpoints.py --compare bench_results/before.json bench_results/after.json
+#
+# האפליקציה רצה in-process (Flask test client) מול sqlite (ברירת מחדל,
+# קובץ זמני) או Postgres מקומי, עם LLM_BACKEND=fake. ה-DB נזרע ב-
+# SearchHistory / AdvisorHistory בנפחים מציאותיים, ואז נמדדים throughput
+# ו-percentiles לכל תרחיש. התוצאות נכתבות כ-JSON להשוואת לפני/אחרי.
+# ===================================================================
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time as pytime
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+
+MILEAGE_RANGES = ["0-50K", "50-100K", "100-150K", "150-200K", "200K+"]
+FUEL_TYPES = ["בנזין", "היברידי", "דיזל", "חשמלי"]
+TRANSMISSIONS = ["אוטומטית", "ידנית"]
+
+ADVISOR_PAYLOAD = {
+    "budget_min": 60000, "budget_max": 110000, "year_min": 2016, "year_max": 2021,
+    "fuels_he": ["בנזין", "היברידי"], "gears_he": ["אוטומטית"], "turbo_choice_he": "לא משנה",
+    "main_use": "נסיעות עירוניות", "annual_km": 15000, "driver_age": 30,
+    "family_size": "3-4", "cargo_need": "בינוני", "weights": {"reliability": 5, "fuel": 4},
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies, errors, duration):
+    lat = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "duration_sec": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 2) if duration > 0 else None,
+        "latency_ms": {
+            "mean": ms(sum(lat) / len(lat)) if lat else None,
+            "p50": ms(percentile(lat, 50)),
+            "p90": ms(percentile(lat, 90)),
+            "p95": ms(percentile(lat, 95)),
+            "p99": ms(percentile(lat, 99)),
+            "max": ms(lat[-1]) if lat else None,
+        },
+    }
+
+
+# ==================================
+# === Seeding ===
+# ==================================
+def catalog_keys(catalog):
+    keys = []
+    for make, models in catalog.items():
+        for model_str in models:
+            model = model_str.split("(")[0].strip()
+            keys.append((make, model))
+    return keys
+
+
+def seed(app_module, rows, advisor_rows, users, heavy_user_rows, seed_value):
+    from sqlalchemy import insert
+
+    app, db = app_module.app, app_module.db
+    User, SearchHistory, AdvisorHistory = app_module.User, app_module.SearchHistory, app_module.AdvisorHistory
+    rng = random.Random(seed_value)
+    fake = app_module.create_llm_backend("fake")
+    normalize = app_module.normalize_text
+
+    keys = catalog_keys(app_module.israeli_car_market_full_compilation)
+    # פופולריות בסגנון Zipf – מעט דגמים מקבלים את רוב החיפושים
+    weights = [1.0 / (i + 1) for i in range(len(keys))]
+    rng.shuffle(keys)
+
+    with app.app_context():
+        db.create_all()
+        t0 = pytime.perf_counter()
+        db.session.execute(insert(User), [
+            {"google_id": f"bench-{i}", "email": f"bench{i}@example.invalid", "name": f"Bench {i}"}
+            for i in range(users + 2)
+        ])
+        db.session.commit()
+        user_ids = [u.id for u in User.query.order_by(User.id).all()]
+        heavy_user_id, probe_user_id = user_ids[-2], user_ids[-1]
+        seed_users = user_ids[:-2]
+
+        docs = {}
+        now = datetime.now()
+        hot_keys = []
+        batch = []
+
+        def flush():
+            if batch:
+                db.session.execute(insert(SearchHistory), batch)
+                db.session.commit()
+                batch.clear()
+
+        total = rows + heavy_user_rows
+        for i in range(total):
+            make, model = rng.choices(keys, weights=weights)[0]
+            year = rng.randint(2008, 2024)
+            mileage = rng.choice(MILEAGE_RANGES)
+            fuel = rng.choice(FUEL_TYPES)
+            trans = rng.choice(TRANSMISSIONS)
+            key = (normalize(make), normalize(model), year, mileage, fuel, trans)
+            if key not in docs:
+                prompt = app_module.build_prompt(make, model, "", year, fuel, trans, mileage)
+                docs[key] = fake.render_report(prompt)
+            # לא זורעים חיפושים של היום כדי לא להפעיל את מגבלת המשתמש
+            ts = now - timedelta(days=rng.uniform(1, 120))
+            if ts >= now - timedelta(days=app_module.MAX_CACHE_DAYS - 1) and len(hot_keys) < 200:
+                hot_keys.append(key)
+            batch.append({
+                "user_id": heavy_user_id if i >= rows else rng.choice(seed_users),
+                "timestamp": ts,
+                "make": key[0], "model": key[1], "year": year,
+                "mileage_range": mileage, "fuel_type": fuel, "transmission": trans,
+                "result_json": docs[key],
+                "prompt_version": app_module.ANALYZE_PROMPT_VERSION,
+            })
+            if len(batch) >= 5000:
+                flush()
+        flush()
+
+        profile = json.dumps(ADVISOR_PAYLOAD, ensure_ascii=False)
+        advisor_doc = fake.render_advisor("")
+        for start in range(0, advisor_rows, 5000):
+            db.session.execute(insert(AdvisorHistory), [
+                {
+                    "user_id": rng.choice(seed_users + [heavy_user_id]),
+                    "timestamp": now - timedelta(days=rng.uniform(1, 120)),
+                    "profile_json": profile,
+                    "result_json": advisor_doc,
+                }
+                for _ in range(min(5000, advisor_rows - start))
+            ])
+            db.session.commit()
+
+        heavy_ids = [r.id for r in SearchHistory.query.with_entities(SearchHistory.id)
+                     .filter_by(user_id=heavy_user_id).limit(500).all()]
+        seed_sec = pytime.perf_counter() - t0
+
+    return {
+        "heavy_user_id": heavy_user_id,
+        "probe_user_id": probe_user_id,
+        "hot_keys": hot_keys,
+        "heavy_ids": heavy_ids,
+        "seed_sec": round(seed_sec, 2),
+    }
+
+
+# ==================================
+# === Scenarios ===
+# ==================================
+def key_payload(key):
+    make, model, year, mileage, fuel, trans = key
+    return {"make": make, "model": model, "year": year, "mileage_range": mileage,
+            "fuel_type": fuel, "transmission": trans}
+
+
+def build_scenarios(state, rng):
+    hot = state["hot_keys"]
+    heavy = state["heavy_ids"] or [0]
+    miss_counter = iter(range(10 ** 9))
+    hottest = hot[0] if hot else ("toyota", "corolla", 2018, "0-50K", "בנזין", "אוטומטית")
+
+    def miss_payload():
+        p = key_payload(rng.choice(hot) if hot else hottest)
+        # טווח קילומטראז' ייחודי => החמצה מובטחת במטמון
+        p["mileage_range"] = f"bench-miss-{next(miss_counter)}"
+        return p
+
+    return {
+        "index": (state["probe_user_id"], lambda c: c.get("/")),
+        # אותו מפתח שוב ושוב – נענה מהשכבה המהירה ביותר שקיימת במטמון
+        "analyze_memory_hit": (state["probe_user_id"], lambda c: c.post("/analyze", json=key_payload(hottest))),
+        "analyze_db_hit": (state["probe_user_id"], lambda c: c.post("/analyze", json=key_payload(rng.choice(hot or [hottest])))),
+        "analyze_miss": (state["probe_user_id"], lambda c: c.post("/analyze", json=miss_payload())),
+        "dashboard": (state["heavy_user_id"], lambda c: c.get("/dashboard")),
+        "search_details": (state["heavy_user_id"], lambda c: c.get(f"/search-details/{rng.choice(heavy)}")),
+        "advisor_api": (state["probe_user_id"], lambda c: c.post("/advisor_api", json=ADVISOR_PAYLOAD)),
+    }
+
+
+def run_scenario(app, user_id, fn, requests, concurrency, warmup):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def make_client():
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["_user_id"] = str(user_id)
+            sess["_fresh"] = True
+        return client
+
+    warm_client = make_client()
+    for _ in range(warmup):
+        fn(warm_client)
+
+    def worker():
+        client = make_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            t0 = pytime.perf_counter()
+            try:
+                resp = fn(client)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            dt = pytime.perf_counter() - t0
+            with lock:
+                latencies.append(dt)
+                if not ok:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    t0 = pytime.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], pytime.perf_counter() - t0)
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(before_path, after_path):
+    with open(before_path, encoding="utf-8") as f:
+        before = json.load(f)["scenarios"]
+    with open(after_path, encoding="utf-8") as f:
+        after = json.load(f)["scenarios"]
+    print(f"{'scenario':<22}{'rps before':>12}{'rps after':>12}{'p50 Δ%':>10}{'p99 Δ%':>10}")
+    for name in sorted(set(before) & set(after)):
+        b, a = before[name], after[name]
+
+        def delta(key):
+            bv, av = b["latency_ms"][key], a["latency_ms"][key]
+            return f"{(av - bv) / bv * 100:+.1f}" if bv and av is not None else "n/a"
+        print(f"{name:<22}{b['throughput_rps'] or 0:>12}{a['throughput_rps'] or 0:>12}{delta('p50'):>10}{delta('p99'):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark for the Flask endpoints")
+    parser.add_argument("--db-url", default="", help="ברירת מחדל: קובץ sqlite זמני")
+    parser.add_argument("--rows", type=int, default=10000, help="שורות SearchHistory לזריעה")
+    parser.add_argument("--advisor-rows", type=int, default=None, help="ברירת מחדל: rows/10")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--heavy-user-rows", type=int, default=300, help="היסטוריה של משתמש הדשבורד")
+    parser.add_argument("--requests", type=int, default=500, help="בקשות לכל תרחיש")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--fake-latency-ms", type=float, default=50)
+    parser.add_argument("--scenarios", default="", help="רשימה מופרדת בפסיקים (ברירת מחדל: הכל)")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out", default="")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    tmpdir = None
+    if not args.db_url:
+        tmpdir = tempfile.mkdtemp(prefix="car-bench-")
+        args.db_url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+
+    # חייב לקרות לפני import app (create_app רץ ב-import)
+    os.environ["DATABASE_URL"] = args.db_url
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LLM_LATENCY_MS"] = str(args.fake_latency_ms)
+    os.environ["FAKE_LLM_SEED"] = str(args.seed)
+    os.environ["USER_DAILY_LIMIT"] = str(10 ** 9)
+    os.environ.setdefault("SECRET_KEY", "bench")
+    sys.path.insert(0, APP_DIR)
+    import app as app_module
+
+    app = app_module.app
+    app_module.init_worker_resources(app)
+
+    advisor_rows = args.advisor_rows if args.advisor_rows is not None else args.rows // 10
+    print(f"[BENCH] seeding {args.rows} searches / {advisor_rows} advisor rows into {args.db_url}")
+    state = seed(app_module, args.rows, advisor_rows, args.users, args.heavy_user_rows, args.seed)
+    print(f"[BENCH] seeded in {state['seed_sec']}s")
+
+    rng = random.Random(args.seed)
+    scenarios = build_scenarios(state, rng)
+    selected = [s.strip() for s in args.scenarios.split(",") if s.strip()] or list(scenarios)
+
+    results = {}
+    for name in selected:
+        user_id, fn = scenarios[name]
+        print(f"[BENCH] {name} ...", flush=True)
+        results[name] = run_scenario(app, user_id, fn, args.requests, args.concurrency, args.warmup)
+        lat = results[name]["latency_ms"]
+        print(f"[BENCH]   {results[name]['throughput_rps']} rps, p50={lat['p50']}ms p99={lat['p99']}ms "
+              f"errors={results[name]['errors']}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_rev": git_rev(),
+            "python": platform.python_version(),
+            "db": args.db_url.split(":", 1)[0],
+            "rows": args.rows,
+            "advisor_rows": advisor_rows,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "fake_latency_ms": args.fake_latency_ms,
+            "seed_sec": state["seed_sec"],
+        },
+        "scenarios": results,
+    }
+    out = args.out or os.path.join(APP_DIR, "bench_results", f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"[BENCH] results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Microbenchmark לסריאליזציית התגובות (JSON provider + pass-through)
+#
+#   python benchmarks/bench_json.py --iterations 5000
+#   python benchmarks/bench_json.py --out bench_results/json.json
+#
+# payloads: דוח אמינות ודוח advisor של FakeLLMBackend (עברית, אותו מבנה
+# כמו תשובות Gemini). לכל payload, מ-result_json השמור ועד בתי התגובה:
+#   stdlib      – json.loads + source_tag + json.dumps (ההתנהגות הקודמת)
+#   provider    – loads + source_tag + FastJSONProvider.dumps
+#   passthrough – JSONDocument: הבתים השמורים + source_tag/mileage_note
+# ===================================================================
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time as pytime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+sys.path.insert(0, APP_DIR)
+
+from flask import Flask  # noqa: E402
+
+import json_provider  # noqa: E402
+from json_provider import FastJSONProvider, JSONDocument  # noqa: E402
+from llm_backends import FakeLLMBackend  # noqa: E402
+
+SOURCE_TAG = "מקור: מטמון DB (נשמר ב-2025-01-01)"
+
+
+def measure(fn, n: int) -> dict:
+    samples = []
+    for _ in range(n):
+        t0 = pytime.perf_counter()
+        fn()
+        samples.append(pytime.perf_counter() - t0)
+    samples.sort()
+    us = lambda v: round(v * 1e6, 2)
+    return {
+        "n": n,
+        "mean_us": us(statistics.fmean(samples)),
+        "p50_us": us(samples[len(samples) // 2]),
+        "p99_us": us(samples[min(len(samples) - 1, int(len(samples) * 0.99))]),
+    }
+
+
+def payloads() -> dict:
+    fake = FakeLLMBackend()
+    report = json.loads(fake.render_report("רכב: Toyota Corolla 2018"))
+    advisor = json.loads(fake.render_advisor(""))
+    return {
+        "reliability": json.dumps(report, ensure_ascii=False),
+        "advisor": json.dumps(advisor, ensure_ascii=False),
+    }
+
+
+def bench_payload(provider: FastJSONProvider, result_json: str, n: int) -> dict:
+    def stdlib():
+        doc = json.loads(result_json)
+        doc["source_tag"] = SOURCE_TAG
+        doc["mileage_note"] = None
+        return json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    def via_provider():
+        doc = provider.loads(result_json)
+        doc["source_tag"] = SOURCE_TAG
+        doc["mileage_note"] = None
+        return provider.dumps(doc).encode("utf-8")
+
+    def passthrough():
+        return JSONDocument(result_json, {"source_tag": SOURCE_TAG, "mileage_note": None}).to_bytes()
+
+    # שלושת המסלולים חייבים לייצר את אותו מסמך
+    expected = json.loads(stdlib())
+    assert json.loads(via_provider()) == expected and json.loads(passthrough()) == expected
+
+    return {
+        "bytes": len(result_json.encode("utf-8")),
+        "stdlib": measure(stdlib, n),
+        "provider": measure(via_provider, n),
+        "passthrough": measure(passthrough, n),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON response serialization microbenchmark")
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+
+    provider = FastJSONProvider(Flask(__name__))
+    engine = "orjson" if json_provider.orjson is not None else "stdlib (orjson not installed)"
+    print(f"[BENCH] provider engine: {engine}")
+
+    results = {"engine": engine}
+    for name, doc in payloads().items():
+        r = results[name] = bench_payload(provider, doc, args.iterations)
+        print(f"[BENCH] {name} ({r['bytes']} bytes)")
+        for path in ("stdlib", "provider", "passthrough"):
+            m = r[path]
+            print(f"    {path:<12} mean {m['mean_us']:>8}us  p50 {m['p50_us']:>8}us  p99 {m['p99_us']:>8}us")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"[BENCH] ✅ results -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Benchmark לתקורת ה-setup של קריאת Gemini (לפני/אחרי ה-registry)
+#
+#   python benchmarks/bench_llm_setup.py --iterations 2000
+#   python benchmarks/bench_llm_setup.py --calls 200 --out bench_results/llm_setup.json
+#
+# שני חלקים:
+#   setup – בניית GenerativeModel + Tool/GenerateContentConfig בכל קריאה
+#           (ההתנהגות הקודמת) מול שליפה מה-registry של GeminiBackend
+#   http  – קריאות generate_content מלאות מול fake_gemini_server מקומי
+#           (latency מוזרק 0): client חדש לכל קריאה (חיבור חדש) מול
+#           backend משותף עם חיבורי keep-alive
+# ===================================================================
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time as pytime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+
+
+def measure(fn, n: int) -> dict:
+    samples = []
+    for _ in range(n):
+        t0 = pytime.perf_counter()
+        fn()
+        samples.append(pytime.perf_counter() - t0)
+    samples.sort()
+    us = lambda v: round(v * 1e6, 2)
+    return {
+        "n": n,
+        "mean_us": us(statistics.fmean(samples)),
+        "p50_us": us(samples[len(samples) // 2]),
+        "p99_us": us(samples[min(len(samples) - 1, int(len(samples) * 0.99))]),
+    }
+
+
+def bench_setup(iterations: int, model_name: str) -> dict:
+    import google.generativeai as genai
+    from llm_backends import GeminiBackend
+
+    genai.configure(api_key="bench")
+    backend = GeminiBackend("bench")
+    backend._advisor_config = GeminiBackend.advisor_config()
+    backend.warm((model_name,))
+
+    def before():
+        genai.GenerativeModel(model_name)
+        GeminiBackend.advisor_config()
+
+    def after():
+        backend.model(model_name)
+        return backend._advisor_config
+
+    return {"before": measure(before, iterations), "after": measure(after, iterations)}
+
+
+def bench_http(calls: int, model_name: str) -> dict:
+    os.environ["FAKE_LLM_LATENCY_MS"] = "0"
+    os.environ["FAKE_LLM_ERROR_RATE"] = "0"
+    os.environ["FAKE_LLM_MALFORMED_RATE"] = "0"
+    os.environ["FAKE_LLM_TIMEOUT_RATE"] = "0"
+    from http.server import ThreadingHTTPServer
+    from fake_gemini_server import FakeGeminiHandler
+    from llm_backends import GeminiBackend
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeGeminiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    prompt = "רכב: Toyota Corolla 2018\nבדיקת בנצ'מרק"
+
+    shared = GeminiBackend("bench", base_url=base_url)
+    shared.init_worker()
+    shared.warm((model_name,))
+
+    def before():
+        # כמו קודם + client חדש: אין שימוש חוזר בחיבור
+        fresh = GeminiBackend("bench", base_url=base_url)
+        fresh.init_worker()
+        fresh.generate_report(model_name, prompt)
+
+    def after():
+        shared.generate_report(model_name, prompt)
+
+    try:
+        after()  # חימום החיבור המשותף
+        return {"before": measure(before, calls), "after": measure(after, calls)}
+    finally:
+        server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call Gemini setup overhead (before/after registry)")
+    parser.add_argument("--iterations", type=int, default=2000, help="איטרציות לחלק ה-setup")
+    parser.add_argument("--calls", type=int, default=200, help="קריאות HTTP לחלק ה-http (0 = דילוג)")
+    parser.add_argument("--model", default="gemini-2.5-flash")
+    parser.add_argument("--out", default="")
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    results = {"setup": bench_setup(args.iterations, args.model)}
+    if args.calls:
+        results["http"] = bench_http(args.calls, args.model)
+
+    for part, res in results.items():
+        b, a = res["before"]["mean_us"], res["after"]["mean_us"]
+        print(f"[BENCH] {part:<6} before {b:>10.2f}us  after {a:>10.2f}us  saved {b - a:>10.2f}us/call")
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"[BENCH] ✅ results -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# אינדקס השלמה אוטומטית לקטלוג הרכבים (israeli_car_market_full_compilation)
+#
+#   prefix trie – על המפתחות המקופלים (lowercase, בלי רווחים/מקפים/נקודות):
+#     "cx 5", "CX-5", "cx5" => אותו מפתח.
+#   trigram index – התאמה פאזית (dice) לשגיאות כתיב: "corola", "elentra".
+#   aliases – "i35 / Elantra" מתפצל לשני מפתחות, ועוד טבלת שמות בעברית
+#     (טויוטה, קורולה, אלנטרה...) => אותה רשומה קנונית.
+#
+# שם הדגם הקנוני הוא בדיוק ה-value של ה-<option> ב-index.html (אותו
+# פירוק טווח שנים כמו buildModelMap ב-script.js), כך שבחירה מההשלמה
+# מייצרת אותם make/model – ואותו מפתח מטמון – כמו בחירה ידנית.
+#
+# האינדקס נבנה פעם אחת ב-import (משותף בין workers עם --preload)
+# ולא משתנה אחר כך; התשובות נשמרות ב-LRU לפי השאילתה.
+# ===================================================================
+
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from shared_cache import MemoryLRU
+
+# אותו regex כמו ב-script.js – (2008-2025) / (2008-25)
+_YEARS_RE = re.compile(r"\((\d{4})\s*-\s*(\d{2,4})\)")
+_SEPARATORS_RE = re.compile(r"[\s\-_.'\"׳״`/+&]+")
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+FUZZY_MIN_SCORE = 0.34
+SUGGEST_MAX_LIMIT = 20
+
+# שמות יצרנים בעברית (כמו שמשתמשים מקלידים – כולל כתיב חלופי)
+HEBREW_MAKE_ALIASES: Dict[str, Sequence[str]] = {
+    "Toyota": ("טויוטה", "טוייטה"),
+    "Hyundai": ("יונדאי", "יונדאיי", "הונדאי"),
+    "Kia": ("קיה", "קייה", "קיא"),
+    "Mazda": ("מאזדה", "מזדה"),
+    "Skoda": ("סקודה",),
+    "Mitsubishi": ("מיצובישי", "מיצ'ובישי"),
+    "Suzuki": ("סוזוקי",),
+    "Nissan": ("ניסאן", "ניסן"),
+    "Subaru": ("סובארו", "סוברו"),
+    "Honda": ("הונדה",),
+    "Ford": ("פורד",),
+    "Chevrolet": ("שברולט", "שברולה"),
+    "Volkswagen": ("פולקסווגן", "פולקסוואגן", "vw"),
+    "Peugeot": ("פיג'ו", "פיגו", "פג'ו"),
+    "Citroen": ("סיטרואן", "citroën"),
+    "Renault": ("רנו",),
+    "Seat": ("סיאט",),
+    "Opel": ("אופל",),
+    "Fiat": ("פיאט",),
+    "Dacia": ("דאצ'יה", "דאציה"),
+    "Alfa Romeo": ("אלפא רומאו", "אלפא"),
+    "Volvo": ("וולוו", "וולבו"),
+    "Audi": ("אאודי", "אודי"),
+    "BMW": ("ב.מ.וו", "במוו", "ב מ וו"),
+    "Mercedes-Benz": ("מרצדס", "מרצדס בנץ", "בנץ", "mercedes"),
+    "Lexus": ("לקסוס",),
+    "Cadillac": ("קאדילק", "קדילק"),
+    "Infiniti": ("אינפיניטי",),
+    "Jaguar": ("יגואר",),
+    "Land Rover": ("לנד רובר", "ריינג' רובר"),
+    "Porsche": ("פורשה",),
+    "Maserati": ("מזראטי", "מאזרטי"),
+    "Genesis": ("ג'נסיס", "גנסיס"),
+    "Tesla": ("טסלה",),
+    "BYD": ("בי ווי די", "ביוואידי"),
+    "MG": ("אם ג'י", "אמג'י"),
+    "Geely": ("ג'ילי", "גילי"),
+    "Chery": ("צ'רי", "צרי"),
+    "GAC": ("גאק",),
+    "Aiways": ("איוויז",),
+    "Seres": ("סרס",),
+    "Skywell": ("סקייוול",),
+    "Maxus": ("מקסוס",),
+    "Ora": ("אורה",),
+    "Wey": ("ווי",),
+    "Leapmotor": ("ליפמוטור",),
+    "XPeng": ("אקספנג",),
+    "Jeep": ("ג'יפ", "גיפ"),
+    "Chrysler": ("קרייזלר",),
+    "Dodge": ("דודג'", "דודג"),
+    "Daihatsu": ("דייהטסו", "דיהטסו"),
+    "Saab": ("סאאב",),
+    "Rover": ("רובר",),
+    "Lancia": ("לנצ'יה",),
+    "Abarth": ("אבארת",),
+}
+
+# דגמים נפוצים בעברית: (יצרן, שם לטיני כפי שמופיע ב-alias בקטלוג) -> שמות
+HEBREW_MODEL_ALIASES: Dict[Tuple[str, str], Sequence[str]] = {
+    ("Toyota", "Corolla"): ("קורולה",),
+    ("Toyota", "Yaris"): ("יאריס",),
+    ("Toyota", "Prius"): ("פריוס",),
+    ("Toyota", "Camry"): ("קאמרי",),
+    ("Toyota", "RAV4"): ("ראב 4", "ראב4"),
+    ("Toyota", "C-HR"): ("סי אייץ' אר",),
+    ("Toyota", "Auris"): ("אוריס",),
+    ("Toyota", "Land Cruiser"): ("לנד קרוזר",),
+    ("Toyota", "Hilux"): ("היילקס",),
+    ("Hyundai", "i10"): ("איי 10",),
+    ("Hyundai", "i20"): ("איי 20",),
+    ("Hyundai", "i30"): ("איי 30",),
+    ("Hyundai", "Elantra"): ("אלנטרה", "איי 35"),
+    ("Hyundai", "Accent"): ("אקסנט", "איי 25"),
+    ("Hyundai", "Tucson"): ("טוסון",),
+    ("Hyundai", "Kona"): ("קונה",),
+    ("Hyundai", "Ioniq"): ("איוניק",),
+    ("Hyundai", "Santa Fe"): ("סנטה פה",),
+    ("Hyundai", "Getz"): ("גטס",),
+    ("Kia", "Picanto"): ("פיקנטו",),
+    ("Kia", "Rio"): ("ריו",),
+    ("Kia", "Ceed"): ("סיד",),
+    ("Kia", "Sportage"): ("ספורטאז'", "ספורטז'"),
+    ("Kia", "Sorento"): ("סורנטו",),
+    ("Kia", "Niro"): ("נירו",),
+    ("Kia", "Stonic"): ("סטוניק",),
+    ("Kia", "Cerato"): ("סראטו", "צרטו"),
+    ("Kia", "Forte"): ("פורטה",),
+    ("Mazda", "Mazda3"): ("מאזדה 3", "מזדה 3"),
+    ("Mazda", "Mazda2"): ("מאזדה 2", "מזדה 2"),
+    ("Mazda", "Mazda6"): ("מאזדה 6", "מזדה 6"),
+    ("Mazda", "CX-5"): ("סי איקס 5",),
+    ("Skoda", "Octavia"): ("אוקטביה",),
+    ("Skoda", "Fabia"): ("פביה",),
+    ("Skoda", "Superb"): ("סופרב",),
+    ("Skoda", "Kodiaq"): ("קודיאק",),
+    ("Skoda", "Karoq"): ("קארוק",),
+    ("Mitsubishi", "Outlander"): ("אאוטלנדר", "אוטלנדר"),
+    ("Mitsubishi", "Lancer"): ("לנסר",),
+    ("Mitsubishi", "Space Star"): ("ספייס סטאר",),
+    ("Suzuki", "Swift"): ("סוויפט", "סויפט"),
+    ("Suzuki", "Vitara"): ("ויטרה",),
+    ("Suzuki", "Baleno"): ("בלנו",),
+    ("Suzuki", "Ignis"): ("איגניס",),
+    ("Nissan", "Qashqai"): ("קשקאי",),
+    ("Nissan", "Micra"): ("מיקרה",),
+    ("Nissan", "Juke"): ("ג'וק",),
+    ("Nissan", "X-Trail"): ("אקס טרייל",),
+    ("Nissan", "Leaf"): ("ליף",),
+    ("Subaru", "Impreza"): ("אימפרזה",),
+    ("Subaru", "Forester"): ("פורסטר",),
+    ("Subaru", "XV"): ("איקס וי",),
+    ("Honda", "Civic"): ("סיוויק", "סיביק"),
+    ("Honda", "Jazz"): ("ג'אז",),
+    ("Honda", "CR-V"): ("סי אר וי",),
+    ("Ford", "Focus"): ("פוקוס",),
+    ("Ford", "Fiesta"): ("פיאסטה",),
+    ("Ford", "Kuga"): ("קוגה",),
+    ("Chevrolet", "Spark"): ("ספארק",),
+    ("Chevrolet", "Cruze"): ("קרוז",),
+    ("Volkswagen", "Golf"): ("גולף",),
+    ("Volkswagen", "Polo"): ("פולו",),
+    ("Volkswagen", "Passat"): ("פאסאט", "פסאט"),
+    ("Volkswagen", "Tiguan"): ("טיגואן",),
+    ("Peugeot", "208"): ("פיג'ו 208",),
+    ("Peugeot", "308"): ("פיג'ו 308",),
+    ("Peugeot", "3008"): ("פיג'ו 3008",),
+    ("Renault", "Clio"): ("קליאו",),
+    ("Renault", "Megane"): ("מגאן",),
+    ("Dacia", "Duster"): ("דאסטר",),
+    ("Dacia", "Sandero"): ("סנדרו",),
+    ("Seat", "Ibiza"): ("איביזה",),
+    ("Seat", "Leon"): ("לאון",),
+    ("Tesla", "Model 3"): ("מודל 3",),
+    ("Tesla", "Model Y"): ("מודל Y", "מודל וואי"),
+}
+
+
+def fold(text: str) -> str:
+    """מפתח להשוואה: lowercase, בלי רווחים/מקפים/נקודות/גרשיים."""
+    text = _SEPARATORS_RE.sub("", str(text or "").lower())
+    return _NON_WORD_RE.sub("", text)
+
+
+def trigrams(key: str) -> set:
+    padded = f"^{key}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def parse_model_entry(entry: str) -> Tuple[str, Optional[Tuple[int, int]]]:
+    """'Corolla (1966-2025)' -> ('Corolla', (1966, 2025)) – כמו buildModelMap ב-script.js."""
+    name = str(entry or "").strip()
+    m = _YEARS_RE.search(name)
+    if not m:
+        return name, None
+    start, end = int(m.group(1)), int(m.group(2))
+    if end < 100:
+        end += 2000
+    return name.replace(m.group(0), "").strip(), (start, end)
+
+
+def model_aliases(name: str) -> List[str]:
+    """'i35 / Elantra' -> ['i35 / Elantra', 'i35', 'Elantra'] (ובלי סוגריים שנשארו בשם)."""
+    base = name.split("(")[0].strip() or name
+    parts = [p.strip() for p in base.split("/") if p.strip()]
+    aliases = [name]
+    for alias in (base, *parts):
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.ids: List[int] = []
+
+
+class PrefixTrie:
+    """trie של מפתחות מקופלים -> מזהי רשומות (לכל מפתח – רשימת ids)."""
+
+    def __init__(self):
+        self.root = _TrieNode()
+
+    def insert(self, key: str, item_id: int) -> None:
+        node = self.root
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+        if item_id not in node.ids:
+            node.ids.append(item_id)
+
+    def _node(self, prefix: str) -> Optional[_TrieNode]:
+        node = self.root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def exact(self, key: str) -> List[int]:
+        node = self._node(key)
+        return list(node.ids) if node is not None else []
+
+    def complete(self, prefix: str, limit: int) -> List[Tuple[int, int]]:
+        """(item_id, אורך המפתח) לכל מפתח שמתחיל ב-prefix – הקצרים קודם (BFS)."""
+        node = self._node(prefix)
+        if node is None:
+            return []
+        out: List[Tuple[int, int]] = []
+        level = [node]
+        depth = len(prefix)
+        while level and len(out) < limit:
+            nxt = []
+            for n in level:
+                out.extend((i, depth) for i in n.ids)
+                nxt.extend(n.children[ch] for ch in sorted(n.children))
+            level = nxt
+            depth += 1
+        return out[:limit]
+
+
+class CatalogIndex:
+    """
+    השלמה לשמות יצרן/דגם מהקטלוג. suggest() מחזיר רשומות קנוניות:
+    {make, model, years, label, match, score}; model=None – הצעת יצרן בלבד.
+    """
+
+    def __init__(self, catalog: Dict[str, Iterable[str]], cache_size: int = 4096):
+        self.entries: List[dict] = []
+        self.makes: List[str] = list(catalog)
+        self._make_trie = PrefixTrie()
+        self._make_keys: Dict[str, int] = {}
+        self._model_trie = PrefixTrie()
+        self._keys: List[Tuple[str, int]] = []  # (מפתח, entry id) – בסיס האינדקס הפאזי
+        self._grams: Dict[str, List[int]] = defaultdict(list)
+        # האינדקס לא משתנה – ה-TTL רק מגביל זיכרון לשאילתות ישנות
+        self._cache = MemoryLRU(maxsize=cache_size, ttl_sec=24 * 3600)
+
+        for make_id, make in enumerate(self.makes):
+            for alias in (make, *HEBREW_MAKE_ALIASES.get(make, ())):
+                key = fold(alias)
+                if key:
+                    self._make_trie.insert(key, make_id)
+                    self._make_keys.setdefault(key, make_id)
+
+        for make_id, make in enumerate(self.makes):
+            for entry in catalog[make] or []:
+                model, years = parse_model_entry(entry)
+                if not model:
+                    continue
+                entry_id = len(self.entries)
+                self.entries.append({"make": make, "make_id": make_id, "model": model, "years": years})
+                aliases = model_aliases(model)
+                hebrew = [h for latin in aliases for h in HEBREW_MODEL_ALIASES.get((make, latin), ())]
+                keys = {fold(alias) for alias in aliases + hebrew}
+                for key in sorted(k for k in keys if k):
+                    self._add_model_key(key, entry_id)
+
+    def _add_model_key(self, key: str, entry_id: int) -> None:
+        self._model_trie.insert(key, entry_id)
+        key_id = len(self._keys)
+        self._keys.append((key, entry_id))
+        for gram in trigrams(key):
+            self._grams[gram].append(key_id)
+
+    # ---------- query ----------
+    def _split_make(self, words: List[str]) -> Tuple[Optional[int], List[str]]:
+        """המילים הראשונות שהן בדיוק שם יצרן (כולל כינוי עברי) -> (make_id, שאר המילים)."""
+        for n in range(min(3, len(words)), 0, -1):
+            make_id = self._make_keys.get(fold("".join(words[:n])))
+            if make_id is not None:
+                return make_id, words[n:]
+        return None, words
+
+    def _fuzzy(self, key: str, make_id: Optional[int], limit: int) -> Dict[int, float]:
+        grams = trigrams(key)
+        counts: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for key_id in self._grams.get(gram, ()):
+                counts[key_id] += 1
+        best: Dict[int, float] = {}
+        for key_id, common in counts.items():
+            cand, entry_id = self._keys[key_id]
+            if make_id is not None and self.entries[entry_id]["make_id"] != make_id:
+                continue
+            score = 2.0 * common / (len(grams) + len(cand) + 2)
+            if score >= FUZZY_MIN_SCORE and score > best.get(entry_id, 0.0):
+                best[entry_id] = score
+        return dict(sorted(best.items(), key=lambda kv: (-kv[1], kv[0]))[:limit])
+
+    def _model_result(self, entry_id: int, match: str, score: float) -> dict:
+        e = self.entries[entry_id]
+        return {
+            "make": e["make"],
+            "model": e["model"],
+            "years": list(e["years"]) if e["years"] else None,
+            "label": f"{e['make']} {e['model']}",
+            "match": match,
+            "score": round(score, 3),
+        }
+
+    def suggest(self, query: str, limit: int = 8, make: Optional[str] = None) -> List[dict]:
+        limit = max(1, min(int(limit or 8), SUGGEST_MAX_LIMIT))
+        cache_key = (query, limit, make)
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            cached = self._suggest(query, limit, make)
+            self._cache.set(cache_key, cached)
+        return cached
+
+    def _suggest(self, query: str, limit: int, make: Optional[str]) -> List[dict]:
+        words = [w for w in _SEPARATORS_RE.split(str(query or "").lower()) if w]
+        if not words and not make:
+            return []
+
+        full_key = fold("".join(words))
+        make_id = self._make_keys.get(fold(make)) if make else None
+        if make_id is None:
+            make_id, words = self._split_make(words)
+        key = fold("".join(words))
+
+        if not key:
+            # רק יצרן – הדגמים שלו לפי סדר הקטלוג
+            if make_id is None:
+                return []
+            ids = [i for i, e in enumerate(self.entries) if e["make_id"] == make_id][:limit]
+            return [self._model_result(i, "make", 1.0) for i in ids]
+
+        scored: Dict[int, Tuple[float, str]] = {}
+
+        def offer(entry_id: int, score: float, match: str) -> None:
+            if make_id is not None and self.entries[entry_id]["make_id"] != make_id:
+                return
+            if score > scored.get(entry_id, (0.0, ""))[0]:
+                scored[entry_id] = (score, match)
+
+        # "mazda 3" / "מאזדה 3": שם היצרן הוא חלק משם הדגם – מנסים גם את השאילתה המלאה
+        for k in {key, full_key}:
+            for entry_id in self._model_trie.exact(k):
+                offer(entry_id, 3.0, "exact")
+            for entry_id, key_len in self._model_trie.complete(k, limit * 8):
+                offer(entry_id, 1.0 + len(k) / key_len, "prefix")
+        if len(scored) < limit:
+            for entry_id, score in self._fuzzy(key, make_id, limit).items():
+                offer(entry_id, score, "fuzzy")
+
+        results = [
+            self._model_result(entry_id, match, score)
+            for entry_id, (score, match) in sorted(scored.items(), key=lambda kv: (-kv[1][0], kv[0]))[:limit]
+        ]
+
+        # הקלדה חלקית של יצרן ("toyo") – הצעת היצרן עצמו
+        if make_id is None and len(results) < limit:
+            seen = set()
+            for mid, _ in self._make_trie.complete(key, limit):
+                if mid in seen:
+                    continue
+                seen.add(mid)
+                make_name = self.makes[mid]
+                results.append({
+                        "make": make_name, "model": None, "years": None, "label": make_name,
+                        "match": "make", "score": 1.0,
+                    })
+        return results[:limit]
+
+    def resolve(self, make: str, model: str) -> Optional[dict]:
+        """יצרן+דגם חופשיים -> הרשומה הקנונית, רק כשההתאמה חד-משמעית (exact / prefix יחיד)."""
+        results = self.suggest(model, limit=2, make=make)
+        if not results or results[0]["model"] is None:
+            return None
+        if results[0]["match"] == "exact" or len(results) == 1:
+            return results[0]
+        return None
+
+    def stats(self) -> dict:
+        return {"makes": len(self.makes), "models": len(self.entries), "keys": len(self._keys), "trigrams": len(self._grams)}
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# CompressedText – דחיסה שקופה של מסמכי JSON ארוכים (result_json וכו')
+#
+# העמודה היא LargeBinary (BYTEA ב-Postgres / BLOB ב-SQLite); ערך דחוס:
+#   \x00zs + dict_id (4 בתים, big-endian) + payload   zstd (dict_id 0 = ללא מילון)
+#   \x00zl + dict_id + payload                         zlib עם zdict
+# ערך קצר / שלא משתלם לדחוס נשמר כ-UTF-8 של ה-JSON עצמו.
+# שורות מלפני המעבר ל-binary (TEXT: JSON רגיל או ~zs<dict_id>:<base64>)
+# עדיין נקראות – ב-Postgres העמודה מומרת ל-BYTEA עם התוכן הישן
+# (flask compression-binary-columns), ב-SQLite הן נשארות TEXT; flask
+# compression-migrate כותב אותן מחדש בפורמט הבינארי, בהדרגה.
+#
+# מילונים משותפים מאומנים מתוך שורות קיימות (flask compression-train),
+# נשמרים בטבלת CompressionDictionary ונטענים לכל תהליך בעלייה.
+# RESULT_COMPRESSION: zstd (ברירת מחדל אם zstandard מותקן) / zlib / off
+# ===================================================================
+
+import base64
+import os
+import struct
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # zlib בלבד
+    zstandard = None
+
+_default_algo = "zstd" if zstandard is not None else "zlib"
+RESULT_COMPRESSION = os.environ.get("RESULT_COMPRESSION", _default_algo).strip().lower()
+if RESULT_COMPRESSION == "zstd" and zstandard is None:
+    print("[COMPRESS] ⚠️ zstandard not installed – falling back to zlib")
+    RESULT_COMPRESSION = "zlib"
+COMPRESS_MIN_BYTES = int(os.environ.get("RESULT_COMPRESS_MIN_BYTES", 256))
+ZSTD_LEVEL = int(os.environ.get("RESULT_ZSTD_LEVEL", 9))
+ZLIB_LEVEL = int(os.environ.get("RESULT_ZLIB_LEVEL", 6))
+ZLIB_MAX_DICT = 32 * 1024  # חלון zlib
+
+_MAGIC = b"\x00z"  # JSON לא מתחיל ב-NUL, כך שאין התנגשות עם ערך לא דחוס
+_KINDS = {"zstd": b"s", "zlib": b"l"}
+_DICT_ID = struct.Struct(">I")
+_HEADER_LEN = len(_MAGIC) + 1 + _DICT_ID.size
+
+
+class DictionaryRegistry:
+    """מילונים לפי id + המילון הפעיל לכל אלגוריתם. מילון לא מוכר נטען דרך loader."""
+
+    def __init__(self):
+        self._dicts: Dict[int, Tuple[str, bytes]] = {}
+        self._active: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.loader: Optional[Callable[[int], Optional[Tuple[str, bytes]]]] = None
+
+    def register(self, dict_id: int, algo: str, data: bytes, activate: bool = True) -> None:
+        with self._lock:
+            self._dicts[dict_id] = (algo, data)
+            if activate and dict_id >= self._active.get(algo, 0):
+                self._active[algo] = dict_id
+
+    def active_id(self, algo: str) -> int:
+        return self._active.get(algo, 0)
+
+    def get(self, dict_id: int) -> Optional[bytes]:
+        if dict_id == 0:
+            return None
+        item = self._dicts.get(dict_id)
+        if item is None and self.loader is not None:
+            loaded = self.loader(dict_id)
+            if loaded is not None:
+                self.register(dict_id, loaded[0], loaded[1], activate=False)
+                item = loaded
+        if item is None:
+            raise KeyError(f"compression dictionary {dict_id} not found")
+        return item[1]
+
+    # ---- zstd: אובייקטים לא thread-safe, לכן per-thread ----
+    def _zstd_cache(self) -> dict:
+        cache = getattr(self._local, "zstd", None)
+        if cache is None:
+            cache = self._local.zstd = {}
+        return cache
+
+    def zstd_compressor(self, dict_id: int):
+        cache = self._zstd_cache()
+        key = ("c", dict_id)
+        if key not in cache:
+            data = self.get(dict_id)
+            zdict = zstandard.ZstdCompressionDict(data) if data else None
+            cache[key] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=zdict)
+        return cache[key]
+
+    def zstd_decompressor(self, dict_id: int):
+        cache = self._zstd_cache()
+        key = ("d", dict_id)
+        if key not in cache:
+            data = self.get(dict_id)
+            zdict = zstandard.ZstdCompressionDict(data) if data else None
+            cache[key] = zstandard.ZstdDecompressor(dict_data=zdict)
+        return cache[key]
+
+
+DICTIONARIES = DictionaryRegistry()
+
+
+def compression_prefix(algo: Optional[str] = None) -> bytes:
+    """ה-header של ערכים שכבר דחוסים עם המילון הפעיל (למיגרציה)."""
+    algo = algo or RESULT_COMPRESSION
+    return _MAGIC + _KINDS.get(algo, b"?") + _DICT_ID.pack(DICTIONARIES.active_id(algo))
+
+
+def compress_text(text: Optional[str], algo: Optional[str] = None) -> Optional[bytes]:
+    if text is None:
+        return None
+    algo = algo or RESULT_COMPRESSION
+    raw = text.encode("utf-8")
+    if algo not in _KINDS or len(raw) < COMPRESS_MIN_BYTES:
+        return raw
+    dict_id = DICTIONARIES.active_id(algo)
+    if algo == "zstd":
+        packed = DICTIONARIES.zstd_compressor(dict_id).compress(raw)
+    else:
+        zdict = DICTIONARIES.get(dict_id)
+        co = zlib.compressobj(ZLIB_LEVEL, zdict=zdict) if zdict else zlib.compressobj(ZLIB_LEVEL)
+        packed = co.compress(raw) + co.flush()
+    # לא שווה לדחוס? נשארים עם הבתים המקוריים
+    if _HEADER_LEN + len(packed) >= len(raw):
+        return raw
+    return compression_prefix(algo) + packed
+
+
+def _unpack(kind: bytes, dict_id: int, packed: bytes) -> str:
+    if kind == b"s":
+        if zstandard is None:
+            raise RuntimeError("zstd-compressed value but zstandard is not installed")
+        return DICTIONARIES.zstd_decompressor(dict_id).decompress(packed).decode("utf-8")
+    if kind == b"l":
+        zdict = DICTIONARIES.get(dict_id)
+        do = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return (do.decompress(packed) + do.flush()).decode("utf-8")
+    raise ValueError(f"unknown compression kind {kind!r}")
+
+
+def _decode_legacy(text: str) -> str:
+    """ערך מלפני העמודה הבינארית: JSON רגיל או ~zs<dict_id>:<base64>."""
+    if not text.startswith("~z"):
+        return text
+    header, _, payload = text.partition(":")
+    return _unpack(header[2:3].encode("ascii"), int(header[3:] or 0), base64.b64decode(payload))
+
+
+def decompress_text(value: Union[bytes, memoryview, str, None]) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):  # SQLite: שורה ישנה שעוד לא עברה compression-migrate
+        return _decode_legacy(value)
+    value = bytes(value)
+    if not value.startswith(_MAGIC):
+        return _decode_legacy(value.decode("utf-8"))
+    (dict_id,) = _DICT_ID.unpack_from(value, len(_MAGIC) + 1)
+    return _unpack(value[len(_MAGIC):len(_MAGIC) + 1], dict_id, value[_HEADER_LEN:])
+
+
+def train_dictionary(samples: List[str], algo: Optional[str] = None, size: int = 64 * 1024) -> bytes:
+    algo = algo or RESULT_COMPRESSION
+    encoded = [s.encode("utf-8") for s in samples if s]
+    if not encoded:
+        raise ValueError("no samples to train on")
+    if algo == "zstd":
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    # zlib: preset dictionary = תוכן מייצג; הבתים בסוף החלון הכי "קרובים", לכן
+    # שמים שם את הדוגמאות הטריות ביותר
+    size = min(size, ZLIB_MAX_DICT)
+    buf = b""
+    for sample in encoded:
+        buf = sample[:4096] + buf
+        if len(buf) >= size:
+            break
+    return buf[-size:]
+
+
+class CompressedText(TypeDecorator):
+    """טקסט בצד ה-Python, בתים דחוסים ב-DB – שקוף לקוד שמשתמש בעמודה."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# DB connection pool – הגדרות engine מ-ENV + מדידת המתנה ל-checkout
+# ===================================================================
+
+import os
+import threading
+import time as pytime
+from contextlib import contextmanager
+from typing import Any, Dict
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    val = os.environ.get(name)
+    if val is None:
+        return default
+    return val.strip().lower() in ("1", "true", "yes", "on")
+
+
+def build_engine_options(database_uri: str) -> Dict[str, Any]:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS לפי ENV.
+    sqlite (פיתוח/בדיקות) נשאר על ברירות המחדל של SQLAlchemy, חוץ מ-sqlite בזיכרון:
+    חיבור יחיד משותף (StaticPool) – אחרת כל thread (בקשות, threads רקע) רואה DB ריק משלו.
+    """
+    if database_uri.startswith("sqlite"):
+        if database_uri in ("sqlite://", "sqlite:///:memory:"):
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return {}
+
+    options: Dict[str, Any] = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 5)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+    }
+
+    statement_timeout_ms = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 15000))
+    if statement_timeout_ms > 0 and database_uri.startswith(("postgres", "postgresql")):
+        options["connect_args"] = {"options": f"-c statement_timeout={statement_timeout_ms}"}
+    return options
+
+
+class PoolStats:
+    """מונים per-process (thread-safe) על השימוש ב-pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_total_sec = 0.0
+        self.wait_max_sec = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        with self._lock:
+            self.wait_total_sec += seconds
+            if seconds > self.wait_max_sec:
+                self.wait_max_sec = seconds
+
+    def incr(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "wait_total_sec": round(self.wait_total_sec, 6),
+                "wait_max_sec": round(self.wait_max_sec, 6),
+                "wait_avg_ms": round(1000 * self.wait_total_sec / self.checkouts, 3) if self.checkouts else 0.0,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool שמודד כמה זמן בקשה חיכתה לחיבור פנוי (כולל פתיחת חיבור חדש)."""
+
+    def _do_get(self):
+        t0 = pytime.perf_counter()
+        try:
+            conn = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.incr("timeouts")
+            pool_stats.record_wait(pytime.perf_counter() - t0)
+            raise
+        pool_stats.record_wait(pytime.perf_counter() - t0)
+        return conn
+
+
+@contextmanager
+def maintenance_transaction(engine):
+    """
+    טרנזקציה לפקודות תחזוקה (CLI): מבטלת את ה-statement_timeout הגלובלי של ה-pool
+    (SET LOCAL – רק לטרנזקציה הזו), כדי ש-ALTER / העתקה של טבלה גדולה לא ייחתכו.
+    """
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+        yield conn
+
+
+@contextmanager
+def maintenance_connection(engine):
+    """
+    כמו maintenance_transaction, לקריאות ארוכות (ספירות, ארכוב ב-streaming): ה-SET LOCAL
+    חל על הטרנזקציה שנפתחת אוטומטית בחיבור ונעלם ב-rollback כשהחיבור חוזר ל-pool.
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SET LOCAL statement_timeout = 0"))
+        yield conn
+
+
+def _no_statement_timeout(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    cursor.execute("SET statement_timeout = 0")
+    cursor.close()
+    dbapi_conn.commit()  # אחרת ה-rollback של ה-pool מבטל את ה-SET
+
+
+def lift_statement_timeout(engine) -> None:
+    """
+    לתהליך CLI שכולו תחזוקה (backfill, rollup, דחיסה מחדש) ועובר דרך db.session:
+    כל חיבור חדש בלי statement_timeout. ה-pool מתרוקן כדי שגם חיבורים קיימים יוחלפו.
+    לא לקרוא מתוך worker שמשרת בקשות.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    event.listen(engine, "connect", _no_statement_timeout)
+    engine.dispose()
+
+
+def is_memory_sqlite(engine) -> bool:
+    """sqlite בזיכרון – ה-DB חי בתוך החיבור, dispose() מוחק אותו."""
+    return engine.url.get_backend_name() == "sqlite" and engine.url.database in (None, "", ":memory:")
+
+
+def dispose_engines(engines, close: bool = True) -> None:
+    """זונח את ה-pool (לפני/אחרי fork) – חוץ מ-sqlite בזיכרון."""
+    for engine in engines:
+        if not is_memory_sqlite(engine):
+            engine.dispose(close=close)
+
+
+def instrument_engine(engine) -> None:
+    # listeners שמוגדרים על ה-engine עוברים גם ל-pool החדש אחרי dispose()
+    event.listen(engine, "connect", lambda *a: pool_stats.incr("connects"))
+    event.listen(engine, "checkout", lambda *a: pool_stats.incr("checkouts"))
+    event.listen(engine, "checkin", lambda *a: pool_stats.incr("checkins"))
+    event.listen(engine, "invalidate", lambda *a: pool_stats.incr("invalidations"))
+
+
+def pool_status(engine) -> Dict[str, Any]:
+    pool = engine.pool
+    status: Dict[str, Any] = {"pool_class": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            try:
+                status[name] = fn()
+            except Exception:
+                pass
+    return status
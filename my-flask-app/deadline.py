@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Deadline per-request – תקציב זמן שעובר דרך retries ו-fallbacks
+#
+# gunicorn הורג worker אחרי --timeout (120s). כל בקשה מקבלת deadline
+# קצר ממנו (REQUEST_DEADLINE_SEC), כל ניסיון LLM מקבל את הזמן שנותר
+# כ-timeout של ה-SDK, וכשהתקציב נגמר זורקים DeadlineExceeded מהר –
+# וה-view מחזיר מטמון ישן או 504 מסודר, במקום 502 בלי שום שמירה.
+# ===================================================================
+
+import asyncio
+import os
+import random
+import time as pytime
+from typing import Optional
+
+# ברירת מחדל: 20 שניות פחות מה-timeout של gunicorn
+REQUEST_DEADLINE_SEC = float(
+    os.environ.get("REQUEST_DEADLINE_SEC", int(os.environ.get("GUNICORN_TIMEOUT", 120)) - 20)
+)
+# זמן ששומרים בצד לשלבים שאחרי ה-LLM (מיילג' + שמירה ל-DB)
+DEADLINE_SAVE_RESERVE_SEC = float(os.environ.get("DEADLINE_SAVE_RESERVE_SEC", 3))
+# לא מתחילים ניסיון שיש לו פחות מזה
+MIN_ATTEMPT_SEC = float(os.environ.get("LLM_MIN_ATTEMPT_SEC", 5))
+# תקרה לניסיון בודד, כדי שה-fallback model עוד יקבל הזדמנות
+LLM_ATTEMPT_TIMEOUT_SEC = float(os.environ.get("LLM_ATTEMPT_TIMEOUT_SEC", 45))
+
+
+class DeadlineExceeded(RuntimeError):
+    """תקציב הזמן של הבקשה נגמר לפני שהתקבלה תשובה."""
+
+
+class Deadline:
+    def __init__(self, budget_sec: float = REQUEST_DEADLINE_SEC):
+        self.budget_sec = budget_sec
+        self.expires_at = pytime.monotonic() + budget_sec
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - pytime.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def queue_budget(self) -> float:
+        """כמה מותר לחכות בתור (admission) ועדיין להשאיר זמן לניסיון אחד + שמירה."""
+        return max(0.0, self.remaining() - MIN_ATTEMPT_SEC - DEADLINE_SAVE_RESERVE_SEC)
+
+    def attempt_timeout(self, cap: Optional[float] = LLM_ATTEMPT_TIMEOUT_SEC) -> float:
+        """timeout לניסיון הבא (אחרי השארת זמן לשמירה). זורק DeadlineExceeded אם לא נשאר מספיק."""
+        available = self.remaining() - DEADLINE_SAVE_RESERVE_SEC
+        if available < MIN_ATTEMPT_SEC:
+            raise DeadlineExceeded(f"request deadline exhausted ({self.remaining():.1f}s left)")
+        return min(available, cap) if cap else available
+
+    def backoff(self, base_sec: float, attempt: int) -> float:
+        """
+        backoff אקספוננציאלי עם full jitter. מחזיר 0 (ללא המתנה) אם ההמתנה
+        לא משאירה מספיק זמן לניסיון נוסף.
+        """
+        delay = random.uniform(0, base_sec * (2 ** (attempt - 1)))
+        if self.remaining() - DEADLINE_SAVE_RESERVE_SEC - delay < MIN_ATTEMPT_SEC:
+            return 0.0
+        return delay
+
+
+def is_timeout_error(exc: BaseException) -> bool:
+    # כל SDK זורק סוג אחר (DeadlineExceeded של api_core, httpx.TimeoutException ...)
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, DeadlineExceeded)):
+        return True
+    name = type(exc).__name__.lower()
+    return "timeout" in name or "deadline" in name
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Offline Gemini stand-in – שרת HTTP מקומי שמחקה את generateContent
+#
+#   python fake_gemini_server.py --port 8089
+#   GEMINI_BASE_URL=http://127.0.0.1:8089 GEMINI_API_KEY=fake gunicorn ...
+#
+# התשובות, ה-latency והתקלות המוזרקות מגיעים מ-FakeLLMBackend
+# (אותם משתני FAKE_LLM_* כמו במצב LLM_BACKEND=fake).
+# ===================================================================
+
+import argparse
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backends import ADVISOR_MODEL_ID, FakeLLMBackend, FakeLLMError
+
+_PATH_RE = re.compile(r"^/v1(?:beta|alpha)?/models/(?P<model>[^:/]+):generateContent$")
+
+backend = FakeLLMBackend()
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        m = _PATH_RE.match(self.path.split("?", 1)[0])
+        if not m:
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request_body = json.loads(self.rfile.read(length) or b"{}")
+        except Exception:
+            self._send_json(400, {"error": {"code": 400, "message": "bad json", "status": "INVALID_ARGUMENT"}})
+            return
+
+        prompt = "".join(
+            part.get("text", "")
+            for content in request_body.get("contents", [])
+            for part in content.get("parts", [])
+        )
+        model = m.group("model")
+        try:
+            if model == ADVISOR_MODEL_ID:
+                resp = backend.generate_advisor(prompt)
+            else:
+                resp = backend.generate_report(model, prompt)
+        except TimeoutError as e:
+            self._send_json(504, {"error": {"code": 504, "message": str(e), "status": "DEADLINE_EXCEEDED"}})
+            return
+        except FakeLLMError as e:
+            self._send_json(503, {"error": {"code": 503, "message": str(e), "status": "UNAVAILABLE"}})
+            return
+
+        usage = resp.usage
+        self._send_json(200, {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": resp.text}]},
+                "finishReason": "STOP",
+                "index": 0,
+            }],
+            "usageMetadata": {
+                "promptTokenCount": usage.get("prompt_tokens", 0),
+                "candidatesTokenCount": usage.get("output_tokens", 0),
+                "totalTokenCount": usage.get("total_tokens", 0),
+            },
+            "modelVersion": model,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Gemini stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), FakeGeminiHandler)
+    print(f"[FAKE-GEMINI] listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
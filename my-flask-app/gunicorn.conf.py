@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Gunicorn config – preload + אתחול per-worker
+# הרצה: gunicorn -c gunicorn.conf.py app:app
+# ===================================================================
+import gc
+import os
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 1))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+
+# create_app (config, מילון רכבים, routes, templates) נטען פעם אחת ב-master
+# ומשותף ל-workers דרך copy-on-write.
+preload_app = True
+
+# מיחזור workers מדי פעם (0 = כבוי); ה-respawn זול כי הכל כבר טעון ב-master
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+
+def when_ready(server):
+    # חיבורים שנפתחו ב-create_app (create_all, מילוני דחיסה) נסגרים לפני ה-fork
+    from app import app, db
+    from db_pool import dispose_engines
+    with app.app_context():
+        dispose_engines(db.engines.values())
+
+    # מקפיא את כל האובייקטים שנטענו ב-master כדי שה-GC של ה-workers
+    # לא יגע בהם (ולא ישבור את שיתוף הדפים)
+    gc.freeze()
+    server.log.info("[BOOT] gc.freeze() – %d objects frozen", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    from app import app, init_worker_resources, SchemaNotReady
+    try:
+        init_worker_resources(app)
+    except SchemaNotReady as e:
+        # קוד 3 (WORKER_BOOT_ERROR) – ה-master עוצר במקום להרים workers שוב ושוב
+        server.log.error("[BOOT] %s", e)
+        sys.exit(3)
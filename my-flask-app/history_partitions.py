@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# חלוקה חודשית של טבלאות ההיסטוריה + retention וארכוב
+#
+# Postgres: search_history / advisor_history הופכות לטבלאות partitioned
+#   (PARTITION BY RANGE (timestamp)), partition לכל חודש + DEFAULT.
+#   ה-PK הופך ל-(id, timestamp) – דרישה של Postgres; ה-ORM ממשיך לעבוד לפי id.
+#   שאילתות עם טווח timestamp (מכסה יומית, מטמון עד MAX_CACHE_DAYS)
+#   נוגעות רק ב-partitions הרלוונטיים (partition pruning).
+# SQLite / Postgres לפני migrate: טבלאות רגילות – retention מוחק לפי חודש.
+#
+# retention: חודשים ישנים מ-HISTORY_RETENTION_MONTHS נכתבים ל-
+#   HISTORY_ARCHIVE_DIR/<table>-<YYYY-MM>.ndjson.gz (JSON פתוח, לא דחוס
+#   בעמודות), ורק אחרי שהקובץ נכתב וספירת השורות תואמת – ה-partition
+#   מנותק ונמחק (או השורות נמחקות בטבלה רגילה).
+#
+#   flask history-partitions migrate   # חד-פעמי, Postgres בלבד
+#   flask history-partitions ensure    # partitions לחודשים הבאים
+#   flask history-partitions retain [--dry-run]
+#   flask history-partitions status
+#
+# כל הפקודות רצות בלי ה-statement_timeout הגלובלי של ה-pool (SET LOCAL בכל
+# טרנזקציה) – העתקה / ארכוב / מחיקה של חודש שלם לוקחים יותר מ-15 שניות.
+# ===================================================================
+
+import gzip
+import json
+import os
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, MetaData, Table, func, select, text as sa_text
+from sqlalchemy.engine import Connection, Engine
+
+from db_pool import maintenance_connection, maintenance_transaction
+
+HISTORY_RETENTION_MONTHS = int(os.environ.get("HISTORY_RETENTION_MONTHS", 0))  # 0 = ללא retention
+HISTORY_ARCHIVE_DIR = os.environ.get("HISTORY_ARCHIVE_DIR", "history_archive")
+HISTORY_PREMAKE_MONTHS = int(os.environ.get("HISTORY_PARTITION_PREMAKE_MONTHS", 3))
+ARCHIVE_BATCH_ROWS = 1000
+
+PARTITION_KEY = "timestamp"
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def month_start(d) -> datetime:
+    return datetime(d.year, d.month, 1)
+
+
+def add_months(d: datetime, n: int) -> datetime:
+    total = d.year * 12 + (d.month - 1) + n
+    return datetime(total // 12, total % 12 + 1, 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _is_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def _same_columns(table: Table, name: str) -> Table:
+    """Table באותו מבנה (כולל CompressedText) בשם אחר – ל-SELECT מ-partition בודד."""
+    return Table(name, MetaData(), *[Column(c.name, c.type) for c in table.columns])
+
+
+# ==================================
+# === מידע על partitions ===
+# ==================================
+def is_partitioned(conn: Connection, table: str) -> bool:
+    if not _is_postgres(conn):
+        return False
+    return bool(conn.execute(
+        sa_text("SELECT 1 FROM pg_class WHERE relname = :t AND relkind = 'p'"), {"t": table}
+    ).scalar())
+
+
+def list_partitions(conn: Connection, table: str) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """[(name, from, to)] לפי סדר; ל-DEFAULT from/to הם None."""
+    rows = conn.execute(sa_text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t"
+    ), {"t": table}).all()
+    parts = []
+    for name, bound in rows:
+        m = _BOUND_RE.search(bound or "")
+        if m:
+            parts.append((name, datetime.fromisoformat(m.group(1)), datetime.fromisoformat(m.group(2))))
+        else:
+            parts.append((name, None, None))
+    return sorted(parts, key=lambda p: (p[1] is None, p[1] or datetime.min))
+
+
+def _default_partition(table: str) -> str:
+    return f"{table}_default"
+
+
+# ==================================
+# === יצירת partitions ===
+# ==================================
+def _create_month(conn: Connection, table: str, month: datetime) -> bool:
+    name = partition_name(table, month)
+    if conn.execute(sa_text("SELECT 1 FROM pg_class WHERE relname = :n"), {"n": name}).scalar():
+        return False
+    lo, hi = month, add_months(month, 1)
+    bounds = f"FROM ('{lo:%Y-%m-%d}') TO ('{hi:%Y-%m-%d}')"
+    default = _default_partition(table)
+    stray = conn.execute(
+        sa_text(f'SELECT 1 FROM {default} WHERE "{PARTITION_KEY}" >= :lo AND "{PARTITION_KEY}" < :hi LIMIT 1'),
+        {"lo": lo, "hi": hi},
+    ).scalar()
+    if not stray:
+        conn.execute(sa_text(f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}"))
+        return True
+    # יש שורות מהחודש הזה ב-DEFAULT – מעבירים אותן ומחברים את ה-partition
+    conn.execute(sa_text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    where = f'"{PARTITION_KEY}" >= :lo AND "{PARTITION_KEY}" < :hi'
+    conn.execute(sa_text(f"INSERT INTO {name} SELECT * FROM {default} WHERE {where}"), {"lo": lo, "hi": hi})
+    conn.execute(sa_text(f"DELETE FROM {default} WHERE {where}"), {"lo": lo, "hi": hi})
+    conn.execute(sa_text(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}"))
+    return True
+
+
+def ensure_partitions(engine: Engine, table: str, through: Optional[datetime] = None) -> List[str]:
+    """partitions מהחודש הנוכחי ועד HISTORY_PREMAKE_MONTHS קדימה. no-op אם הטבלה לא partitioned."""
+    created = []
+    with maintenance_transaction(engine) as conn:
+        if not is_partitioned(conn, table):
+            return created
+        month = month_start(datetime.now())
+        through = through or add_months(month, HISTORY_PREMAKE_MONTHS)
+        while month <= through:
+            if _create_month(conn, table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    return created
+
+
+def migrate_to_partitioned(engine: Engine, table: str) -> bool:
+    """
+    המרה חד-פעמית של טבלה רגילה לטבלה partitioned (בטרנזקציה אחת, תחת
+    ACCESS EXCLUSIVE – לא להריץ בשעות עומס). מחזיר False אם כבר הומרה.
+    """
+    if not _is_postgres(engine):
+        raise RuntimeError("partitioning is supported on Postgres only")
+    legacy = f"{table}_legacy"
+    with maintenance_transaction(engine) as conn:
+        if is_partitioned(conn, table):
+            return False
+        conn.execute(sa_text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        index_defs = conn.execute(sa_text(
+            "SELECT indexdef FROM pg_indexes i WHERE i.tablename = :t AND i.indexname NOT IN "
+            "(SELECT conname FROM pg_constraint WHERE conrelid = CAST(:t AS regclass) AND contype IN ('p', 'u'))"
+        ), {"t": table}).scalars().all()
+        fk_defs = conn.execute(sa_text(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = CAST(:t AS regclass) AND contype = 'f'"
+        ), {"t": table}).all()
+        pkey = conn.execute(sa_text(
+            "SELECT conname FROM pg_constraint WHERE conrelid = CAST(:t AS regclass) AND contype = 'p'"
+        ), {"t": table}).scalar()
+        identity = conn.execute(sa_text(
+            "SELECT attidentity FROM pg_attribute WHERE attrelid = CAST(:t AS regclass) AND attname = 'id'"
+        ), {"t": table}).scalar()
+        if identity:
+            raise RuntimeError(f"{table}.id is an IDENTITY column – only SERIAL ids are supported")
+        oldest = conn.execute(sa_text(f'SELECT MIN("{PARTITION_KEY}") FROM {table}')).scalar()
+        sequence = conn.execute(sa_text("SELECT pg_get_serial_sequence(:t, 'id')"), {"t": table}).scalar()
+
+        conn.execute(sa_text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+        if pkey:
+            conn.execute(sa_text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {pkey} TO {legacy}_pkey"))
+        conn.execute(sa_text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f'PARTITION BY RANGE ("{PARTITION_KEY}")'
+        ))
+        conn.execute(sa_text(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "{PARTITION_KEY}")'))
+        conn.execute(sa_text(f"CREATE TABLE {_default_partition(table)} PARTITION OF {table} DEFAULT"))
+
+        month = month_start(oldest or datetime.now())
+        last = add_months(month_start(datetime.now()), HISTORY_PREMAKE_MONTHS)
+        while month <= last:
+            _create_month(conn, table, month)
+            month = add_months(month, 1)
+
+        conn.execute(sa_text(f"INSERT INTO {table} SELECT * FROM {legacy}"))
+        if sequence:
+            # ה-sequence של SERIAL שייך לטבלה הישנה – בלי זה DROP ימחק אותו
+            conn.execute(sa_text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+        conn.execute(sa_text(f"DROP TABLE {legacy}"))
+        for name, definition in fk_defs:
+            conn.execute(sa_text(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}"))
+        for definition in index_defs:
+            conn.execute(sa_text(definition))
+    return True
+
+
+# ==================================
+# === retention + ארכוב ===
+# ==================================
+def _archive_path(archive_dir: str, table: str, month: datetime) -> str:
+    path = os.path.join(archive_dir, f"{table}-{month:%Y-%m}.ndjson.gz")
+    if os.path.exists(path):
+        # הרצה חוזרת על אותו חודש (שורות שהגיעו ל-DEFAULT) – לא דורסים ארכיון קיים
+        path = os.path.join(archive_dir, f"{table}-{month:%Y-%m}-{datetime.now():%Y%m%d%H%M%S}.ndjson.gz")
+    return path
+
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def archive_rows(engine: Engine, source: Table, where, path: str) -> int:
+    """כותב את השורות כ-NDJSON.gz (קובץ זמני -> rename). מחזיר מספר שורות."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    query = select(source).order_by(source.c.id)
+    if where is not None:
+        query = query.where(where)
+    with maintenance_connection(engine) as conn, gzip.open(tmp, "wt", encoding="utf-8") as f:
+        result = conn.execution_options(stream_results=True, yield_per=ARCHIVE_BATCH_ROWS).execute(query)
+        for row in result:
+            # עמודות CompressedText נפתחות כאן – הארכיון עומד בפני עצמו
+            f.write(json.dumps({k: _json_value(v) for k, v in row._mapping.items()}, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    if count == 0:
+        os.remove(tmp)
+        return 0
+    os.replace(tmp, path)
+    return count
+
+
+def _old_months(engine: Engine, source: Table, cutoff: datetime) -> List[datetime]:
+    ts = source.c[PARTITION_KEY]
+    with maintenance_connection(engine) as conn:
+        oldest = conn.execute(select(func.min(ts)).where(ts < cutoff)).scalar()
+    if oldest is None:
+        return []
+    if isinstance(oldest, str):  # SQLite בלי type processing על aggregate
+        oldest = datetime.fromisoformat(oldest)
+    months, month = [], month_start(oldest)
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def _retain_rows(engine: Engine, source: Table, table: str, cutoff: datetime,
+                 archive_dir: str, dry_run: bool) -> List[dict]:
+    """retention לפי DELETE – טבלה רגילה, או שאריות ב-DEFAULT partition."""
+    ts = source.c[PARTITION_KEY]
+    actions = []
+    for month in _old_months(engine, source, cutoff):
+        where = (ts >= month) & (ts < add_months(month, 1))
+        if dry_run:
+            with maintenance_connection(engine) as conn:
+                rows = conn.execute(select(func.count()).select_from(source).where(where)).scalar()
+            if rows:
+                actions.append({"table": table, "source": source.name, "month": f"{month:%Y-%m}", "rows": rows})
+            continue
+        path = _archive_path(archive_dir, table, month)
+        archived = archive_rows(engine, source, where, path)
+        if not archived:
+            continue
+        with maintenance_transaction(engine) as conn:
+            deleted = conn.execute(source.delete().where(where)).rowcount
+        actions.append({"table": table, "source": source.name, "month": f"{month:%Y-%m}",
+                        "rows": archived, "deleted": deleted, "archive": path})
+    return actions
+
+
+def retain(engine: Engine, table: Table, months: int = HISTORY_RETENTION_MONTHS,
+           archive_dir: str = HISTORY_ARCHIVE_DIR, dry_run: bool = False) -> List[dict]:
+    """מארכב ומסיר את כל מה שישן מ-months חודשים שלמים. months=0 – לא עושה כלום."""
+    if months <= 0:
+        return []
+    cutoff = add_months(month_start(datetime.now()), -months)
+    with maintenance_connection(engine) as conn:
+        partitioned = is_partitioned(conn, table.name)
+        partitions = list_partitions(conn, table.name) if partitioned else []
+    if not partitioned:
+        return _retain_rows(engine, table, table.name, cutoff, archive_dir, dry_run)
+
+    actions = []
+    for name, lo, hi in partitions:
+        if lo is None or hi > cutoff:
+            continue
+        part = _same_columns(table, name)
+        if dry_run:
+            with maintenance_connection(engine) as conn:
+                rows = conn.execute(select(func.count()).select_from(part)).scalar()
+            actions.append({"table": table.name, "partition": name, "month": f"{lo:%Y-%m}", "rows": rows})
+            continue
+        path = _archive_path(archive_dir, table.name, lo)
+        archived = archive_rows(engine, part, None, path)
+        with maintenance_transaction(engine) as conn:
+            conn.execute(sa_text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+            current = conn.execute(select(func.count()).select_from(part)).scalar()
+            if current != archived:
+                raise RuntimeError(f"{name}: {current} rows but {archived} archived – not dropping")
+            conn.execute(sa_text(f"ALTER TABLE {table.name} DETACH PARTITION {name}"))
+            conn.execute(sa_text(f"DROP TABLE {name}"))
+        actions.append({"table": table.name, "partition": name, "month": f"{lo:%Y-%m}",
+                        "rows": archived, "dropped": True, "archive": path if archived else None})
+    default = _same_columns(table, _default_partition(table.name))
+    actions += _retain_rows(engine, default, table.name, cutoff, archive_dir, dry_run)
+    return actions
+
+
+def status(engine: Engine, table: Table) -> Dict:
+    ts = table.c[PARTITION_KEY]
+    with maintenance_connection(engine) as conn:
+        rows, oldest, newest = conn.execute(select(func.count(), func.min(ts), func.max(ts))).one()
+        info = {
+            "table": table.name,
+            "dialect": engine.dialect.name,
+            "partitioned": is_partitioned(conn, table.name),
+            "rows": rows,
+            "oldest": str(oldest) if oldest else None,
+            "newest": str(newest) if newest else None,
+            "retention_months": HISTORY_RETENTION_MONTHS,
+        }
+        if info["partitioned"]:
+            info["partitions"] = [
+                {
+                    "name": name,
+                    "from": f"{lo:%Y-%m-%d}" if lo else "DEFAULT",
+                    "to": f"{hi:%Y-%m-%d}" if hi else None,
+                    "rows_estimate": conn.execute(
+                        sa_text("SELECT GREATEST(reltuples, 0)::bigint FROM pg_class WHERE relname = :n"), {"n": name}
+                    ).scalar(),
+                }
+                for name, lo, hi in list_partitions(conn, table.name)
+            ]
+    return info
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# דחיסת תגובות HTTP (gzip / brotli לפי Accept-Encoding)
+#
+# after_request שדוחס תגובות JSON / HTML מעל HTTP_COMPRESS_MIN_BYTES.
+# רמות הדחיסה מכוונות ל-latency (gzip 5, brotli 4) – ההבדל בגודל מול
+# הרמות הגבוהות קטן, והזמן קצר פי כמה.
+#
+# תגובות שמגיעות ממסמך שמור (JSONDocument – cache hits, פרטי חיפוש)
+# מסומנות compress_once: הגרסה הדחוסה נשמרת ב-LRU לפי hash של התוכן
+# והקידוד, כך שמסמך פופולרי נדחס פעם אחת ולא בכל בקשה.
+#
+# HTTP_COMPRESSION: "br,gzip" (ברירת מחדל, לפי סדר העדפה) / "gzip" / "off"
+# brotli מגיע מ-requirements.txt (או brotlicffi); אם הוא חסר – gzip בלבד, עם אזהרה בעלייה.
+# ===================================================================
+
+import gzip
+import hashlib
+import os
+from typing import Optional, Sequence
+
+from flask import request
+
+from metrics import HTTP_COMPRESSION, HTTP_COMPRESSION_BYTES
+from shared_cache import MemoryLRU
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:  # gzip בלבד
+        brotli = None
+
+HTTP_COMPRESS_MIN_BYTES = int(os.environ.get("HTTP_COMPRESS_MIN_BYTES", 1024))
+HTTP_GZIP_LEVEL = int(os.environ.get("HTTP_GZIP_LEVEL", 5))
+HTTP_BROTLI_QUALITY = int(os.environ.get("HTTP_BROTLI_QUALITY", 4))
+HTTP_COMPRESS_CACHE_SIZE = int(os.environ.get("HTTP_COMPRESS_CACHE_SIZE", 512))
+HTTP_COMPRESS_CACHE_TTL_SEC = float(os.environ.get("HTTP_COMPRESS_CACHE_TTL_SEC", 600))
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain", "text/csv"}
+
+
+def _enabled_encodings() -> Sequence[str]:
+    raw = os.environ.get("HTTP_COMPRESSION", "br,gzip").strip().lower()
+    if raw in ("", "off", "0", "false"):
+        return ()
+    wanted = [e.strip() for e in raw.split(",") if e.strip()]
+    if "br" in wanted and brotli is None:
+        print("[HTTP] ⚠️ brotli not installed – gzip only")
+    return tuple(e for e in wanted if e == "gzip" or (e == "br" and brotli is not None))
+
+
+HTTP_ENCODINGS = _enabled_encodings()
+
+# (digest, encoding) -> bytes דחוסים
+_compressed_bodies = MemoryLRU(maxsize=HTTP_COMPRESS_CACHE_SIZE, ttl_sec=HTTP_COMPRESS_CACHE_TTL_SEC)
+
+
+def negotiate_encoding(accept_encodings) -> Optional[str]:
+    """הקידוד הטוב ביותר שהלקוח מקבל (כולל q=0 ו-*), לפי סדר ההעדפה שלנו."""
+    if not HTTP_ENCODINGS:
+        return None
+    return accept_encodings.best_match(HTTP_ENCODINGS) or None
+
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=HTTP_BROTLI_QUALITY)
+    # mtime=0 – פלט דטרמיניסטי לאותו תוכן
+    return gzip.compress(body, compresslevel=HTTP_GZIP_LEVEL, mtime=0)
+
+
+def _compress_cached(body: bytes, encoding: str) -> bytes:
+    key = f"{hashlib.blake2b(body, digest_size=16).hexdigest()}:{encoding}"
+    packed = _compressed_bodies.get(key)
+    if packed is not None:
+        HTTP_COMPRESSION.inc(encoding=encoding, outcome="cached")
+        return packed
+    packed = compress_body(body, encoding)
+    _compressed_bodies.set(key, packed)
+    HTTP_COMPRESSION.inc(encoding=encoding, outcome="compressed")
+    return packed
+
+
+def compress_response(response):
+    """after_request: דוחס את הגוף במקום אם הלקוח תומך והתגובה שווה דחיסה."""
+    if not HTTP_ENCODINGS or not (200 <= response.status_code < 300) or response.status_code in (204, 206):
+        return response
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES or "Content-Encoding" in response.headers:
+        return response
+    if "no-transform" in (response.headers.get("Cache-Control") or ""):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < HTTP_COMPRESS_MIN_BYTES:
+        HTTP_COMPRESSION.inc(encoding=encoding, outcome="too_small")
+        return response
+
+    if getattr(response, "compress_once", False):
+        packed = _compress_cached(body, encoding)
+    else:
+        packed = compress_body(body, encoding)
+        HTTP_COMPRESSION.inc(encoding=encoding, outcome="compressed")
+    HTTP_COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage="raw")
+    HTTP_COMPRESSION_BYTES.inc(len(packed), encoding=encoding, stage="sent")
+
+    response.set_data(packed)
+    response.headers["Content-Encoding"] = encoding
+    # ETag חזק מתייחס לבתים – לכל קידוד ETag משלו
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+
+def etag_matches(etag: str) -> bool:
+    """If-None-Match מול ETag – כולל הווריאנטים עם סיומת הקידוד (abc-gzip / abc-br)."""
+    candidates = request.if_none_match
+    if not candidates:
+        return False
+    return any(candidates.contains(tag) for tag in (etag, *(f"{etag}-{enc}" for enc in HTTP_ENCODINGS)))
+
+
+def init_response_compression(app) -> None:
+    # נרשם ראשון => רץ אחרון מבין ה-after_request (אחרי כל מי שנוגע בגוף)
+    app.after_request(compress_response)
+    print(f"[HTTP] response compression: {', '.join(HTTP_ENCODINGS) or 'off'} "
+          f"(min {HTTP_COMPRESS_MIN_BYTES} bytes)")
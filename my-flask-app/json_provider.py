@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# JSON מהיר לתגובות Flask
+#
+#   FastJSONProvider – provider של Flask על orjson (אם מותקן). בלי orjson
+#     נופלים ל-json של stdlib עם ensure_ascii=False, כך שהפלט זהה בשני
+#     המקרים: עברית כ-UTF-8 ולא כ-\uXXXX. התאריכים, Decimal וכו' עוברים
+#     דרך ה-default של Flask (כמו קודם).
+#   JSONDocument – מסמך שכבר שמור כטקסט JSON (result_json) + שדות קטנים
+#     per-request (source_tag, mileage_note...). בתגובה הבתים של המסמך
+#     יוצאים כמו שהם והשדות מודבקים לפני ה-} האחרון – בלי parse מלא.
+#     מפתח שמופיע גם במסמך וגם בשדות – JSON.parse לוקח את האחרון (השדה).
+# ===================================================================
+
+import json
+from typing import Any, Dict, Optional, Union
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # stdlib בלבד
+    orjson = None
+
+_ORJSON_OPTS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+
+def _dumps_bytes(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_document_default, option=_ORJSON_OPTS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_document_default).encode("utf-8")
+
+
+def _document_default(obj: Any) -> Any:
+    if isinstance(obj, JSONDocument):
+        if orjson is not None and hasattr(orjson, "Fragment"):
+            return orjson.Fragment(obj.to_bytes())
+        return obj.to_dict()
+    return DefaultJSONProvider.default(obj)
+
+
+class JSONDocument:
+    """JSON object שכבר מסודר כטקסט + שדות per-request שמודבקים בסוף."""
+    __slots__ = ("raw", "extra", "_parsed")
+
+    def __init__(self, raw: Union[str, bytes], extra: Optional[Dict[str, Any]] = None):
+        self.raw = raw.encode("utf-8") if isinstance(raw, str) else raw
+        self.extra = dict(extra or {})
+        self._parsed = None
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.extra or key in self.to_dict()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.extra:
+            return self.extra[key]
+        return self.to_dict()[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.extra[key] = value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> dict:
+        if self._parsed is None:
+            self._parsed = orjson.loads(self.raw) if orjson is not None else json.loads(self.raw)
+        return {**self._parsed, **self.extra}
+
+    def to_bytes(self) -> bytes:
+        if not self.extra:
+            return self.raw
+        body = self.raw.rstrip()
+        if not body.endswith(b"}"):
+            # לא object – אין איפה להדביק
+            return _dumps_bytes(self.to_dict())
+        head = body[:-1].rstrip()
+        sep = b"" if head.endswith(b"{") else b","
+        return head + sep + _dumps_bytes(self.extra)[1:]
+
+    def to_text(self) -> str:
+        return self.to_bytes().decode("utf-8")
+
+
+def dumps_text(obj: Any) -> str:
+    """json.dumps(obj, ensure_ascii=False) שמבין גם JSONDocument (לשמירה ב-DB)."""
+    if isinstance(obj, JSONDocument):
+        return obj.to_text()
+    return _dumps_bytes(obj).decode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    ensure_ascii = False
+    default = staticmethod(_document_default)
+
+    def _options(self, indent: bool) -> int:
+        opts = _ORJSON_OPTS
+        if self.sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        if indent:
+            opts |= orjson.OPT_INDENT_2
+        return opts
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options(bool(kwargs.get("indent")))).decode("utf-8")
+        except TypeError:
+            # למשל int מעבר ל-64 ביט – stdlib מסתדר
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # NaN / Infinity וכו' – stdlib מקבל אותם, או זורק את השגיאה הרגילה
+            return super().loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        document = isinstance(obj, JSONDocument)
+        if document and not indent:
+            body = obj.to_bytes()
+        elif orjson is not None:
+            try:
+                body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+            except TypeError:
+                return super().response(obj)
+        else:
+            return super().response(obj)
+        response = self._app.response_class(body + b"\n", mimetype=self.mimetype)
+        # מסמך שמור – הגרסה הדחוסה שלו נשמרת (ראה http_compression)
+        response.compress_once = document
+        return response
@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# LLM backends – ממשק אחיד מאחורי call_model_with_retry ו-Car Advisor
+#
+#   LLM_BACKEND=gemini  (ברירת מחדל) – Gemini אמיתי דרך שני ה-SDK-ים
+#   LLM_BACKEND=fake    – backend מקומי ללא רשת, עם latency / שגיאות /
+#                         JSON שבור / timeouts להזרקה (לבדיקות עומס)
+#
+# אפשר גם להריץ את fake_gemini_server.py ולהפנות אליו את backend ה-gemini
+# עם GEMINI_BASE_URL, כדי לבדוק גם את שכבת ה-SDK וה-HTTP.
+# ===================================================================
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time as pytime
+from typing import Optional
+
+ADVISOR_MODEL_ID = "gemini-3-pro-preview"
+
+
+class LLMUnavailable(RuntimeError):
+    """ה-backend לא מאותחל (למשל חסר GEMINI_API_KEY)."""
+
+
+class LLMResponse:
+    """
+    text + usage: {"prompt_tokens", "output_tokens", "total_tokens"}
+    (output כולל thinking tokens – שגם הם מחויבים כ-output).
+    """
+
+    def __init__(self, text: str, model: str, usage: Optional[dict] = None):
+        self.text = text
+        self.model = model
+        self.usage = usage or {}
+
+
+def usage_from_response(resp) -> dict:
+    # usage_metadata קיים בשני ה-SDK-ים עם אותם שמות שדות
+    meta = getattr(resp, "usage_metadata", None)
+    if meta is None:
+        return {}
+    prompt_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    output_tokens = (getattr(meta, "candidates_token_count", 0) or 0) + (getattr(meta, "thoughts_token_count", 0) or 0)
+    total_tokens = getattr(meta, "total_token_count", 0) or (prompt_tokens + output_tokens)
+    return {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens, "total_tokens": total_tokens}
+
+
+def estimate_usage(prompt: str, text: str) -> dict:
+    # הערכה גסה (~4 תווים לטוקן) – ל-backend המקומי
+    prompt_tokens = max(1, len(prompt) // 4)
+    output_tokens = max(1, len(text) // 4)
+    return {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens}
+
+
+class LLMBackend:
+    """
+    ממשק: generate_report – דוח אמינות (SDK הישן, מודל לפי שם),
+    generate_advisor – המלצות (Gemini 3 + Google Search, JSON בלבד).
+    לכל אחת גרסת async (a*) עבור מצב ASGI.
+    timeout (שניות) – הזמן שנותר מה-deadline של הבקשה לניסיון הזה.
+    """
+    name = "base"
+
+    def init_worker(self) -> None:
+        pass
+
+    def warm(self, model_names) -> None:
+        """בונה מראש אובייקטים per-model (אחרי init_worker)."""
+
+    def generate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    async def agenerate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        return await asyncio.to_thread(self.generate_report, model_name, prompt, timeout)
+
+    def generate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    async def agenerate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        return await asyncio.to_thread(self.generate_advisor, prompt, timeout)
+
+
+# ==================================
+# === Gemini (אמיתי) ===
+# ==================================
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, base_url: str = ""):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.advisor_client = None
+        # registry per-worker: GenerativeModel לפי שם + config קבוע ל-Car Advisor.
+        # ה-SDK-ים מחזיקים את ערוץ ה-gRPC / ה-HTTP session בתוך ה-client,
+        # כך ששימוש חוזר באותם אובייקטים שומר גם על חיבורי keep-alive.
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._advisor_config = None
+
+    def init_worker(self) -> None:
+        import google.generativeai as genai
+        from google import genai as genai3
+        from google.genai import types as genai_types
+
+        self._models = {}
+        self._advisor_config = self.advisor_config()
+
+        if self.base_url:
+            genai.configure(
+                api_key=self.api_key, transport="rest",
+                client_options={"api_endpoint": self.base_url},
+            )
+        else:
+            genai.configure(api_key=self.api_key)
+
+        # Gemini 3 client עבור Car Advisor (SDK החדש)
+        if self.api_key:
+            try:
+                http_options = genai_types.HttpOptions(base_url=self.base_url) if self.base_url else None
+                self.advisor_client = genai3.Client(api_key=self.api_key, http_options=http_options)
+                print("[CAR-ADVISOR] ✅ Gemini 3 client initialized")
+            except Exception as e:
+                self.advisor_client = None
+                print(f"[CAR-ADVISOR] ❌ Failed to init Gemini 3 client: {e}")
+        else:
+            self.advisor_client = None
+
+    def model(self, model_name: str):
+        llm = self._models.get(model_name)
+        if llm is None:
+            import google.generativeai as genai
+            with self._models_lock:
+                llm = self._models.get(model_name)
+                if llm is None:
+                    llm = genai.GenerativeModel(model_name)
+                    self._models[model_name] = llm
+        return llm
+
+    def warm(self, model_names) -> None:
+        for model_name in model_names:
+            self.model(model_name)
+
+    @staticmethod
+    def _request_options(timeout: Optional[float]) -> dict:
+        return {"timeout": timeout} if timeout else {}
+
+    def _advisor_call_config(self, timeout: Optional[float]):
+        if not timeout:
+            return self._advisor_config
+        from google.genai import types as genai_types
+        # HttpOptions.timeout במילישניות; העתק רדוד – ה-Tool עצמו משותף
+        return self._advisor_config.model_copy(
+            update={"http_options": genai_types.HttpOptions(timeout=int(timeout * 1000))}
+        )
+
+    def generate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        resp = self.model(model_name).generate_content(prompt, request_options=self._request_options(timeout))
+        return LLMResponse(getattr(resp, "text", "") or "", model_name, usage_from_response(resp))
+
+    async def agenerate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        resp = await self.model(model_name).generate_content_async(
+            prompt, request_options=self._request_options(timeout)
+        )
+        return LLMResponse(getattr(resp, "text", "") or "", model_name, usage_from_response(resp))
+
+    @staticmethod
+    def advisor_config():
+        from google.genai import types as genai_types
+        search_tool = genai_types.Tool(
+            google_search=genai_types.GoogleSearch()
+        )
+        return genai_types.GenerateContentConfig(
+            temperature=0.3,
+            top_p=0.9,
+            top_k=40,
+            tools=[search_tool],
+            response_mime_type="application/json",
+        )
+
+    def generate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        if self.advisor_client is None:
+            raise LLMUnavailable("Gemini Car Advisor client unavailable.")
+        resp = self.advisor_client.models.generate_content(
+            model=ADVISOR_MODEL_ID,
+            contents=prompt,
+            config=self._advisor_call_config(timeout),
+        )
+        return LLMResponse(getattr(resp, "text", "") or "", ADVISOR_MODEL_ID, usage_from_response(resp))
+
+    async def agenerate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        if self.advisor_client is None:
+            raise LLMUnavailable("Gemini Car Advisor client unavailable.")
+        resp = await self.advisor_client.aio.models.generate_content(
+            model=ADVISOR_MODEL_ID,
+            contents=prompt,
+            config=self._advisor_call_config(timeout),
+        )
+        return LLMResponse(getattr(resp, "text", "") or "", ADVISOR_MODEL_ID, usage_from_response(resp))
+
+
+# ==================================
+# === Fake (offline) ===
+# ==================================
+class FakeLLMError(RuntimeError):
+    """שגיאה מוזרקת (מדמה 5xx / quota של Gemini)."""
+
+
+class FakeLLMConfig:
+    """
+    FAKE_LLM_LATENCY_MS       ממוצע latency (ברירת מחדל 800)
+    FAKE_LLM_LATENCY_DIST     fixed | uniform | exponential | lognormal
+    FAKE_LLM_LATENCY_SPREAD   uniform: ±חלק מהממוצע, lognormal: sigma (ברירת מחדל 0.5)
+    FAKE_LLM_ADVISOR_FACTOR   פי כמה Car Advisor איטי יותר (ברירת מחדל 4)
+    FAKE_LLM_ERROR_RATE       הסתברות לשגיאה (0–1)
+    FAKE_LLM_MALFORMED_RATE   הסתברות ל-JSON שבור
+    FAKE_LLM_TIMEOUT_RATE     הסתברות ל-timeout
+    FAKE_LLM_TIMEOUT_SEC      כמה זמן "נתקעים" לפני ה-timeout (ברירת מחדל 60)
+    FAKE_LLM_SEED             seed לשחזור
+    """
+
+    def __init__(self, **overrides):
+        env = os.environ
+        self.latency_ms = float(env.get("FAKE_LLM_LATENCY_MS", 800))
+        self.latency_dist = env.get("FAKE_LLM_LATENCY_DIST", "lognormal")
+        self.latency_spread = float(env.get("FAKE_LLM_LATENCY_SPREAD", 0.5))
+        self.advisor_factor = float(env.get("FAKE_LLM_ADVISOR_FACTOR", 4))
+        self.error_rate = float(env.get("FAKE_LLM_ERROR_RATE", 0))
+        self.malformed_rate = float(env.get("FAKE_LLM_MALFORMED_RATE", 0))
+        self.timeout_rate = float(env.get("FAKE_LLM_TIMEOUT_RATE", 0))
+        self.timeout_sec = float(env.get("FAKE_LLM_TIMEOUT_SEC", 60))
+        seed = env.get("FAKE_LLM_SEED")
+        self.seed = int(seed) if seed not in (None, "") else None
+        for key, value in overrides.items():
+            setattr(self, key, value)
+
+
+_FAKE_ISSUES = [
+    ("רעידות בגיר האוטומטי", 3500, "בינוני"),
+    ("תקלה במשאבת מים", 1200, "בינוני"),
+    ("בלאי מוקדם ברפידות בלמים", 800, "נמוך"),
+    ("נזילת שמן מאטם ראש מנוע", 2500, "בינוני"),
+    ("תקלה בחיישני חניה", 600, "נמוך"),
+    ("כשל במצמד כפול (DSG)", 7000, "גבוה"),
+    ("תקלה במערכת המיזוג", 1800, "בינוני"),
+    ("בעיות במערכת המולטימדיה", 900, "נמוך"),
+    ("שחיקת זרועות מתלה", 1500, "בינוני"),
+    ("תקלה במצבר ההיברידי", 9000, "גבוה"),
+]
+
+_FAKE_MODELS = [
+    ("Toyota", "Corolla", 1600, False), ("Toyota", "Yaris", 1500, False),
+    ("Hyundai", "i30", 1600, False), ("Hyundai", "Tucson", 1600, True),
+    ("Kia", "Picanto", 1200, False), ("Kia", "Niro", 1600, False),
+    ("Mazda", "3", 2000, False), ("Skoda", "Octavia", 1400, True),
+    ("Suzuki", "Swift", 1200, False), ("Honda", "Civic", 1500, True),
+    ("Mitsubishi", "Outlander", 2000, False), ("Seat", "Leon", 1400, True),
+]
+
+_CAR_LINE_RE = re.compile(r"רכב:\s*(.+)")
+_PROFILE_RE = re.compile(r"\(JSON\):\s*(\{.*?\n\})", re.DOTALL)
+
+
+class FakeLLMBackend(LLMBackend):
+    name = "fake"
+
+    def __init__(self, config: Optional[FakeLLMConfig] = None):
+        self.config = config or FakeLLMConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+
+    # ---- הזרקת התנהגות ----
+    def _draw(self):
+        with self._lock:
+            return self._rng.random(), self._rng.random()
+
+    def _latency_sec(self, factor: float = 1.0) -> float:
+        cfg = self.config
+        mean = cfg.latency_ms * factor / 1000.0
+        with self._lock:
+            if cfg.latency_dist == "fixed":
+                value = mean
+            elif cfg.latency_dist == "uniform":
+                spread = mean * cfg.latency_spread
+                value = self._rng.uniform(mean - spread, mean + spread)
+            elif cfg.latency_dist == "exponential":
+                value = self._rng.expovariate(1.0 / mean) if mean > 0 else 0.0
+            else:
+                sigma = cfg.latency_spread
+                mu = math.log(mean) - sigma * sigma / 2 if mean > 0 else 0.0
+                value = self._rng.lognormvariate(mu, sigma) if mean > 0 else 0.0
+        return max(0.0, value)
+
+    def _plan(self, factor: float):
+        """מחזיר (delay, failure) – failure אחד מ: None / 'error' / 'timeout' / 'malformed'."""
+        cfg = self.config
+        roll, _ = self._draw()
+        if roll < cfg.timeout_rate:
+            return cfg.timeout_sec, "timeout"
+        roll -= cfg.timeout_rate
+        if roll < cfg.error_rate:
+            return self._latency_sec(factor) / 4, "error"
+        roll -= cfg.error_rate
+        if roll < cfg.malformed_rate:
+            return self._latency_sec(factor), "malformed"
+        return self._latency_sec(factor), None
+
+    @staticmethod
+    def _fail(failure: str, model: str):
+        if failure == "timeout":
+            raise TimeoutError(f"fake {model}: deadline exceeded (injected)")
+        raise FakeLLMError(f"fake {model}: 503 Service Unavailable (injected)")
+
+    @staticmethod
+    def _malform(text: str) -> str:
+        # JSON קטוע עם טקסט מסביב – מפעיל את מסלול repair_json
+        cut = max(10, int(len(text) * 0.8))
+        return "הנה התשובה:\n```json\n" + text[:cut]
+
+    # ---- דוח אמינות ----
+    def render_report(self, prompt: str) -> str:
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12], 16)
+        rng = random.Random(digest)
+        m = _CAR_LINE_RE.search(prompt)
+        car = m.group(1).strip() if m else "הרכב המבוקש"
+
+        keys = [
+            "engine_transmission_score", "electrical_score", "suspension_brakes_score",
+            "maintenance_cost_score", "satisfaction_score", "recalls_score",
+        ]
+        breakdown = {k: rng.randint(5, 10) for k in keys}
+        base = round(sum(breakdown.values()) / len(keys) * 10, 1)
+        issues = rng.sample(_FAKE_ISSUES, 3)
+        issues_with_costs = [
+            {"issue": name, "avg_cost_ILS": cost, "source": "פורום בעלי רכב (סימולציה)", "severity": sev}
+            for name, cost, sev in issues
+        ]
+        report = {
+            "search_performed": True,
+            "score_breakdown": breakdown,
+            "base_score_calculated": base,
+            "common_issues": [i[0] for i in issues],
+            "avg_repair_cost_ILS": round(sum(i[1] for i in issues) / len(issues)),
+            "issues_with_costs": issues_with_costs,
+            "reliability_summary": (
+                f"{car}: ניתוח סימולציה ללא חיבור ל-Gemini. הציון הכללי {base} מבוסס על ממוצע "
+                f"תתי-הציונים. נקודות חוזק: מנוע ותיבת הילוכים יציבים יחסית. נקודות תורפה: "
+                f"{issues[0][0]} ו-{issues[1][0]}. מומלץ לבדוק היסטוריית טיפולים מלאה."
+            ),
+            "reliability_summary_simple": (
+                f"זה רכב עם אמינות {'טובה' if base >= 75 else 'בינונית'}. רוב הזמן הוא לא יעשה בעיות, "
+                "אבל כדאי לעשות בדיקה במוסך לפני שקונים."
+            ),
+            "sources": ["https://example.invalid/fake-source-1", "https://example.invalid/fake-source-2"],
+            "recommended_checks": ["בדיקת גיר במוסך מורשה", "בדיקת מחשב לתקלות שמורות", "בדיקת בלמים ומתלים"],
+            "common_competitors_brief": [
+                {"model": "מתחרה א׳", "brief_summary": "אמינות דומה, עלויות אחזקה מעט גבוהות יותר"},
+                {"model": "מתחרה ב׳", "brief_summary": "אמינות גבוהה, מחיר קנייה גבוה יותר"},
+            ],
+        }
+        return json.dumps(report, ensure_ascii=False)
+
+    # ---- Car Advisor ----
+    def render_advisor(self, prompt: str) -> str:
+        profile = {}
+        m = _PROFILE_RE.search(prompt)
+        if m:
+            try:
+                profile = json.loads(m.group(1))
+            except Exception:
+                profile = {}
+        digest = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12], 16)
+        rng = random.Random(digest)
+
+        budget = profile.get("budget_nis") or [40000, 120000]
+        years = profile.get("years") or [2015, 2022]
+        fuels = profile.get("fuel") or ["gasoline"]
+        gears = profile.get("gear") or ["automatic"]
+
+        cars = []
+        for brand, model, cc, turbo in rng.sample(_FAKE_MODELS, rng.randint(5, 10)):
+            fuel = rng.choice(fuels)
+            is_ev = fuel == "electric"
+            price_low = int(rng.uniform(float(budget[0]), float(budget[1])) // 1000 * 1000)
+            cars.append({
+                "brand": brand,
+                "model": model,
+                "year": rng.randint(int(years[0]), int(years[1])),
+                "fuel": fuel,
+                "gear": rng.choice(gears),
+                "turbo": turbo,
+                "engine_cc": 0 if is_ev else cc,
+                "price_range_nis": [price_low, price_low + 8000],
+                "avg_fuel_consumption": round(rng.uniform(14, 18), 1) if is_ev else round(rng.uniform(11, 20), 1),
+                "fuel_method": "ממוצע נתוני יצרן ובעלי רכב (סימולציה)",
+                "annual_fee": rng.randint(1000, 2500),
+                "fee_method": "לפי טבלת אגרת רישוי (סימולציה)",
+                "reliability_score": rng.randint(6, 10),
+                "reliability_method": "ממוצע דוחות אמינות (סימולציה)",
+                "maintenance_cost": rng.randint(2500, 6000),
+                "maintenance_method": "טיפולים שנתיים ממוצעים (סימולציה)",
+                "safety_rating": rng.randint(6, 10),
+                "safety_method": "דירוג Euro NCAP (סימולציה)",
+                "insurance_cost": rng.randint(3500, 8000),
+                "insurance_method": "הערכת ביטוח מקיף לנהג ממוצע (סימולציה)",
+                "resale_value": rng.randint(5, 10),
+                "resale_method": "שמירת ערך במחירון (סימולציה)",
+                "performance_score": rng.randint(4, 9),
+                "performance_method": "הספק ומשקל (סימולציה)",
+                "comfort_features": rng.randint(5, 9),
+                "comfort_method": "רמת גימור ואבזור (סימולציה)",
+                "suitability": rng.randint(5, 10),
+                "suitability_method": "התאמה לפרופיל המשתמש (סימולציה)",
+                "market_supply": rng.choice(["גבוה", "בינוני", "נמוך"]),
+                "supply_method": "מספר מודעות ביד 2 (סימולציה)",
+                "fit_score": rng.randint(55, 95),
+                "comparison_comment": "רכב מאוזן שמתאים לרוב הצרכים (סימולציה)",
+                "not_recommended_reason": None,
+            })
+        cars.sort(key=lambda c: c["fit_score"], reverse=True)
+        return json.dumps({
+            "search_performed": True,
+            "search_queries": ["רכב יד 2 אמין בתקציב", "צריכת דלק ממוצעת רכב משפחתי"],
+            "recommended_cars": cars,
+        }, ensure_ascii=False)
+
+    # ---- ממשק ----
+    def _respond(self, model: str, prompt: str, text: str, failure: Optional[str]) -> LLMResponse:
+        if failure in ("error", "timeout"):
+            self._fail(failure, model)
+        if failure == "malformed":
+            text = self._malform(text)
+        return LLMResponse(text, model, estimate_usage(prompt, text))
+
+    @staticmethod
+    def _apply_timeout(delay: float, failure: Optional[str], timeout: Optional[float]):
+        # כמו ה-SDK: אם התשובה מתעכבת מעבר ל-timeout – נכשלים אחרי timeout שניות
+        if timeout is not None and delay > timeout:
+            return timeout, "timeout"
+        return delay, failure
+
+    def generate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        delay, failure = self._apply_timeout(*self._plan(1.0), timeout)
+        pytime.sleep(delay)
+        return self._respond(model_name, prompt, self.render_report(prompt), failure)
+
+    async def agenerate_report(self, model_name: str, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        delay, failure = self._apply_timeout(*self._plan(1.0), timeout)
+        await asyncio.sleep(delay)
+        return self._respond(model_name, prompt, self.render_report(prompt), failure)
+
+    def generate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        delay, failure = self._apply_timeout(*self._plan(self.config.advisor_factor), timeout)
+        pytime.sleep(delay)
+        return self._respond(ADVISOR_MODEL_ID, prompt, self.render_advisor(prompt), failure)
+
+    async def agenerate_advisor(self, prompt: str, timeout: Optional[float] = None) -> LLMResponse:
+        delay, failure = self._apply_timeout(*self._plan(self.config.advisor_factor), timeout)
+        await asyncio.sleep(delay)
+        return self._respond(ADVISOR_MODEL_ID, prompt, self.render_advisor(prompt), failure)
+
+
+def create_llm_backend(name: str, api_key: str = "") -> LLMBackend:
+    name = (name or "gemini").strip().lower()
+    if name == "fake":
+        return FakeLLMBackend()
+    if name == "gemini":
+        return GeminiBackend(api_key, base_url=os.environ.get("GEMINI_BASE_URL", ""))
+    raise ValueError(f"Unknown LLM_BACKEND: {name}")
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Metrics – מונים והיסטוגרמות per-stage, ייצוא בפורמט Prometheus text
+#
+# כל תהליך מחזיק רישום משלו. אם מוגדר METRICS_MULTIPROC_DIR, כל worker
+# כותב snapshot לקובץ <pid>.json בתיקייה, ו-/metrics מחבר את כולם
+# (כך ש-scrape דרך כל worker מחזיר את תמונת המצב של כל ה-host).
+# ===================================================================
+
+import json
+import os
+import threading
+import time as pytime
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL_SEC = float(os.environ.get("METRICS_FLUSH_INTERVAL_SEC", 2.0))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {"|".join(k): v for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(dumps: List[dict]) -> dict:
+        out: Dict[str, float] = {}
+        for d in dumps:
+            for k, v in d.items():
+                out[k] = out.get(k, 0.0) + v
+        return out
+
+    def render(self, merged: dict) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key in sorted(merged):
+            values = key.split("|") if self.labelnames else []
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(merged[key])}")
+        return lines
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = [0.0] * (len(self.buckets) + 2)
+                self._values[key] = row
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {"|".join(k): list(v) for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(dumps: List[dict]) -> dict:
+        out: Dict[str, List[float]] = {}
+        for d in dumps:
+            for k, row in d.items():
+                if k not in out:
+                    out[k] = list(row)
+                elif len(out[k]) == len(row):
+                    out[k] = [a + b for a, b in zip(out[k], row)]
+        return out
+
+    def render(self, merged: dict) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key in sorted(merged):
+            row = merged[key]
+            values = key.split("|") if self.labelnames else []
+            for i, bound in enumerate(self.buckets):
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {_format_value(row[i])}")
+            labels = _format_labels(self.labelnames, values, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{labels} {_format_value(row[-1])}")
+            base = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{base} {_format_value(row[-2])}")
+            lines.append(f"{self.name}_count{base} {_format_value(row[-1])}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        # gauges שמחושבים בזמן ה-scrape: name -> (help, labelnames, fn -> [(label values, value)])
+        self._gauges: Dict[str, Tuple[str, Tuple[str, ...], Callable]] = {}
+        self._last_flush = 0.0
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labelnames)
+        self._metrics[name] = metric
+        return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def gauge_callback(self, name: str, help_text: str, labelnames: Tuple[str, ...], fn: Callable) -> None:
+        self._gauges[name] = (help_text, labelnames, fn)
+
+    # ---- multiprocess ----
+    def _snapshot(self) -> dict:
+        snap = {name: m.dump() for name, m in self._metrics.items()}
+        gauges = {}
+        for name, (_, _, fn) in self._gauges.items():
+            try:
+                gauges[name] = {"|".join(str(v) for v in labels): value for labels, value in fn()}
+            except Exception:
+                gauges[name] = {}
+        snap["__gauges__"] = gauges
+        return snap
+
+    def flush(self, force: bool = False) -> None:
+        if not METRICS_MULTIPROC_DIR:
+            return
+        now = pytime.monotonic()
+        if not force and now - self._last_flush < METRICS_FLUSH_INTERVAL_SEC:
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+            path = os.path.join(METRICS_MULTIPROC_DIR, f"{os.getpid()}.json")
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._snapshot(), f)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"[METRICS] ⚠️ flush failed: {e}")
+
+    def _collect_snapshots(self) -> List[dict]:
+        if not METRICS_MULTIPROC_DIR:
+            return [self._snapshot()]
+        self.flush(force=True)
+        snaps = []
+        for fname in os.listdir(METRICS_MULTIPROC_DIR):
+            if not fname.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(METRICS_MULTIPROC_DIR, fname), encoding="utf-8") as f:
+                    snap = json.load(f)
+            except Exception:
+                continue
+            # gauges של תהליכים שכבר לא חיים לא נספרים
+            if not _pid_alive(fname[:-5]):
+                snap["__gauges__"] = {}
+            snaps.append(snap)
+        return snaps
+
+    def render(self) -> str:
+        snaps = self._collect_snapshots()
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            merged = metric.merge([s.get(name, {}) for s in snaps])
+            lines.extend(metric.render(merged))
+        for name, (help_text, labelnames, _) in self._gauges.items():
+            merged = Counter.merge([s.get("__gauges__", {}).get(name, {}) for s in snaps])
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for key in sorted(merged):
+                values = key.split("|") if labelnames else []
+                lines.append(f"{name}{_format_labels(labelnames, values)} {_format_value(merged[key])}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid_str: str) -> bool:
+    try:
+        os.kill(int(pid_str), 0)
+        return True
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        return True
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_LATENCY = REGISTRY.histogram(
+    "car_stage_duration_seconds", "Latency of each pipeline stage", ("pipeline", "stage"))
+STAGE_TOTAL = REGISTRY.counter(
+    "car_stage_total", "Pipeline stage executions by outcome", ("pipeline", "stage", "outcome"))
+LLM_LATENCY = REGISTRY.histogram(
+    "car_llm_call_duration_seconds", "Latency of a single LLM call attempt", ("pipeline", "model", "outcome"))
+LLM_TOKENS = REGISTRY.counter(
+    "car_llm_tokens_total", "LLM tokens consumed", ("pipeline", "model", "kind"))
+LLM_COST = REGISTRY.counter(
+    "car_llm_cost_ils_total", "Estimated LLM spend in ILS", ("pipeline", "model"))
+ADMISSION_TOTAL = REGISTRY.counter(
+    "car_llm_admission_total", "LLM admission decisions", ("pipeline", "outcome"))
+ADMISSION_WAIT = REGISTRY.histogram(
+    "car_llm_admission_wait_seconds", "Time spent waiting for an LLM slot", ("pipeline",))
+LLM_JOBS = REGISTRY.counter(
+    "car_llm_jobs_total", "LLM lane jobs by outcome", ("kind", "outcome"))
+LLM_JOB_WAIT = REGISTRY.histogram(
+    "car_llm_job_queue_wait_seconds", "Time an LLM job waited before a lane picked it up", ("kind",))
+SHARED_CACHE_OPS = REGISTRY.counter(
+    "car_tiered_cache_ops_total", "L1 (memory) / L2 (host SQLite) cache operations", ("tier", "op", "outcome"))
+HTTP_COMPRESSION = REGISTRY.counter(
+    "car_http_compression_total", "Response compression by encoding and outcome", ("encoding", "outcome"))
+HTTP_COMPRESSION_BYTES = REGISTRY.counter(
+    "car_http_compression_bytes_total", "Response body bytes before / after compression", ("encoding", "stage"))
+CACHE_LOOKUPS = REGISTRY.counter(
+    "car_analyze_cache_total", "Reliability cache lookups by outcome", ("outcome",))
+USER_LOOKUPS = REGISTRY.counter(
+    "car_user_lookups_total", "current_user resolution by source (session / memory / db)", ("source",))
+HTTP_LATENCY = REGISTRY.histogram(
+    "car_http_request_duration_seconds", "HTTP request latency by endpoint", ("endpoint", "method", "status"))
+
+
+@contextmanager
+def stage_timer(pipeline: str, stage: str):
+    """
+    with stage_timer("analyze", "quota"): ...
+    מודד latency ומונה ok/error (חריגה נחשבת error ומועברת הלאה).
+    """
+    t0 = pytime.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_LATENCY.observe(pytime.perf_counter() - t0, pipeline=pipeline, stage=stage)
+        STAGE_TOTAL.inc(pipeline=pipeline, stage=stage, outcome=outcome)
+        REGISTRY.flush()
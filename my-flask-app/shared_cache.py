@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Cache דו-שכבתי: L1 בזיכרון התהליך + L2 משותף לכל ה-workers ב-host
+#
+#   L1 – LRU + TTL per-process (dict, ללא I/O)
+#   L2 – קובץ SQLite (WAL + mmap) ב-SHARED_CACHE_PATH: בטוח לכמה תהליכים,
+#        שורד restart של workers, עם TTL ופינוי LRU לפי גודל / מספר רשומות
+#
+# ה-cache הוא שכבת האצה בלבד: כל תקלה ב-L2 נרשמת ומחזירה miss,
+# והמקור (Postgres) נשאר מקור האמת.
+# ===================================================================
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time as pytime
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import SHARED_CACHE_OPS
+
+SHARED_CACHE_PATH = os.environ.get("SHARED_CACHE_PATH") or os.path.join(tempfile.gettempdir(), "car_shared_cache.sqlite3")
+SHARED_CACHE_MAX_MB = float(os.environ.get("SHARED_CACHE_MAX_MB", 256))
+SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("SHARED_CACHE_MAX_ENTRIES", 50000))
+CACHE_L1_SIZE = int(os.environ.get("CACHE_L1_SIZE", 2000))
+CACHE_L1_TTL_SEC = float(os.environ.get("CACHE_L1_TTL_SEC", 300))
+
+# עדכון accessed_at (ל-LRU) לכל היותר פעם ב-X שניות לרשומה – חוסך כתיבות
+_TOUCH_INTERVAL_SEC = 60
+_EVICT_EVERY_WRITES = 200
+
+
+class MemoryLRU:
+    """LRU + TTL בזיכרון התהליך (thread-safe)."""
+
+    def __init__(self, maxsize: int = CACHE_L1_SIZE, ttl_sec: float = CACHE_L1_TTL_SEC):
+        self.maxsize = maxsize
+        self.ttl_sec = ttl_sec
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= pytime.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, ttl_sec: Optional[float] = None) -> None:
+        ttl = min(ttl_sec, self.ttl_sec) if ttl_sec is not None else self.ttl_sec
+        with self._lock:
+            self._data[key] = (value, pytime.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_prefix(self, prefix: str) -> None:
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteSharedCache:
+    """L2 משותף ב-host. חיבור נפרד לכל thread ולכל pid (לא משתפים חיבורים דרך fork)."""
+
+    def __init__(self, path: str = SHARED_CACHE_PATH, max_bytes: int = int(SHARED_CACHE_MAX_MB * 1024 * 1024),
+                 max_entries: int = SHARED_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=67108864")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_accessed ON cache (accessed_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = pytime.time()
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at, accessed_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+                return None
+            if now - accessed_at > _TOUCH_INTERVAL_SEC:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+        except sqlite3.Error as e:
+            SHARED_CACHE_OPS.inc(tier="l2", op="get", outcome="error")
+            print(f"[L2] ⚠️ get failed: {e}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl_sec: float) -> None:
+        now = pytime.time()
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at, size) VALUES (?, ?, ?, ?, ?)",
+                (key, value, now + ttl_sec, now, len(value)),
+            )
+        except sqlite3.Error as e:
+            SHARED_CACHE_OPS.inc(tier="l2", op="set", outcome="error")
+            print(f"[L2] ⚠️ set failed: {e}")
+            return
+        with self._writes_lock:
+            self._writes += 1
+            evict = self._writes % _EVICT_EVERY_WRITES == 0
+        if evict:
+            self.evict()
+
+    def delete_prefix(self, prefix: str) -> int:
+        try:
+            escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            cur = self._conn().execute("DELETE FROM cache WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",))
+            return cur.rowcount
+        except sqlite3.Error as e:
+            print(f"[L2] ⚠️ delete failed: {e}")
+            return 0
+
+    def evict(self) -> int:
+        """מוחק רשומות שפג תוקפן, ואז את הפחות-בשימוש עד שחוזרים לגבולות."""
+        removed = 0
+        try:
+            conn = self._conn()
+            removed += conn.execute("DELETE FROM cache WHERE expires_at <= ?", (pytime.time(),)).rowcount
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+            if count > self.max_entries or total > self.max_bytes:
+                # מפנים 10% מעבר לגבול כדי לא לחזור לכאן בכל כתיבה
+                target_count = int(self.max_entries * 0.9)
+                target_bytes = int(self.max_bytes * 0.9)
+                rows = conn.execute("SELECT key, size FROM cache ORDER BY accessed_at ASC").fetchall()
+                victims = []
+                for key, size in rows:
+                    if count <= target_count and total <= target_bytes:
+                        break
+                    victims.append((key,))
+                    count -= 1
+                    total -= size
+                conn.executemany("DELETE FROM cache WHERE key = ?", victims)
+                removed += len(victims)
+        except sqlite3.Error as e:
+            print(f"[L2] ⚠️ evict failed: {e}")
+        if removed:
+            SHARED_CACHE_OPS.inc(removed, tier="l2", op="evict", outcome="ok")
+        return removed
+
+    def stats(self) -> dict:
+        try:
+            count, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        except sqlite3.Error:
+            count, total = None, None
+        return {"path": self.path, "entries": count, "bytes": total,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+
+class TieredCache:
+    """L1 → L2 → (המקור). ערכים הם str (UTF-8 ב-L2)."""
+
+    def __init__(self, l1: Optional[MemoryLRU] = None, l2: Optional[SQLiteSharedCache] = None):
+        self.l1 = l1 or MemoryLRU()
+        self.l2 = l2 if l2 is not None else SQLiteSharedCache()
+
+    def get(self, key: str):
+        """מחזיר (value, tier) – tier הוא "memory" / "l2" / None."""
+        value = self.l1.get(key)
+        if value is not None:
+            SHARED_CACHE_OPS.inc(tier="memory", op="get", outcome="hit")
+            return value, "memory"
+        raw = self.l2.get(key)
+        if raw is not None:
+            SHARED_CACHE_OPS.inc(tier="l2", op="get", outcome="hit")
+            value = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            self.l1.set(key, value)
+            return value, "l2"
+        SHARED_CACHE_OPS.inc(tier="l2", op="get", outcome="miss")
+        return None, None
+
+    def set(self, key: str, value: str, ttl_sec: float) -> None:
+        if ttl_sec <= 0:
+            return
+        self.l1.set(key, value, ttl_sec)
+        self.l2.set(key, value.encode("utf-8"), ttl_sec)
+
+    def delete_prefix(self, prefix: str) -> int:
+        self.l1.delete_prefix(prefix)
+        return self.l2.delete_prefix(prefix)
+
+    def stats(self) -> dict:
+        return {"l1_entries": len(self.l1), "l1_max": self.l1.maxsize, "l2": self.l2.stats()}
+
+
+SHARED_CACHE = TieredCache()
@@ -586,6 +586,16 @@
     }
 
     // --- Submit ---
+    // 202 = הניתוח רץ ב-lane נפרד בשרת; מושכים את התוצאה מ-/jobs/<id>
+    async function waitForJob(res, data) {
+        while (res.status === 202 && data && data.job_id) {
+            await new Promise(resolve => setTimeout(resolve, data.poll_after_ms || 1500));
+            res = await fetch(data.poll_url || `/jobs/${encodeURIComponent(data.job_id)}`);
+            data = await res.json();
+        }
+        return { res, data };
+    }
+
     async function handleSubmit(e) {
         e.preventDefault();
 
@@ -617,12 +627,13 @@
 
         setSubmitting(true);
         try {
-            const res = await fetch('/advisor_api', {
+            let res = await fetch('/advisor_api', {
                 method: 'POST',
                 headers: {'Content-Type': 'application/json'},
                 body: JSON.stringify(payload)
             });
-            const data = await res.json();
+            let data = await res.json();
+            ({ res, data } = await waitForJob(res, data));
             if (!res.ok || data.error) {
                 if (errorEl) {
                     errorEl.textContent =
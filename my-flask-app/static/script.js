@@ -132,6 +132,100 @@
         yearSelect.disabled = false;
     }
 
+    // חיפוש מהיר: השלמה מ-/api/catalog/suggest (שגיאות כתיב, עברית, i35 / Elantra)
+    // ובחירה ממלאת את היצרן/דגם הקנוניים – אותו מפתח מטמון כמו בחירה ידנית
+    const searchInput = document.getElementById('car-search');
+    const searchOptions = document.getElementById('car-search-options');
+    let searchResults = [];
+    let searchTimer = null;
+    let searchSeq = 0;
+
+    async function fetchSuggestions(q, make) {
+        const params = new URLSearchParams({ q, limit: '8' });
+        if (make) params.set('make', make);
+        try {
+            const res = await fetch(`/api/catalog/suggest?${params.toString()}`);
+            if (!res.ok) return [];
+            const data = await res.json();
+            return Array.isArray(data.results) ? data.results : [];
+        } catch (err) {
+            console.error('[SUGGEST]', err);
+            return [];
+        }
+    }
+
+    function isCanonical(make, model) {
+        return (MODEL_MAP[make] || []).some(m => m.name === model);
+    }
+
+    function applySuggestion(item) {
+        if (!item || !makeSelect || !MODEL_MAP[item.make]) return false;
+        makeSelect.value = item.make;
+        populateModelsForMake(item.make);
+        if (item.model && isCanonical(item.make, item.model)) {
+            modelSelect.value = item.model;
+            populateYearsForModel(item.make, item.model);
+        }
+        return true;
+    }
+
+    function renderSuggestions(items) {
+        searchResults = items;
+        if (!searchOptions) return;
+        searchOptions.innerHTML = '';
+        items.forEach(item => {
+            const opt = document.createElement('option');
+            opt.value = item.label;
+            searchOptions.appendChild(opt);
+        });
+    }
+
+    // התאמה בטוחה בלבד: exact/prefix, או תוצאה פאזית יחידה
+    function confidentMatch(items) {
+        if (!items.length) return null;
+        if (items[0].match !== 'fuzzy' || items.length === 1) return items[0];
+        return null;
+    }
+
+    function onSearchInput() {
+        const q = searchInput.value.trim();
+        const picked = searchResults.find(item => item.label === q);
+        if (picked) {
+            applySuggestion(picked);
+            return;
+        }
+        clearTimeout(searchTimer);
+        if (!q) {
+            renderSuggestions([]);
+            return;
+        }
+        searchTimer = setTimeout(async () => {
+            const seq = ++searchSeq;
+            const items = await fetchSuggestions(q);
+            if (seq === searchSeq) renderSuggestions(items);
+        }, 120);
+    }
+
+    async function onSearchCommit() {
+        const q = searchInput.value.trim();
+        if (!q) return;
+        const picked = searchResults.find(item => item.label === q)
+            || confidentMatch(await fetchSuggestions(q));
+        if (picked && applySuggestion(picked)) {
+            searchInput.value = picked.label;
+        }
+    }
+
+    // לפני /analyze: יצרן/דגם שלא מהקטלוג (למשל שהוזנו מבחוץ) נצמדים לשם הקנוני
+    async function snapToCatalog(payload) {
+        if (!payload.make || !payload.model || isCanonical(payload.make, payload.model)) return payload;
+        const match = confidentMatch(await fetchSuggestions(payload.model, payload.make));
+        if (match && match.model) {
+            return { ...payload, make: match.make, model: match.model };
+        }
+        return payload;
+    }
+
     function setSubmitting(isSubmitting) {
         if (!submitBtn) return;
         const spinner = submitBtn.querySelector('.spinner');
@@ -321,11 +415,21 @@
         return payload;
     }
 
+    // 202 = הניתוח רץ ב-lane נפרד בשרת; מושכים את התוצאה מ-/jobs/<id>
+    async function waitForJob(res, data) {
+        while (res.status === 202 && data && data.job_id) {
+            await new Promise(resolve => setTimeout(resolve, data.poll_after_ms || 1500));
+            res = await fetch(data.poll_url || `/jobs/${encodeURIComponent(data.job_id)}`);
+            data = await res.json();
+        }
+        return { res, data };
+    }
+
     async function handleSubmit(e) {
         e.preventDefault();
         if (!validateLegal()) return;
 
-        const payload = collectFormData();
+        let payload = collectFormData();
         if (!payload.make || !payload.model || !payload.year) {
             alert('נא למלא יצרן, דגם ושנתון.');
             return;
@@ -333,14 +437,16 @@
 
         setSubmitting(true);
         try {
-            const res = await fetch('/analyze', {
+            payload = await snapToCatalog(payload);
+            let res = await fetch('/analyze', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
                 body: JSON.stringify(payload)
             });
-            const data = await res.json();
+            let data = await res.json();
+            ({ res, data } = await waitForJob(res, data));
             if (!res.ok || data.error) {
                 alert(data.error || 'שגיאה בשרת');
                 return;
@@ -385,6 +491,18 @@
             });
         }
 
+        if (searchInput) {
+            searchInput.addEventListener('input', onSearchInput);
+            searchInput.addEventListener('change', onSearchCommit);
+            searchInput.addEventListener('keydown', (e) => {
+                // Enter בשדה החיפוש בוחר רכב ולא שולח את הטופס
+                if (e.key === 'Enter') {
+                    e.preventDefault();
+                    onSearchCommit();
+                }
+            });
+        }
+
         if (form) {
             form.addEventListener('submit', handleSubmit);
         }
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# ===================================================================
+# Workload model + replay מתוך SearchHistory / AdvisorHistory
+#
+#   flask --app app workload-extract --out workload.json --days 90
+#   python workload.py simulate workload.json --cache-days 45 --cache-size 5000
+#   python workload.py replay workload.json --target https://staging... \
+#       --cookie "session=..." --speedup 120 --duration-hours 24
+#
+# המודל אנונימי: אין user_id / email / פרופיל אישי – רק מפתחות רכב,
+# קצב הגעה לפי שעה ביום ומרווחי חזרה על אותו מפתח.
+# שימו לב: SearchHistory נשמר רק בהחמצות מטמון, ולכן פופולריות מפתחות
+# שנענים מהמטמון מוערכת בחסר (חזרות בתוך MAX_CACHE_DAYS לא נרשמות).
+# ===================================================================
+
+import argparse
+import json
+import math
+import random
+import threading
+import time as pytime
+import urllib.error
+import urllib.request
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+KEY_FIELDS = ("make", "model", "year", "mileage_range", "fuel_type", "transmission")
+INTERVAL_BUCKETS_SEC = [3600, 6 * 3600, 86400, 3 * 86400, 7 * 86400, 14 * 86400, 30 * 86400, 45 * 86400,
+                        60 * 86400, 90 * 86400, float("inf")]
+
+
+def _quantiles(values: List[float], points=(10, 50, 90, 99)) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    out = {}
+    for p in points:
+        out[f"p{p}"] = values[min(len(values) - 1, int(len(values) * p / 100))] if values else None
+    return out
+
+
+# ==================================
+# === Extract ===
+# ==================================
+def extract_workload(SearchHistory, AdvisorHistory, days: int = 90, batch_size: int = 2000) -> dict:
+    """בונה מודל עומס אנונימי. רץ בתוך app context; קורא ב-yield_per (זיכרון קבוע)."""
+    since = datetime.now() - timedelta(days=days)
+
+    key_counts: Counter = Counter()
+    last_seen: Dict[tuple, datetime] = {}
+    intervals: List[float] = []
+    hourly = [0] * 24
+    active_days = set()
+    first_ts = last_ts = None
+    total = 0
+
+    rows = (
+        SearchHistory.query
+        .with_entities(SearchHistory.timestamp, *[getattr(SearchHistory, f) for f in KEY_FIELDS])
+        .filter(SearchHistory.timestamp >= since)
+        .order_by(SearchHistory.timestamp.asc())
+        .yield_per(batch_size)
+    )
+    for row in rows:
+        ts = row[0]
+        key = tuple(row[1:])
+        total += 1
+        key_counts[key] += 1
+        hourly[ts.hour] += 1
+        active_days.add(ts.date())
+        if key in last_seen:
+            intervals.append((ts - last_seen[key]).total_seconds())
+        last_seen[key] = ts
+        first_ts = first_ts or ts
+        last_ts = ts
+
+    advisor_hourly = [0] * 24
+    advisor_total = 0
+    for (ts,) in (
+        AdvisorHistory.query.with_entities(AdvisorHistory.timestamp)
+        .filter(AdvisorHistory.timestamp >= since)
+        .yield_per(batch_size)
+    ):
+        advisor_total += 1
+        advisor_hourly[ts.hour] += 1
+        active_days.add(ts.date())
+
+    n_days = max(1, len(active_days))
+    histogram = [0] * len(INTERVAL_BUCKETS_SEC)
+    for iv in intervals:
+        for i, bound in enumerate(INTERVAL_BUCKETS_SEC):
+            if iv <= bound:
+                histogram[i] += 1
+                break
+
+    return {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "source": {
+            "days_requested": days,
+            "active_days": n_days,
+            "from": first_ts.isoformat() if first_ts else None,
+            "to": last_ts.isoformat() if last_ts else None,
+            "searches": total,
+            "advisor_requests": advisor_total,
+            "distinct_keys": len(key_counts),
+        },
+        "keys": [
+            dict(zip(KEY_FIELDS, key), weight=count)
+            for key, count in key_counts.most_common()
+        ],
+        "arrivals_per_hour": {
+            "analyze": [round(c / n_days, 4) for c in hourly],
+            "advisor": [round(c / n_days, 4) for c in advisor_hourly],
+        },
+        "repeat_intervals_sec": {
+            "count": len(intervals),
+            **_quantiles(intervals),
+            "bucket_bounds": [b if b != float("inf") else None for b in INTERVAL_BUCKETS_SEC],
+            "histogram": histogram,
+        },
+    }
+
+
+# ==================================
+# === Schedule ===
+# ==================================
+def generate_schedule(workload: dict, duration_hours: float, start_hour: int = 0,
+                      rate_multiplier: float = 1.0, seed: int = 0) -> List[tuple]:
+    """
+    מחזיר [(t_sec, kind, key_index)] – תהליך Poisson לפי קצב ההגעה לשעה,
+    ובחירת מפתח לפי הפופולריות.
+    """
+    rng = random.Random(seed)
+    keys = workload["keys"]
+    weights = [k["weight"] for k in keys]
+    cumulative = []
+    acc = 0
+    for w in weights:
+        acc += w
+        cumulative.append(acc)
+
+    events = []
+    total_sec = duration_hours * 3600
+    for kind in ("analyze", "advisor"):
+        rates = workload["arrivals_per_hour"].get(kind) or [0] * 24
+        t = 0.0
+        while t < total_sec:
+            hour = int((start_hour + t / 3600) % 24)
+            rate = rates[hour] * rate_multiplier / 3600.0
+            if rate <= 0:
+                t = (math.floor(t / 3600) + 1) * 3600
+                continue
+            t += rng.expovariate(rate)
+            if t >= total_sec:
+                break
+            key_index = None
+            if kind == "analyze" and keys:
+                r = rng.uniform(0, acc)
+                lo, hi = 0, len(cumulative) - 1
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    if cumulative[mid] < r:
+                        lo = mid + 1
+                    else:
+                        hi = mid
+                key_index = lo
+            events.append((t, kind, key_index))
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+# ==================================
+# === Simulate (offline) ===
+# ==================================
+def simulate_cache(workload: dict, schedule: List[tuple], cache_days: float, cache_size: int = 0) -> dict:
+    """
+    מודל מטמון: TTL של cache_days, ואופציונלית LRU בגודל cache_size (0 = ללא הגבלה).
+    מחזיר hit rate וכמה קריאות LLM היו נדרשות.
+    """
+    ttl = cache_days * 86400
+    cache: "OrderedDict[int, float]" = OrderedDict()
+    hits = misses = advisor = 0
+    for t, kind, key_index in schedule:
+        if kind != "analyze":
+            advisor += 1
+            continue
+        stored = cache.get(key_index)
+        if stored is not None and t - stored <= ttl:
+            hits += 1
+            cache.move_to_end(key_index)
+            continue
+        misses += 1
+        cache[key_index] = t
+        cache.move_to_end(key_index)
+        if cache_size and len(cache) > cache_size:
+            cache.popitem(last=False)
+    lookups = hits + misses
+    return {
+        "cache_days": cache_days,
+        "cache_size": cache_size,
+        "analyze_requests": lookups,
+        "cache_hits": hits,
+        "hit_rate": round(hits / lookups, 4) if lookups else None,
+        "llm_calls": misses + advisor,
+        "llm_calls_analyze": misses,
+        "llm_calls_advisor": advisor,
+    }
+
+
+# ==================================
+# === Replay (מול instance רץ) ===
+# ==================================
+def replay(workload: dict, schedule: List[tuple], target: str, cookie: str, speedup: float,
+           concurrency: int = 16, timeout: float = 130.0, advisor_payload: Optional[dict] = None) -> dict:
+    keys = workload["keys"]
+    stats = defaultdict(int)
+    latencies = {"analyze": [], "advisor": []}
+    lock = threading.Lock()
+
+    def send(kind: str, key_index: Optional[int]):
+        if kind == "analyze":
+            url = target.rstrip("/") + "/analyze"
+            payload = {f: keys[key_index][f] for f in KEY_FIELDS}
+        else:
+            url = target.rstrip("/") + "/advisor_api"
+            payload = advisor_payload or {"budget_min": 50000, "budget_max": 100000}
+        req = urllib.request.Request(
+            url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"), method="POST",
+            headers={"Content-Type": "application/json", "Cookie": cookie},
+        )
+        t0 = pytime.perf_counter()
+        status, body = 0, {}
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                status = resp.status
+                body = json.loads(resp.read().decode("utf-8") or "{}")
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = 0
+        dt = pytime.perf_counter() - t0
+        tag = str(body.get("source_tag", "")) if isinstance(body, dict) else ""
+        with lock:
+            latencies[kind].append(dt)
+            stats[f"{kind}_status_{status}"] += 1
+            if kind == "analyze" and status == 200:
+                if "מטמון" in tag:
+                    stats["cache_hits"] += 1
+                else:
+                    stats["llm_calls_analyze"] += 1
+            elif kind == "advisor" and status == 200:
+                stats["llm_calls_advisor"] += 1
+
+    started = pytime.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for t, kind, key_index in schedule:
+            delay = t / speedup - (pytime.perf_counter() - started)
+            if delay > 0:
+                pytime.sleep(delay)
+            pool.submit(send, kind, key_index)
+    wall = pytime.perf_counter() - started
+
+    analyze_ok = stats["cache_hits"] + stats["llm_calls_analyze"]
+    return {
+        "wall_sec": round(wall, 2),
+        "requests": len(schedule),
+        "hit_rate": round(stats["cache_hits"] / analyze_ok, 4) if analyze_ok else None,
+        "llm_calls": stats["llm_calls_analyze"] + stats["llm_calls_advisor"],
+        "counters": dict(stats),
+        "latency_ms": {
+            kind: {k: round(v * 1000, 1) if v is not None else None for k, v in _quantiles(vals, (50, 90, 99)).items()}
+            for kind, vals in latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Workload simulate / replay")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("simulate", "replay"):
+        p = sub.add_parser(name)
+        p.add_argument("workload")
+        p.add_argument("--duration-hours", type=float, default=24)
+        p.add_argument("--start-hour", type=int, default=0)
+        p.add_argument("--rate-multiplier", type=float, default=1.0, help="הגדלת עומס (x2, x10 ...)")
+        p.add_argument("--seed", type=int, default=0)
+        if name == "simulate":
+            p.add_argument("--cache-days", type=float, nargs="+", default=[45])
+            p.add_argument("--cache-size", type=int, nargs="+", default=[0])
+        else:
+            p.add_argument("--target", required=True)
+            p.add_argument("--cookie", default="", help="session cookie של משתמש בדיקות")
+            p.add_argument("--speedup", type=float, default=60)
+            p.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    with open(args.workload, encoding="utf-8") as f:
+        workload = json.load(f)
+    schedule = generate_schedule(workload, args.duration_hours, args.start_hour, args.rate_multiplier, args.seed)
+
+    if args.command == "simulate":
+        results = [
+            simulate_cache(workload, schedule, days, size)
+            for days in args.cache_days
+            for size in args.cache_size
+        ]
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print(f"[REPLAY] {len(schedule)} requests over {args.duration_hours}h at x{args.speedup}")
+        print(json.dumps(replay(workload, schedule, args.target, args.cookie, args.speedup, args.concurrency),
+                         ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()